@@ -0,0 +1,311 @@
+#!/usr/bin/env
+# purpose: streaming history weighted combination of Monte Carlo batch outputs
+
+from __future__ import division, print_function
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import rename, stat
+from shutil import copyfileobj
+from sys import argv
+from tempfile import TemporaryFile
+from time import time
+
+import numpy
+
+from dose_store import STORE_EXTENSION, write_store
+from parallel_gzip import gzip_member
+from py3ddose import (
+    DoseFile, _DoseArithmetic, _3ddose_header, _format_scientific
+    )
+
+
+def _next_slab(stream):
+    return next(stream, None)
+
+def _combine(weights, blocks, uncertainty):
+    # history weighted mean of the batch doses; the batches are independent,
+    # so their weighted absolute uncertainties add in quadrature. The sums
+    # are float64, as the squared absolute uncertainties of float32 slabs
+    # (about 1e-30 for doses of 1e-13) underflow, and are cast to the type
+    # of the slabs once
+    dtype = blocks[0][0].dtype
+    dose = numpy.zeros(blocks[0][0].shape, dtype=numpy.float64)
+    variance = numpy.zeros_like(dose) if uncertainty else None
+    for weight, (batch_dose, batch_uncertainty) in zip(weights, blocks):
+        weighted = numpy.multiply(batch_dose, weight, dtype=numpy.float64)
+        dose += weighted
+        if uncertainty:
+            weighted *= batch_uncertainty
+            weighted *= weighted
+            variance += weighted
+
+    if not uncertainty:
+        return dose.astype(dtype, copy=False), None
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        relative = numpy.sqrt(variance) / abs(dose)
+    relative[(dose == 0) | numpy.isnan(dose)] = 0.
+
+    return dose.astype(dtype, copy=False), relative.astype(dtype, copy=False)
+
+class BatchCombination(_DoseArithmetic):
+
+    """
+    Description:
+    History weighted mean of the dose files of a run split into independent
+    batches (e.g. egs_brachy runs on several cores with different seeds),
+    evaluated lazily like a DoseExpression. Batch i of N_i histories has
+    the weight N_i / sum(N); the relative uncertainty of the mean is
+    sqrt(sum((w_i * r_i * D_i)^2)) / D, the batch uncertainties being
+    independent, and 0 where the dose is 0.
+
+    The batches are opened without loading their dose and are streamed
+    together slab by slab, reading the next slab of every batch in a thread
+    pool, so that at most one slab (per block) of each batch is held in
+    memory. Regions, planes, histograms and the write methods all stream
+    this way; write_store (see dose_store) accepts the combination as is.
+
+    Inputs:
+    :param file_names: paths of the batch dose files, on the same grid
+    :type file_names: list
+    :param histories: number of histories of each batch (default: equal)
+    :type histories: list
+    :param threads: number of reading threads (default: all cores)
+    :type threads: int
+    :param dtype: type of the dose and uncertainty slabs
+    :type dtype: numpy.dtype
+    """
+
+    def __init__(self, file_names, histories=None, threads=None,
+            dtype=numpy.float64):
+        assert len(file_names) > 0, "nothing to combine"
+        if histories is None:
+            histories = [1.] * len(file_names)
+        assert len(histories) == len(file_names), \
+        "{0} history counts for {1} batches".format(
+            len(histories), len(file_names)
+            )
+        assert min(histories) > 0, "every batch needs histories"
+
+        # the batches are read in parallel with each other, so each one
+        # decompresses in a single thread
+        self.batches = [
+            DoseFile(file_name, load_dose=False, dtype=dtype, threads=1)
+            for file_name in file_names
+            ]
+        first = self.batches[0]
+        for batch in self.batches[1:]:
+            assert tuple(batch.shape) == tuple(first.shape), \
+            "cannot combine grids of shape {0} and {1}".format(
+                first.shape, batch.shape
+                )
+            for p, q in zip(first.positions, batch.positions):
+                assert numpy.allclose(p, q), \
+                "the grid bounds of {0} and {1} differ".format(
+                    first.file_name, batch.file_name
+                    )
+
+        self.file_name = None
+        self.histories = float(sum(histories))
+        self.weights = [n / self.histories for n in histories]
+        self.threads = min(threads or cpu_count(), len(self.batches))
+        self.shape = first.shape
+        self.size = first.size
+        self.positions = first.positions
+        self.dtype = first.dtype
+
+    @property
+    def grid_index(self):
+        return self.batches[0].grid_index
+
+    def _read(self, ranges, uncertainty=False):
+        pool = ThreadPool(self.threads)
+        try:
+            blocks = pool.map(
+                lambda batch: batch._read(ranges, uncertainty), self.batches
+                )
+        finally:
+            pool.close()
+            pool.join()
+        return _combine(self.weights, blocks, uncertainty)
+
+    def read_region(self, x_range=None, y_range=None, z_range=None,
+            uncertainty=False):
+        """
+        Combines a box of the batches (see DoseFile.read_region); with
+        uncertainty=True the combined relative uncertainty of the box is
+        returned instead of the dose.
+        """
+        dose, relative_uncertainty = self._read(
+            (x_range, y_range, z_range), uncertainty
+            )
+        return relative_uncertainty if uncertainty else dose
+
+    def iter_slabs(self, nz=1, load_uncertainty=False):
+        """
+        Combines the batches slab by slab (see DoseFile.iter_slabs), reading
+        the slabs of the batches in parallel.
+        """
+        streams = [
+            batch.iter_slabs(nz, load_uncertainty) for batch in self.batches
+            ]
+        pool = ThreadPool(self.threads)
+        try:
+            while True:
+                slabs = pool.map(_next_slab, streams)
+                if slabs[0] is None:
+                    break
+                dose, uncertainty = _combine(
+                    self.weights,
+                    [(slab[1], slab[2] if load_uncertainty else None)
+                     for slab in slabs],
+                    load_uncertainty
+                    )
+                if load_uncertainty:
+                    yield slabs[0][0], dose, uncertainty
+                else:
+                    yield slabs[0][0], dose
+        finally:
+            pool.close()
+            pool.join()
+            for stream in streams:
+                stream.close()
+
+    def write_3ddose(self, file_name, compress=True, precision=4, nz=None,
+            level=6):
+        """
+        Description:
+        Writes the combined dose and uncertainty in the .3ddose format (see
+        DoseFile.write_3ddose) in a single pass over the batches: the dose
+        block is written as it is combined while the formatted uncertainty
+        block is spooled to a temporary file and appended at the end. The
+        file is written under a scratch name and renamed when complete.
+
+        Inputs:
+        :param file_name: output path (conventionally ending in .3ddose.gz
+                          when compress=True)
+        :type file_name: str
+        :param compress: gzip the output
+        :type compress: bool
+        :param precision: digits after the decimal point of each value
+        :type precision: int
+        :param nz: z planes per slab; by default about 2**20 values per slab
+                   over all the batches
+        :type nz: int
+        :param level: zlib compression level
+        :type level: int
+        """
+
+        x, y, z = self.shape
+        if nz is None:
+            nz = max(1, 2 ** 20 // (x * y * len(self.batches)))
+
+        def encode(values):
+            # 3ddose blocks run fastest along x
+            text = _format_scientific(
+                values.transpose((2,1,0)), precision, line_length=x * y
+                )
+            return gzip_member(text, level) if compress else text
+
+        header = _3ddose_header(self.shape, self.positions)
+        scratch_name = file_name + '.tmp'
+        pool = ThreadPool(2)
+        try:
+            with open(scratch_name, 'wb') as out_file, \
+                    TemporaryFile() as spool:
+                out_file.write(
+                    gzip_member(header, level) if compress else header
+                    )
+                for __, dose, uncertainty in self.iter_slabs(nz, True):
+                    dose_data, uncertainty_data = pool.map(
+                        encode, (dose, uncertainty)
+                        )
+                    out_file.write(dose_data)
+                    spool.write(uncertainty_data)
+                spool.seek(0)
+                copyfileobj(spool, out_file)
+        finally:
+            pool.close()
+            pool.join()
+
+        rename(scratch_name, file_name)
+
+    def write_store(self, file_name, uncertainty=True, **options):
+        """
+        Writes the combined dose, and uncertainty, to a chunked store (see
+        dose_store.write_store, whose keyword arguments options are).
+        """
+        write_store(file_name, self, uncertainty, **options)
+
+def combine_batches(file_names, output_name, histories=None, threads=None,
+        **options):
+    """
+    Description:
+    Combines the dose files of the batches of a run (see BatchCombination)
+    into a single .3ddose(.gz) file or, if output_name ends in
+    STORE_EXTENSION, a chunked store, and prints the time taken.
+
+    Inputs:
+    :param file_names: paths of the batch dose files
+    :type file_names: list
+    :param output_name: path of the combined file
+    :type output_name: str
+    :param histories: number of histories of each batch (default: equal)
+    :type histories: list
+    :param threads: number of reading threads (default: all cores)
+    :type threads: int
+    :param options: keyword arguments of BatchCombination.write_3ddose or
+                    of dose_store.write_store
+    :type options: dict
+
+    Outputs:
+    :param combination: the combination, for further queries
+    :type combination: BatchCombination
+    """
+
+    start = time()
+    combination = BatchCombination(file_names, histories, threads)
+    if output_name.endswith(STORE_EXTENSION):
+        combination.write_store(output_name, **options)
+    else:
+        options.setdefault('compress', output_name.endswith('.gz'))
+        combination.write_3ddose(output_name, **options)
+    print("{0}: {1} batches, {2:.1f} s, {3:.1f} MB".format(
+        output_name, len(file_names), time() - start,
+        stat(output_name).st_size / 2 ** 20
+        ))
+
+    return combination
+
+def main(args):
+    """
+    Description:
+    Combines the dose files of the batches of a run. Usage:
+
+        python batch_combine.py [--histories=N1,N2,...] [--lzma]
+            output.3ddose.gz batch_1.3ddose.gz batch_2.3ddose.gz ...
+
+    The output is a chunked store (lzma compressed with --lzma) if its name
+    ends in STORE_EXTENSION; the history counts default to equal batches.
+    """
+
+    options = {}
+    histories = None
+    for arg in args:
+        if arg.startswith('--histories='):
+            histories = [float(n) for n in arg.split('=', 1)[1].split(',')]
+        elif arg == '--lzma':
+            options['compression'] = 'lzma'
+    file_names = [arg for arg in args if not arg.startswith('--')]
+    assert len(file_names) > 1, main.__doc__
+    assert file_names[0].endswith(STORE_EXTENSION) or not options, \
+    "--lzma only applies to chunked stores"
+
+    combine_batches(file_names[1:], file_names[0], histories, **options)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
@@ -0,0 +1,1245 @@
+#!/usr/bin/env python
+# purpose: timing the 3ddose loading and processing routines on synthetic grids
+
+from __future__ import division, print_function
+
+from multiprocessing import cpu_count
+from sys import argv
+from os.path import getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from gzip import open as gOpen
+
+import numpy
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+try:
+    from scipy.interpolate import RegularGridInterpolator
+except ImportError:
+    RegularGridInterpolator = None
+
+from batch_combine import BatchCombination
+from dose_basis import get_basis
+from dose_cache import DoseCache
+from dose_columns import write_binary_columns, write_columns
+from dose_summary import load_summary
+from dwell_optimizer import DoseObjective, evaluate_objectives, optimize_weights
+from plan_sweep import sweep_plans
+from isodose import isodose_volumes, clear_memory
+from superposition import superpose
+from interpolation import interpolate_grid, interpolate_points
+from py3ddose import (
+    DoseFile, AxisIndex, position_to_index,
+    dose_to_volume, _mmap_npz_member
+    )
+
+
+def legacy_load_3ddose(file_name, load_uncertainty=False):
+    """
+    Description:
+    Line-by-line 3ddose parser that DoseFile used before the bulk parser. Kept
+    here only as the baseline the benchmarks are measured against.
+
+    Inputs:
+    :param file_name: path to the dose file
+    :type file_name: str
+    :param load_uncertainty: also parse the uncertainty block
+    :type load_uncertainty: bool
+
+    Outputs:
+    :param dose: dose array in (x, y, z) order
+    :type dose: numpy.ndarray
+    :param uncertainty: uncertainty array in (x, y, z) order or None
+    :type uncertainty: numpy.ndarray
+    """
+
+    if file_name[-3:] == '.gz':
+        with gOpen(file_name, 'rb') as data_file:
+            data = data_file.read().split(b'\n')
+    else:
+        with open(file_name, 'rb') as data_file:
+            data = data_file.read().split(b'\n')
+
+    cur_line = 0
+    x, y, z = map(int, data[cur_line].split())
+    size = x * y * z
+    cur_line += 1
+
+    for n_voxels in (x, y, z):
+        bounds = []
+        while len(bounds) < n_voxels:
+            bounds += list(map(float, data[cur_line].split()))
+            cur_line += 1
+
+    blocks = []
+    for __ in range(2 if load_uncertainty else 1):
+        block = []
+        while len(block) < size:
+            block += list(map(float, data[cur_line].split()))
+            cur_line += 1
+        blocks.append(numpy.array(block).reshape((z, y, x)).transpose((2, 1, 0)))
+
+    if load_uncertainty:
+        return blocks[0], blocks[1]
+    return blocks[0], None
+
+
+def write_synthetic_3ddose(file_name, extent=10.0, voxel_size=0.1, seed=0,
+        source=(0., 0., 0.)):
+    """
+    Description:
+    Writes a cubic 3ddose file centred on the origin filled with an inverse
+    square like dose and random uncertainties, in the layout egs_brachy uses
+    (one line per bounds axis, one line per z slice for each data block).
+
+    Inputs:
+    :param file_name: output path; gzipped if it ends in .gz
+    :type file_name: str
+    :param extent: side length of the cube in cm
+    :type extent: float
+    :param voxel_size: voxel side length in cm
+    :type voxel_size: float
+    :param seed: seed for the random uncertainties
+    :type seed: int
+    :param source: x, y and z coordinates of the point the dose falls off
+                   from, in cm
+    :type source: tuple
+
+    Outputs:
+    :param shape: number of voxels along (x, y, z)
+    :type shape: tuple
+    """
+
+    n_voxels = int(round(extent / voxel_size))
+    bounds = numpy.linspace(-extent / 2, extent / 2, n_voxels + 1)
+    mid = (bounds[:-1] + bounds[1:]) / 2
+    random = numpy.random.RandomState(seed)
+
+    opener = gOpen if file_name[-3:] == '.gz' else open
+    with opener(file_name, 'wb') as out_file:
+        out_file.write('{0} {0} {0}\n'.format(n_voxels).encode())
+        for __ in range(3):
+            out_file.write(
+                (' '.join('{0:.4f}'.format(b) for b in bounds) + '\n').encode()
+                )
+        r2 = (
+            (mid[:, None] - source[0]) ** 2 + (mid[None, :] - source[1]) ** 2
+            )
+        for block in range(2):
+            for z in mid:
+                if block == 0:
+                    values = 1e-13 / (r2 + (z - source[2]) ** 2 + 0.01)
+                else:
+                    values = random.uniform(0.001, 0.2, r2.shape)
+                # 3ddose blocks run fastest along x
+                numpy.savetxt(out_file, values.T.reshape(1, -1), fmt='%.4E')
+
+    return (n_voxels, n_voxels, n_voxels)
+
+
+def time_call(function, *args, **kwargs):
+    """
+    Description:
+    Calls function once and reports how long it took. Pass trace=True to also
+    record the peak memory allocated during the call where tracemalloc is
+    available (tracing slows pure python code down, so timings taken with it
+    should not be compared).
+
+    Outputs:
+    :param elapsed: wall clock time in seconds
+    :type elapsed: float
+    :param peak: peak traced allocation in MB (nan if not traced)
+    :type peak: float
+    :param result: return value of the call
+    :type result: object
+    """
+
+    trace = kwargs.pop('trace', False) and tracemalloc is not None
+
+    if trace:
+        tracemalloc.start()
+    start = time()
+    result = function(*args, **kwargs)
+    elapsed = time() - start
+    peak = numpy.nan
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_load(work_dir, voxel_sizes, extent, run_legacy=True, trace=False):
+    """
+    Description:
+    Compares the line-by-line loader to the bulk DoseFile parser on plain
+    and gzipped files for each voxel size and checks they agree.
+    """
+
+    print('== 3ddose loading (extent = {0} cm) =='.format(extent))
+    for voxel_size in voxel_sizes:
+        for suffix in ('.3ddose', '.3ddose.gz'):
+            file_name = join(
+                work_dir, 'bench_{0}mm{1}'.format(voxel_size * 10, suffix)
+                )
+            shape = write_synthetic_3ddose(file_name, extent, voxel_size)
+
+            new_time, new_peak, dose_file = time_call(
+                DoseFile, file_name, load_uncertainty=True, trace=trace
+                )
+            line = '{0:>4} mm {1:<11} {2:>11}  bulk {3:7.2f} s'.format(
+                voxel_size * 10, suffix, 'x'.join(map(str, shape)), new_time
+                )
+            if trace:
+                line += ' {0:8.1f} MB'.format(new_peak)
+
+            if run_legacy:
+                old_time, old_peak, (dose, uncertainty) = time_call(
+                    legacy_load_3ddose, file_name, load_uncertainty=True,
+                    trace=trace
+                    )
+                assert numpy.array_equal(dose, dose_file.dose)
+                assert numpy.array_equal(uncertainty, dose_file.uncertainty)
+                line += '  legacy {0:7.2f} s'.format(old_time)
+                if trace:
+                    line += ' {0:8.1f} MB'.format(old_peak)
+                else:
+                    line += '  ({0:.1f}x)'.format(old_time / new_time)
+            print(line)
+
+
+def bench_cache(work_dir, voxel_sizes, extent):
+    """
+    Description:
+    Times the first load of a gzipped file with cache=True (parse and write
+    the sidecar cache) against later loads that memory map the cache.
+    """
+
+    print('== sidecar cache (extent = {0} cm) =='.format(extent))
+    for voxel_size in voxel_sizes:
+        file_name = join(
+            work_dir, 'bench_cache_{0}mm.3ddose.gz'.format(voxel_size * 10)
+            )
+        shape = write_synthetic_3ddose(file_name, extent, voxel_size)
+
+        first_time, __, __ = time_call(
+            DoseFile, file_name, load_uncertainty=True, cache=True
+            )
+        cached_time, __, dose_file = time_call(
+            DoseFile, file_name, load_uncertainty=True, cache=True
+            )
+        print('{0:>4} mm {1:>11}  first {2:7.2f} s  cached {3:9.4f} s'.format(
+            voxel_size * 10, 'x'.join(map(str, shape)), first_time, cached_time
+            ))
+
+
+def bench_decompress(work_dir, voxel_sizes, extent):
+    """
+    Description:
+    Decompression plus parse throughput (MB of decompressed text per second)
+    of a single member .3ddose.gz (as written by gzip/egs_brachy) and of the
+    multi-member file written by write_3ddose. The baseline reads the whole
+    file with gzip.open().read() before parsing it; DoseFile overlaps
+    inflating with parsing and inflates known members in parallel.
+    """
+
+    print('== gzip decompression (extent = {0} cm) =='.format(extent))
+    for voxel_size in voxel_sizes:
+        single_name = join(
+            work_dir, 'bench_single_{0}mm.3ddose.gz'.format(voxel_size * 10)
+            )
+        shape = write_synthetic_3ddose(single_name, extent, voxel_size)
+        multi_name = join(
+            work_dir, 'bench_multi_{0}mm.3ddose.gz'.format(voxel_size * 10)
+            )
+        DoseFile(single_name, load_uncertainty=True).write_3ddose(multi_name)
+
+        for label, file_name in (('single', single_name), ('multi', multi_name)):
+            with gOpen(file_name, 'rb') as data_file:
+                text_size = len(data_file.read()) / 2 ** 20
+
+            def baseline():
+                with gOpen(file_name, 'rb') as data_file:
+                    return numpy.fromstring(data_file.read(), sep=' ')
+
+            old_time, __, __ = time_call(baseline)
+            line = '{0:>4} mm {1:>11} {2:<6} {3:7.1f} MB  read+parse {4:6.1f} MB/s'.format(
+                voxel_size * 10, 'x'.join(map(str, shape)), label, text_size,
+                text_size / old_time
+                )
+            for threads in (1, None):
+                new_time, __, __ = time_call(
+                    DoseFile, file_name, load_uncertainty=True,
+                    threads=threads
+                    )
+                line += '  threads={0} {1:6.1f} MB/s ({2:.2f}x)'.format(
+                    threads or 'all', text_size / new_time, old_time / new_time
+                    )
+            print(line)
+
+
+def bench_superposition(work_dir, extent, voxel_size=0.05, references=11,
+        trace=False):
+    """
+    Description:
+    Times the streamed superposition of reference dose files, with float64
+    and float32 accumulators and in a process pool, against loading every
+    file (see tests/test_superposition.py for the checks). With trace=True
+    it also reports the peak memory.
+    """
+
+    def superpose_loaded(file_names, weights):
+        # the loop construct_dose used, with separate accumulators
+        dose = variance = 0.
+        for weight, file_name in zip(weights, file_names):
+            reference = DoseFile(file_name, load_uncertainty=True)
+            dose = dose + weight * reference.dose
+            variance = variance + (
+                weight * reference.uncertainty * reference.dose
+                ) ** 2
+        return dose, numpy.sqrt(variance)
+
+    print('== superposition of {0} references (extent = {1} cm) =='.format(
+        references, extent
+        ))
+    file_names = []
+    for number in range(references):
+        file_name = join(work_dir, 'bench_reference_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(file_name, extent, voxel_size, seed=number)
+        file_names.append(file_name)
+    weights = numpy.linspace(0.3, 1.0, references)
+
+    elapsed, peak, __ = time_call(
+        superpose_loaded, file_names, weights, trace=trace
+        )
+    line = '  load each: {0:.3f} s'.format(elapsed)
+    if trace:
+        line += ', peak {0:.1f} MB'.format(peak)
+    print(line)
+
+    for dtype in (numpy.float64, numpy.float32):
+        elapsed, peak, __ = time_call(
+            superpose, file_names, weights, dtype=dtype, trace=trace
+            )
+        line = '  streamed ({0}): {1:.3f} s'.format(
+            numpy.dtype(dtype).name, elapsed
+            )
+        if trace:
+            line += ', peak {0:.1f} MB'.format(peak)
+        print(line)
+
+    # the files parsed in a process pool, adding into shared memory
+    elapsed, __, __ = time_call(
+        superpose, file_names, weights, processes=None, report=True
+        )
+    print('  pooled ({0} processes): {1:.3f} s'.format(
+        min(cpu_count(), references), elapsed
+        ))
+
+
+def bench_basis(work_dir, extent, voxel_size=0.05, references=11):
+    """
+    Description:
+    Times building the float32 dose basis of a set of reference files and
+    superposing new weight vectors from it against streaming the files for
+    each weight vector, and checks both agree to float32 precision.
+    """
+
+    print('== dose basis of {0} references (extent = {1} cm) =='.format(
+        references, extent
+        ))
+    file_names = []
+    for number in range(references):
+        file_name = join(work_dir, 'bench_basis_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(file_name, extent, voxel_size, seed=number)
+        file_names.append(file_name)
+    weights = numpy.linspace(0.3, 1.0, references)
+
+    elapsed, __, (dose, uncertainty, __) = time_call(
+        superpose, file_names, weights
+        )
+    print('     streamed: {0:.3f} s'.format(elapsed))
+
+    basis_dir = join(work_dir, 'bench_basis')
+    elapsed, __, basis = time_call(get_basis, file_names, basis_dir)
+    print('  build basis: {0:.3f} s'.format(elapsed))
+    elapsed, __, basis = time_call(get_basis, file_names, basis_dir)
+    print('   open basis: {0:.4f} s'.format(elapsed))
+
+    elapsed, __, (basis_dose, basis_uncertainty, __) = time_call(
+        basis.superpose, weights
+        )
+    print('  superpose from basis: {0:.3f} s'.format(elapsed))
+    assert abs(basis_dose - dose).max() <= 1e-6 * dose.max()
+    assert abs(basis_uncertainty - uncertainty).max() <= (
+        1e-6 * uncertainty.max()
+        )
+
+
+def bench_point_basis(work_dir, extent, voxel_size=0.1, references=11,
+        points=20):
+    """
+    Description:
+    Times interpolating the reference doses at a set of points once (see
+    DoseBasis.point_basis) and superposing the dose there (see
+    tests/test_dose_basis.py for the checks).
+    """
+
+    print('== point basis of {0} references (extent = {1} cm) =='.format(
+        references, extent
+        ))
+    file_names = []
+    for number, z in enumerate(
+            numpy.linspace(-extent / 4, extent / 4, references)):
+        file_name = join(work_dir, 'bench_points_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(
+            file_name, extent, voxel_size, seed=number, source=(0., 0., z)
+            )
+        file_names.append(file_name)
+    basis = get_basis(file_names, join(work_dir, 'bench_points_basis'))
+    weights = numpy.linspace(0.3, 1.0, references)
+    # some of them outside the voxel centres
+    positions = numpy.random.RandomState(0).uniform(
+        -0.55 * extent, 0.55 * extent, (points, 3)
+        )
+
+    elapsed, __, point_basis = time_call(basis.point_basis, positions)
+    print('  interpolate {0} points: {1:.4f} s'.format(points, elapsed))
+    repeats = 1000
+    start = time()
+    for __ in range(repeats):
+        point_basis.superpose(weights)
+    print('  superpose: {0:.1f} us'.format((time() - start) / repeats * 1e6))
+
+
+def bench_optimizer(work_dir, extent, voxel_size=0.1, references=11):
+    """
+    Description:
+    Times optimize_weights for targets prescribed the dose of known dwell
+    weights, for references along the z axis, with and without an upper
+    limit on a box next to the sources (see tests/test_dwell_optimizer.py
+    for the checks).
+    """
+
+    print('== dwell weight optimizer of {0} references (extent = {1} cm) =='
+        .format(references, extent))
+    dwell_z = numpy.linspace(-extent / 4, extent / 4, references)
+    file_names = []
+    for number, z in enumerate(dwell_z):
+        file_name = join(work_dir, 'bench_dwell_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(
+            file_name, extent, voxel_size, seed=number, source=(0., 0., z)
+            )
+        file_names.append(file_name)
+    basis = get_basis(file_names, join(work_dir, 'bench_dwell_basis'))
+    scale = 1e13
+
+    # targets 1 cm off the line of dwell positions, prescribed the dose of
+    # the known weights
+    true_weights = numpy.linspace(1.0, 0.3, references)
+    points = numpy.column_stack((
+        numpy.ones(4 * references), numpy.zeros(4 * references),
+        numpy.linspace(-extent / 4, extent / 4, 4 * references)
+        ))
+    prescriptions = DoseFile(file_names[0], load_dose=False).grid_index
+    targets = [
+        DoseObjective('target', dose * scale, points=[point])
+        for point, dose in zip(points, basis.voxel_doses(
+            basis.flat_index(*prescriptions.voxel(*points.T))
+            ).dot(true_weights))
+        ]
+    elapsed, __, weights = time_call(
+        optimize_weights, basis, targets, scale, tolerance=1e-12
+        )
+    print('  {0} targets: {1:.3f} s'.format(len(targets), elapsed))
+
+    # a limit on the far side of the sources, below what the targets give
+    limit = 0.8 * evaluate_objectives(basis, [DoseObjective(
+        'maximum', 0., box=((-1.5, -0.5), (-0.5, 0.5), (-1., 1.))
+        )], weights, scale)[0][5]
+    organ = DoseObjective(
+        'maximum', limit, box=((-1.5, -0.5), (-0.5, 0.5), (-1., 1.)),
+        weight=1e6
+        )
+    elapsed, __, weights = time_call(
+        optimize_weights, basis, targets + [organ], scale
+        )
+    print('  with an upper limit: {0:.3f} s'.format(elapsed))
+
+
+def bench_sweep(work_dir, extent, voxel_size=0.05, references=11, plans=32):
+    """
+    Description:
+    Times the summary metrics of many weight vectors in one pass over a
+    dose basis (see plan_sweep) against superposing each one from the basis
+    and measuring its grid, and checks both agree to float32 precision.
+    """
+
+    print('== sweep of {0} plans over {1} references (extent = {2} cm) =='
+        .format(plans, references, extent))
+    file_names = []
+    for number, z in enumerate(
+            numpy.linspace(-extent / 4, extent / 4, references)):
+        file_name = join(work_dir, 'bench_sweep_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(
+            file_name, extent, voxel_size, seed=number, source=(0., 0., z)
+            )
+        file_names.append(file_name)
+    basis = get_basis(file_names, join(work_dir, 'bench_sweep_basis'))
+
+    scale = 1e13
+    weights = numpy.random.RandomState(0).uniform(0.2, 1.0, (plans, references))
+    points = numpy.array([[1., 0., 0.], [0., 2., 1.], [-0.5, 0.5, -1.]]) * (
+        extent / 10.
+        )
+    levels = [2., 5., 10.]
+
+    elapsed, __, (max_dose, point_doses, volumes) = time_call(
+        sweep_plans, basis, weights, points, levels, None, scale
+        )
+    print('  one pass: {0:.3f} s'.format(elapsed))
+
+    def each_plan():
+        metrics = []
+        index = DoseFile(file_names[0], load_dose=False).grid_index
+        ix, iy, iz = index.voxel(*points.T)
+        voxel_volume = numpy.prod([axis.step for axis in index.bounds])
+        for plan_weights in weights:
+            dose = basis.superpose(plan_weights, False)[0] * scale
+            metrics.append((
+                dose.max(), dose[ix, iy, iz],
+                [(dose >= level).sum() * voxel_volume for level in levels]
+                ))
+        return metrics
+
+    elapsed, __, metrics = time_call(each_plan)
+    print('  plan by plan: {0:.3f} s'.format(elapsed))
+    for plan, (expected_max, expected_points, expected_volumes) in enumerate(
+            metrics):
+        assert abs(max_dose[plan] - expected_max) <= 1e-5 * expected_max
+        assert numpy.allclose(point_doses[plan], expected_points, rtol=1e-5)
+        # voxels within float32 rounding of a level may fall either side
+        assert numpy.allclose(
+            volumes[plan], expected_volumes, rtol=1e-3, atol=voxel_size ** 3
+            )
+
+
+def bench_expressions(work_dir, extent, voxel_size=0.1):
+    """
+    Description:
+    Times reading one plane of a file scaled three times in place, which
+    only updates its scale, against scaling the loaded array (see
+    tests/test_expressions.py for the checks of the lazy arithmetic).
+    """
+
+    print('== lazy dose arithmetic (extent = {0} cm) =='.format(extent))
+    file_name = join(work_dir, 'bench_expression.3ddose')
+    write_synthetic_3ddose(file_name, extent, voxel_size, seed=1)
+    loaded = DoseFile(file_name)
+
+    # the in place passes the analysis scripts used to make
+    scaled = loaded.dose.copy()
+    start = time()
+    scaled *= 3
+    scaled /= 5
+    scaled *= 100
+    plane = scaled[:, :, 0]
+    eager_time = time() - start
+
+    lazy = loaded
+    start = time()
+    lazy *= 3
+    lazy /= 5
+    lazy *= 100
+    lazy_plane = lazy.read_plane(2, 0)
+    lazy_time = time() - start
+    assert numpy.allclose(plane, lazy_plane)
+    print('scale three times and read a plane: arrays {0:.4f} s, '
+        'lazy {1:.4f} s'.format(eager_time, lazy_time))
+
+
+def bench_dose_cache(work_dir, extent, voxel_size=0.1):
+    """
+    Description:
+    Times a batch of "plotting functions" that each load the same three
+    files, through a DoseCache and without it, and checks the LRU budget, the
+    pinning of a reference file and that lazy scaling of one cached copy does
+    not leak into another.
+    """
+
+    print('== dose cache (extent = {0} cm) =='.format(extent))
+    file_names = [
+        join(work_dir, 'bench_cache_{0}.3ddose'.format(index))
+        for index in range(3)
+        ]
+    for index, file_name in enumerate(file_names):
+        write_synthetic_3ddose(file_name, extent, voxel_size, seed=index)
+
+    start = time()
+    for __ in range(4):
+        for file_name in file_names:
+            DoseFile(file_name, load_uncertainty=True)
+    uncached_time = time() - start
+
+    cache = DoseCache()
+    start = time()
+    for __ in range(4):
+        for file_name in file_names:
+            cache.get(file_name, load_uncertainty=True)
+    cached_time = time() - start
+    info = cache.info()
+    assert (info['hits'], info['misses']) == (9, 3)
+    print('4 x 3 loads: DoseFile {0:.3f} s, DoseCache {1:.3f} s '
+        '({2} hits, {3} misses)'.format(
+            uncached_time, cached_time, info['hits'], info['misses']
+            ))
+
+    # room for two files: the pinned reference survives while the other two
+    # evict each other
+    cache = DoseCache(max_bytes=int(info['nbytes'] / 3 * 2.5))
+    reference = cache.get(file_names[0], pin=True, load_uncertainty=True)
+    for file_name in file_names[1:] + file_names[1:]:
+        cache.get(file_name, load_uncertainty=True)
+    info = cache.info()
+    assert (info['entries'], info['pinned']) == (2, 1)
+    assert (info['hits'], info['evictions']) == (0, 3)
+    assert cache.get(file_names[0]).dose is reference.dose
+
+    reference *= 2
+    assert cache.get(file_names[0]).scale == 1
+
+
+def bench_resample(work_dir, extent):
+    """
+    Description:
+    Times DoseFile.resample from a 0.5 mm to a 1 mm grid and back in both
+    modes, and checks that volume averaging onto the nested coarse grid
+    gives the 2x2x2 block means and conserves the integral dose.
+    """
+
+    print('== resampling (extent = {0} cm) =='.format(extent))
+    fine_name = join(work_dir, 'bench_resample_fine.3ddose')
+    coarse_name = join(work_dir, 'bench_resample_coarse.3ddose')
+    write_synthetic_3ddose(fine_name, extent, 0.05)
+    write_synthetic_3ddose(coarse_name, extent, 0.1)
+    fine = DoseFile(fine_name, load_uncertainty=True)
+    coarse = DoseFile(coarse_name, load_uncertainty=True)
+
+    for mode in ('volume', 'trilinear'):
+        for source, target, name in ((fine, coarse, 'fine to coarse'),
+                (coarse, fine, 'coarse to fine')):
+            elapsed, __, resampled = time_call(
+                source.resample, target, mode, load_uncertainty=True
+                )
+            print('{0:>9} {1:>14}: {2:.3f} s'.format(mode, name, elapsed))
+
+            if mode == 'volume' and source is fine:
+                n_x, n_y, n_z = coarse.shape
+                block_means = fine.dose.reshape(
+                    n_x, 2, n_y, 2, n_z, 2
+                    ).mean(axis=(1, 3, 5))
+                assert numpy.allclose(resampled.dose, block_means, rtol=1e-12)
+                # the grids are uniform, so the integral is the sum
+                assert numpy.isclose(
+                    resampled.dose.sum() * 8, fine.dose.sum(), rtol=1e-12
+                    )
+
+
+def bench_profiles(work_dir, extent, voxel_size=0.1, lines=50):
+    """
+    Description:
+    Times extracting lines z-profiles (dose and absolute uncertainty) one
+    by one with position_to_index, as in the analysis scripts, against one
+    DoseFile.profiles call, on a loaded file and through the byte-offset
+    index of an unloaded one, and checks that the profiles agree.
+    """
+
+    print('== line profiles (extent = {0} cm, {1} lines) =='.format(
+        extent, lines
+        ))
+    file_name = join(work_dir, 'bench_profiles.3ddose')
+    write_synthetic_3ddose(file_name, extent, voxel_size)
+    loaded = DoseFile(file_name, load_uncertainty=True)
+    unloaded = DoseFile(file_name, load_dose=False)
+
+    x_pos, y_pos = loaded.positions[0], loaded.positions[1]
+    generator = numpy.random.RandomState(0)
+    specs = list(zip(
+        generator.uniform(x_pos[0], x_pos[-1], lines),
+        generator.uniform(y_pos[0], y_pos[-1], lines)
+        ))
+
+    def by_hand():
+        dose = []
+        err = []
+        for x, y in specs:
+            ix = position_to_index(x, x_pos)
+            iy = position_to_index(y, y_pos)
+            dose.append(loaded.dose[ix, iy, :])
+            err.append(
+                loaded.uncertainty[ix, iy, :] * abs(loaded.dose[ix, iy, :])
+                )
+        return numpy.array(dose), numpy.array(err)
+
+    elapsed, __, expected = time_call(by_hand)
+    print('     by hand: {0:.4f} s'.format(elapsed))
+    for name, dose_file in (('loaded', loaded), ('unloaded', unloaded)):
+        elapsed, __, result = time_call(dose_file.profiles, specs)
+        print('{0:>12}: {1:.4f} s'.format(name, elapsed))
+        assert numpy.array_equal(result[0], expected[0])
+        assert numpy.allclose(result[1], expected[1], rtol=1e-12)
+
+
+def bench_isodose(work_dir, extent, voxel_size=0.1):
+    """
+    Description:
+    Times the enclosed volumes of ten isodose levels from one streamed pass
+    against a (dose >= level) mask per level, checks that they agree, and
+    times the cached result, from memory and from disk.
+    """
+
+    print('== isodose volumes (extent = {0} cm) =='.format(extent))
+    file_name = join(work_dir, 'bench_isodose.3ddose')
+    write_synthetic_3ddose(file_name, extent, voxel_size)
+    dose_file = DoseFile(file_name, load_dose=False)
+    loaded = DoseFile(file_name)
+    levels = loaded.dose.max() * numpy.linspace(0.05, 0.95, 10)
+    voxel_volume = voxel_size ** 3
+
+    def by_mask():
+        return numpy.array([
+            (loaded.dose >= level).sum() * voxel_volume for level in levels
+            ])
+
+    elapsed, __, expected = time_call(by_mask)
+    print('  masks (loaded): {0:.3f} s'.format(elapsed))
+    for name, source in (('loaded', loaded), ('streamed', dose_file)):
+        elapsed, __, volumes = time_call(
+            isodose_volumes, source, levels, cache=False
+            )
+        print(' {0:>14}: {1:.3f} s'.format('one pass (' + name + ')', elapsed))
+        assert numpy.allclose(volumes, expected, rtol=1e-9)
+
+    isodose_volumes(dose_file, levels)
+    elapsed, __, volumes = time_call(isodose_volumes, dose_file, levels)
+    print('  cached (memory): {0:.5f} s'.format(elapsed))
+    clear_memory()
+    elapsed, __, volumes = time_call(isodose_volumes, dose_file, levels)
+    print('  cached (disk): {0:.5f} s'.format(elapsed))
+    assert numpy.allclose(volumes, expected, rtol=1e-9)
+
+
+def bench_pyramid(work_dir, extent, voxel_size=0.05):
+    """
+    Description:
+    Times building the dose pyramid from a streamed file, then getting a
+    quick look level from the stored pyramid in a fresh DoseFile against
+    loading the full resolution grid, and checks that the block means keep
+    the integral dose and the block maxima the maximum.
+    """
+
+    def integral_dose(dose_file):
+        # the edge blocks of a level can be smaller than the others
+        x_widths, y_widths, z_widths = dose_file.spacing
+        return numpy.einsum(
+            'ijk,i,j,k', dose_file.dose, x_widths, y_widths, z_widths
+            )
+
+    print('== dose pyramid (extent = {0} cm) =='.format(extent))
+    file_name = join(work_dir, 'bench_pyramid.3ddose')
+    write_synthetic_3ddose(file_name, extent, voxel_size)
+
+    elapsed, __, full = time_call(DoseFile, file_name)
+    print('     full load: {0:.3f} s'.format(elapsed))
+    dose_file = DoseFile(file_name, load_dose=False)
+    elapsed, __, __ = time_call(dose_file.pyramid, 2)
+    print('         build: {0:.3f} s'.format(elapsed))
+
+    for factor in (2, 4, 8):
+        elapsed, __, level = time_call(
+            DoseFile(file_name, load_dose=False).pyramid, factor
+            )
+        print('  {0}x (stored): {1:.4f} s {2}'.format(
+            factor, elapsed, level.shape
+            ))
+        assert numpy.isclose(
+            integral_dose(level), integral_dose(full), rtol=1e-10
+            )
+        assert full.pyramid(factor, 'max').dose.max() == full.dose.max()
+
+
+def bench_summary(work_dir, extent, voxel_size=0.05, files=4):
+    """
+    Description:
+    Times coarse dose volume histograms of several runs from their dose
+    summary sidecars against streaming the dose blocks of each file, and
+    checks the cumulative histograms and D90 against the full grid.
+    """
+
+    print('== dose summaries (extent = {0} cm) =='.format(extent))
+    file_names = []
+    for number in range(files):
+        file_name = join(work_dir, 'bench_summary_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(file_name, extent, voxel_size, seed=number)
+        file_names.append(file_name)
+
+    scale = 8.2573429808917e13
+    start = time()
+    streamed = [
+        DoseFile(file_name, load_dose=False).dose_volume_histogram(
+            scale=scale, nz=10
+            )
+        for file_name in file_names
+        ]
+    print('      streamed: {0:.3f} s'.format(time() - start))
+
+    start = time()
+    for file_name in file_names:
+        load_summary(file_name)
+    print('  first (build): {0:.3f} s'.format(time() - start))
+
+    start = time()
+    summaries = [load_summary(file_name) for file_name in file_names]
+    histograms = [
+        summary.dose_volume_histogram(scale=scale) for summary in summaries
+        ]
+    print('      sidecars: {0:.4f} s'.format(time() - start))
+
+    for file_name, summary, (volume, cumulative, bin_edges), reference in zip(
+            file_names, summaries, histograms, streamed):
+        assert numpy.allclose(bin_edges, reference[2])
+        assert abs(cumulative - reference[1]).max() < 1.
+        dose = DoseFile(file_name).dose * scale
+        assert summary.max * scale == dose.max()
+        assert numpy.isclose(
+            summary.dose_at_volume(90., scale), dose_to_volume(dose), rtol=0.03
+            )
+
+
+def bench_combine(work_dir, extent, voxel_size=0.05, batches=4,
+        trace=False):
+    """
+    Description:
+    Times combining the dose files of several batches of a run with the
+    streaming BatchCombination against loading every batch and combining
+    the arrays, reports the peak memory of both with trace=True, and checks
+    the streamed combination against the arrays.
+    """
+
+    def combine_loaded(file_names, histories, output_name):
+        weights = numpy.array(histories) / sum(histories)
+        dose = variance = 0.
+        for weight, file_name in zip(weights, file_names):
+            batch = DoseFile(file_name, load_uncertainty=True)
+            dose = dose + weight * batch.dose
+            variance = variance + (weight * batch.dose * batch.uncertainty) ** 2
+        relative = numpy.sqrt(variance) / dose
+        DoseFile.from_arrays(batch.positions, dose, relative).write_3ddose(
+            output_name
+            )
+        return dose, relative
+
+    print('== batch combination (extent = {0} cm) =='.format(extent))
+    file_names = []
+    for number in range(batches):
+        file_name = join(work_dir, 'bench_batch_{0}.3ddose'.format(number))
+        write_synthetic_3ddose(file_name, extent, voxel_size, seed=number)
+        file_names.append(file_name)
+    histories = [1e8 * (number + 1) for number in range(batches)]
+
+    elapsed, peak, (dose, relative) = time_call(
+        combine_loaded, file_names, histories,
+        join(work_dir, 'bench_loaded.3ddose.gz'), trace=trace
+        )
+    line = '  load and add: {0:.3f} s'.format(elapsed)
+    if trace:
+        line += ', peak {0:.1f} MB'.format(peak)
+    print(line)
+
+    output_name = join(work_dir, 'bench_combined.3ddose.gz')
+    for nz in (None, 2):
+        elapsed, peak, __ = time_call(
+            BatchCombination(file_names, histories).write_3ddose, output_name,
+            nz=nz, trace=trace
+            )
+        line = '  streamed (nz = {0}): {1:.3f} s'.format(nz, elapsed)
+        if trace:
+            line += ', peak {0:.1f} MB'.format(peak)
+        print(line)
+
+    # with persisted byte-offset indexes the uncertainty blocks are read
+    # without tokenizing the dose blocks a second time
+    for file_name in file_names:
+        DoseFile(file_name, load_dose=False)._get_index()
+    elapsed, peak, __ = time_call(
+        BatchCombination(file_names, histories).write_3ddose, output_name,
+        nz=8, trace=trace
+        )
+    line = '  indexed (nz = 8): {0:.3f} s'.format(elapsed)
+    if trace:
+        line += ', peak {0:.1f} MB'.format(peak)
+    print(line)
+
+    combined = DoseFile(output_name, load_uncertainty=True)
+    assert numpy.allclose(combined.dose, dose, rtol=1e-4)
+    assert numpy.allclose(combined.uncertainty, relative, rtol=1e-4)
+
+
+def bench_store(work_dir, extent, voxel_size=0.05):
+    """
+    Description:
+    Converts a .3ddose.gz file to a chunked store (zlib and float32 lzma)
+    and times reading a z plane and a line profile from a freshly opened
+    store against the same reads from the .3ddose.gz (through its
+    byte-offset index once built) and against loading the whole file,
+    checking that the values agree.
+    """
+
+    print('== chunked store (extent = {0} cm) =='.format(extent))
+    text_name = join(work_dir, 'bench_store.3ddose')
+    write_synthetic_3ddose(text_name, extent, voxel_size)
+    file_name = text_name + '.gz'
+    with open(text_name, 'rb') as text_file:
+        with gOpen(file_name, 'wb') as gz_file:
+            gz_file.write(text_file.read())
+
+    stores = []
+    for name, options in (('zlib', {}),
+            ('lzma float32', {'compression': 'lzma', 'dtype': numpy.float32})):
+        store_name = join(work_dir, 'bench_store_{0}.dstore'.format(
+            name.replace(' ', '_')
+            ))
+        elapsed, __, __ = time_call(
+            DoseFile(file_name, load_dose=False).write_store, store_name,
+            **options
+            )
+        print('  convert to {0}: {1:.3f} s, {2:.1f} MB (gz {3:.1f} MB)'.format(
+            name, elapsed, getsize(store_name) / 2 ** 20,
+            getsize(file_name) / 2 ** 20
+            ))
+        stores.append(store_name)
+
+    elapsed, __, full = time_call(DoseFile, file_name)
+    print('  full load (gz): {0:.3f} s'.format(elapsed))
+    # builds the byte-offset index so the gz reads below use it
+    DoseFile(file_name, load_dose=False).read_plane(2, 0)
+
+    middle = full.shape[2] // 2
+    for name, source in (('gz', file_name), ('zlib store', stores[0]),
+            ('lzma store', stores[1])):
+        dose_file = DoseFile(source, load_dose=False)
+        elapsed, __, plane = time_call(dose_file.read_plane, 2, middle)
+        assert numpy.allclose(plane, full.dose[:, :, middle], rtol=1e-6)
+        profile_time, __, (profile,) = time_call(
+            dose_file.profiles, [(0.0, 0.0)], uncertainty=False
+            )
+        assert numpy.allclose(
+            profile, full.profiles([(0.0, 0.0)], uncertainty=False)[0],
+            rtol=1e-6
+            )
+        print('  {0:>10}: plane {1:.4f} s, z profile {2:.4f} s'.format(
+            name, elapsed, profile_time
+            ))
+
+
+def rgi_bounds_dose(dose_file):
+    """
+    Description:
+    The meshgrid + RegularGridInterpolator interpolation of the dose at the
+    voxel bounds that dose_inv_position_plots used before interpolate_grid,
+    kept as the baseline.
+    """
+
+    x_pos, y_pos, z_pos = [numpy.array(p) for p in dose_file.positions]
+    interpolated_dose = RegularGridInterpolator(
+        [(p[:-1] + p[1:]) / 2.0 for p in (x_pos, y_pos, z_pos)],
+        dose_file.dose, bounds_error=False, fill_value=None
+        )
+    points = numpy.meshgrid(x_pos, y_pos, z_pos)
+    flat = numpy.array([m.flatten() for m in points])
+
+    return interpolated_dose(
+        flat.transpose()
+        ).reshape(*points[0].shape).transpose((1, 0, 2))
+
+
+def bench_columns(work_dir, extent, voxel_size=0.1):
+    """
+    Description:
+    Times writing a dose grid as a gzipped text table of voxel centres,
+    dose and uncertainty (see dose_columns) against one format call per
+    voxel as construct_dose used to, and writing the binary tables, and
+    checks every table holds the same values.
+    """
+
+    print('== column tables (extent = {0} cm) =='.format(extent))
+    file_name = join(work_dir, 'bench_columns.3ddose')
+    write_synthetic_3ddose(file_name, extent, voxel_size)
+    dose_file = DoseFile(file_name, load_uncertainty=True)
+    dose = dose_file.dose
+    uncertainty = dose_file.uncertainty * dose
+    centres = [(p[:-1] + p[1:]) / 2 for p in dose_file.positions]
+    print('  {0} rows'.format(dose.size))
+
+    def legacy_write(out_name):
+        with gOpen(out_name, 'wt') as gfile:
+            for x_index, x in enumerate(centres[0]):
+                for y_index, y in enumerate(centres[1]):
+                    for z_index, z in enumerate(centres[2]):
+                        gfile.write(
+                            '{0}\t{1}\t{2}\t{3:.15f}\t{4:.15f}\n'.format(
+                                x, y, z,
+                                dose[x_index, y_index, z_index],
+                                uncertainty[x_index, y_index, z_index]
+                                )
+                            )
+
+    legacy_name = join(work_dir, 'bench_columns_legacy.dat')
+    elapsed, __, __ = time_call(legacy_write, legacy_name)
+    print('  per voxel format: {0:.3f} s'.format(elapsed))
+
+    text_name = join(work_dir, 'bench_columns.dat')
+    elapsed, __, __ = time_call(
+        write_columns, text_name, dose, uncertainty, centres
+        )
+    print('  vectorized gzip:  {0:.3f} s, {1:.1f} MB'.format(
+        elapsed, getsize(text_name) / 2 ** 20
+        ))
+
+    npy_name = join(work_dir, 'bench_columns.npy')
+    elapsed, __, __ = time_call(
+        write_binary_columns, npy_name, dose, uncertainty, centres
+        )
+    print('  binary .npy:      {0:.3f} s'.format(elapsed))
+    npz_name = join(work_dir, 'bench_columns.npz')
+    elapsed, __, __ = time_call(
+        write_binary_columns, npz_name, dose, uncertainty, dose_file.positions
+        )
+    print('  binary .npz:      {0:.3f} s'.format(elapsed))
+
+    with gOpen(text_name, 'rb') as text_file:
+        table = numpy.loadtxt(text_file, delimiter='\t')
+    with gOpen(legacy_name, 'rb') as legacy_file:
+        legacy = numpy.loadtxt(legacy_file, delimiter='\t')
+    assert table.shape == legacy.shape == (dose.size, 5)
+    # the rows and coordinates are those of the per voxel loop, whose 15
+    # decimals only kept 2 or 3 digits of doses per history
+    assert numpy.allclose(table[:, :3], legacy[:, :3], rtol=1e-8, atol=1e-12)
+    expected = numpy.column_stack((
+        legacy[:, :3], dose.ravel(), uncertainty.ravel()
+        ))
+    assert numpy.allclose(table, expected, rtol=1e-8, atol=0)
+
+    binary = numpy.load(npy_name, mmap_mode='r')
+    assert numpy.allclose(binary, expected, rtol=1e-6, atol=1e-7)
+    for number, name in enumerate(('x', 'y', 'z', 'dose', 'uncertainty')):
+        column = _mmap_npz_member(npz_name, name, 'r')
+        assert numpy.allclose(
+            column, expected[:, number], rtol=1e-6, atol=1e-7 * (number < 3)
+            )
+
+
+def bench_interpolation(work_dir, voxel_sizes, extent, trace=False):
+    """
+    Description:
+    Interpolates the dose at the voxel bounds (as in dose_inv_position_plots)
+    with the RegularGridInterpolator baseline, the separable interpolate_grid
+    and the batched interpolate_points, and checks that they agree to 1e-12.
+    """
+
+    print('== interpolation at the voxel bounds (extent = {0} cm) =='.format(
+        extent
+        ))
+    for voxel_size in voxel_sizes:
+        file_name = join(
+            work_dir, 'bench_interpolation_{0}mm.3ddose'.format(voxel_size * 10)
+            )
+        write_synthetic_3ddose(file_name, extent, voxel_size)
+        dose_file = DoseFile(file_name)
+        x_pos, y_pos, z_pos = dose_file.positions
+
+        line = '{0:>4} mm {1:>11}'.format(
+            voxel_size * 10, 'x'.join(map(str, dose_file.shape))
+            )
+
+        elapsed, peak, grid = time_call(
+            interpolate_grid, dose_file, x_pos, y_pos, z_pos, fill_value=None,
+            trace=trace
+            )
+        line += '  separable {0:6.3f} s'.format(elapsed)
+        if trace:
+            line += ' {0:7.1f} MB'.format(peak)
+
+        points = numpy.stack(
+            numpy.meshgrid(x_pos, y_pos, z_pos, indexing='ij'), axis=-1
+            )
+        elapsed, peak, batched = time_call(
+            interpolate_points, dose_file, points, fill_value=None, trace=trace
+            )
+        line += '  points {0:6.3f} s'.format(elapsed)
+        if trace:
+            line += ' {0:7.1f} MB'.format(peak)
+        assert numpy.allclose(batched, grid, rtol=1e-12, atol=0)
+        del points, batched
+
+        if RegularGridInterpolator is not None:
+            elapsed, peak, baseline = time_call(
+                rgi_bounds_dose, dose_file, trace=trace
+                )
+            line += '  RGI {0:6.3f} s'.format(elapsed)
+            if trace:
+                line += ' {0:7.1f} MB'.format(peak)
+            assert numpy.allclose(baseline, grid, rtol=1e-12, atol=0)
+
+        print(line)
+
+
+def bench_write(work_dir, voxel_sizes, extent):
+    """
+    Description:
+    Round trip check and timing of DoseFile.write_3ddose. Each synthetic file
+    is loaded, written back plain and gzipped (multi-member, threaded) and
+    read again; the bounds must match to the 8 significant digits written
+    and every value must match its own '%.4E' representation.
+    """
+
+    print('== 3ddose writing (extent = {0} cm) =='.format(extent))
+    for voxel_size in voxel_sizes:
+        file_name = join(
+            work_dir, 'bench_write_{0}mm.3ddose'.format(voxel_size * 10)
+            )
+        shape = write_synthetic_3ddose(file_name, extent, voxel_size)
+        dose_file = DoseFile(file_name, load_uncertainty=True)
+
+        line = '{0:>4} mm {1:>11}'.format(
+            voxel_size * 10, 'x'.join(map(str, shape))
+            )
+        for suffix, compress, threads in (
+                ('', False, 1), ('.gz', True, 1), ('.gz', True, None)):
+            out_name = file_name + '.out' + suffix
+            elapsed, __, __ = time_call(
+                dose_file.write_3ddose, out_name, compress=compress,
+                threads=threads
+                )
+            line += '  {0} {1:6.2f} s'.format(
+                'gzip x{0}'.format(threads or 'all') if compress else 'plain',
+                elapsed
+                )
+
+            written = DoseFile(out_name, load_uncertainty=True)
+            for p, q in zip(dose_file.positions, written.positions):
+                assert numpy.allclose(p, q, rtol=1e-8, atol=0)
+            # the synthetic file was itself written with '%.4E', so the
+            # values survive the round trip exactly
+            assert numpy.array_equal(written.dose, dose_file.dose)
+            assert numpy.array_equal(written.uncertainty, dose_file.uncertainty)
+        print(line)
+
+
+def bench_index(extent, voxel_sizes, lookups=10000):
+    """
+    Description:
+    Times position to voxel lookups with the linear scan position_to_index
+    used to do, the binary search it does now and the AxisIndex arithmetic
+    lookup, and checks that all three agree (including positions exactly on
+    a bound).
+    """
+
+    def scan(p, A):
+        return numpy.where(numpy.logical_and(p >= A[:-1], p < A[1:]))[0][0]
+
+    print('== position lookups (extent = {0} cm, {1} lookups) =='.format(
+        extent, lookups
+        ))
+    random_state = numpy.random.RandomState(0)
+    for voxel_size in voxel_sizes:
+        n = int(round(extent / voxel_size))
+        bounds = numpy.round(
+            numpy.linspace(-extent / 2., extent / 2., n + 1), 4
+            )
+        points = numpy.concatenate([
+            bounds[:-1],
+            random_state.uniform(bounds[0], bounds[-1], lookups - n)
+            ])
+
+        start = time()
+        scanned = numpy.array([scan(p, bounds) for p in points])
+        scan_time = time() - start
+
+        start = time()
+        searched = numpy.array([position_to_index(p, bounds) for p in points])
+        search_time = time() - start
+
+        axis_index = AxisIndex(bounds)
+        start = time()
+        looked_up = numpy.array([axis_index(p) for p in points])
+        scalar_time = time() - start
+
+        start = time()
+        vectorized = axis_index(points)
+        array_time = time() - start
+
+        assert numpy.array_equal(scanned, searched)
+        assert numpy.array_equal(scanned, looked_up)
+        assert numpy.array_equal(scanned, vectorized)
+
+        print(
+            '{0:>4} mm {1:>5} bounds  scan {2:.3f} s  searchsorted {3:.3f} s'
+            '  AxisIndex {4:.3f} s  array {5:.5f} s'.format(
+                voxel_size * 10, n + 1, scan_time, search_time, scalar_time,
+                array_time
+                )
+            )
+
+def main(args):
+    """
+    Description:
+    Runs the benchmarks. Usage:
+
+        python benchmarks.py [extent_cm] [--no-legacy] [--memory]
+
+    The default 10 cm cube gives 1e6 voxels at 1 mm and 8e6 voxels at 0.5 mm.
+    With --memory the peak allocation of each call is reported instead of a
+    meaningful timing.
+    """
+
+    run_legacy = '--no-legacy' not in args
+    trace = '--memory' in args
+    args = [arg for arg in args if not arg.startswith('--')]
+    extent = float(args[0]) if args else 10.0
+
+    work_dir = mkdtemp(prefix='py3ddose_bench_')
+    try:
+        bench_load(work_dir, [0.1, 0.05], extent, run_legacy, trace)
+        bench_cache(work_dir, [0.1, 0.05], extent)
+        bench_write(work_dir, [0.1, 0.05], extent)
+        bench_decompress(work_dir, [0.1, 0.05], extent)
+        bench_expressions(work_dir, extent)
+        bench_superposition(work_dir, extent, trace=trace)
+        bench_basis(work_dir, extent)
+        bench_point_basis(work_dir, extent)
+        bench_optimizer(work_dir, extent)
+        bench_sweep(work_dir, extent)
+        bench_columns(work_dir, extent)
+        bench_dose_cache(work_dir, extent)
+        bench_resample(work_dir, extent)
+        bench_profiles(work_dir, extent)
+        bench_isodose(work_dir, extent)
+        bench_pyramid(work_dir, extent)
+        bench_summary(work_dir, extent)
+        bench_store(work_dir, extent)
+        bench_combine(work_dir, extent, trace=trace)
+        bench_interpolation(work_dir, [0.1, 0.05], extent, trace)
+        bench_index(extent, [0.1, 0.05])
+    finally:
+        rmtree(work_dir)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
@@ -0,0 +1,502 @@
+#!/usr/bin/env
+# purpose: memory mapped dwell position dose bases for instant re-weighting
+
+from __future__ import division, print_function
+
+from collections import OrderedDict
+from glob import glob
+from json import dump as json_dump, load as json_load
+from os import makedirs, rename
+from os.path import abspath, isdir, join
+from shutil import rmtree
+from sys import argv
+from time import time
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from interpolation import _axis_weights
+from py3ddose import DoseFile, GridIndex, _cache_key
+
+# reference files of the Nucletron applicators, as laid out for
+# construct_dose: reference/<size>mm_applicator/*.3ddose.gz
+APPLICATOR_SIZES = ('25', '30', '35', '40')
+
+# bases opened by get_basis, by absolute directory
+_open_bases = {}
+
+# point bases kept by each basis, least recently used first
+MAX_POINT_BASES = 16
+
+
+def _source_keys(file_names):
+    return [_cache_key(file_name) for file_name in file_names]
+
+def build_basis(file_names, basis_dir, nz=8):
+    """
+    Description:
+    Stacks the dose of N reference files (e.g. the dwell positions of an
+    applicator) into a memory mapped float32 basis, with a matching basis
+    of squared absolute uncertainties, so that the superposed dose of any
+    weight vector is one matrix-vector product (see DoseBasis.superpose)
+    instead of a parse of every file.
+
+    Each reference is streamed in z-slabs and stored normalised by its
+    maximum dose (the maxima are kept in the header), which keeps the
+    squared uncertainties well inside the float32 range. The basis is
+    written under a scratch name and renamed when complete.
+
+    Inputs:
+    :param file_names: paths of the reference dose files, on the same grid,
+                       in the order of the weights
+    :type file_names: list
+    :param basis_dir: directory of the basis
+    :type basis_dir: str
+    :param nz: z planes read at a time
+    :type nz: int
+
+    Outputs:
+    :param basis: the basis
+    :type basis: DoseBasis
+    """
+
+    assert len(file_names) > 0, "a basis needs reference files"
+    start = time()
+    first = DoseFile(file_names[0], load_dose=False)
+    x, y, z = first.shape
+    # (z, y, x) order per reference, as the values are stored in the file
+    stored_shape = (len(file_names), z, y, x)
+
+    scratch_dir = basis_dir + '.tmp'
+    if isdir(scratch_dir):
+        rmtree(scratch_dir)
+    makedirs(scratch_dir)
+    dose = open_memmap(
+        join(scratch_dir, 'dose.npy'), mode='w+', dtype=numpy.float32,
+        shape=stored_shape
+        )
+    variance = open_memmap(
+        join(scratch_dir, 'variance.npy'), mode='w+', dtype=numpy.float32,
+        shape=stored_shape
+        )
+
+    scales = []
+    for number, file_name in enumerate(file_names):
+        reference = DoseFile(file_name, load_dose=False)
+        assert tuple(reference.shape) == (x, y, z), \
+        "{0} has shape {1}, not {2}".format(
+            file_name, reference.shape, (x, y, z)
+            )
+        for p, q in zip(first.positions, reference.positions):
+            assert numpy.allclose(p, q), \
+            "the grid bounds of {0} differ".format(file_name)
+        if not (hasattr(reference, 'dose') or hasattr(reference, 'store')):
+            # lets the uncertainty reader start at its block (see
+            # superposition.superpose)
+            reference._get_index()
+
+        maximum = 0.
+        for z_index, dose_slab, uncertainty_slab in reference.iter_slabs(
+                nz, True):
+            planes = slice(z_index, z_index + dose_slab.shape[2])
+            maximum = max(maximum, abs(dose_slab).max())
+            dose[number, planes] = dose_slab.transpose((2,1,0))
+            variance[number, planes] = (
+                dose_slab * uncertainty_slab
+                ).transpose((2,1,0))
+
+        # normalise in place, a few planes at a time
+        scale = maximum if maximum > 0 else 1.
+        for z_index in range(0, z, nz):
+            planes = slice(z_index, z_index + nz)
+            dose[number, planes] /= scale
+            variance[number, planes] /= scale
+            variance[number, planes] **= 2
+        scales.append(float(scale))
+
+    dose.flush()
+    variance.flush()
+    del dose, variance
+
+    with open(join(scratch_dir, 'header.json'), 'w') as header_file:
+        json_dump({
+            'sources': _source_keys(file_names),
+            'scales': scales,
+            'positions': [p.tolist() for p in first.positions]
+            }, header_file)
+
+    if isdir(basis_dir):
+        rmtree(basis_dir)
+    rename(scratch_dir, basis_dir)
+    print("{0}: {1} references, {2:.1f} s".format(
+        basis_dir, len(file_names), time() - start
+        ))
+
+    return DoseBasis(basis_dir)
+
+def get_basis(file_names, basis_dir, nz=8):
+    """
+    Description:
+    Returns the DoseBasis of file_names in basis_dir, building it (see
+    build_basis) if there is none or if it was built from other files or
+    from older versions of them. The bases are kept open for the next
+    call.
+    """
+
+    # a basis opened before is reused, with the point bases it holds
+    basis = _open_bases.get(abspath(basis_dir))
+    if basis is None:
+        try:
+            basis = DoseBasis(basis_dir)
+        except (IOError, OSError, ValueError, KeyError):
+            basis = None
+    if basis is None or not basis.is_current(file_names):
+        basis = build_basis(file_names, basis_dir, nz)
+    _open_bases[abspath(basis_dir)] = basis
+    return basis
+
+class DoseBasis(object):
+
+    """
+    Description:
+    Dose basis written by build_basis. dose and variance are (N, X, Y, Z)
+    memory mapped float32 views (of arrays stored in (N, Z, Y, X) order),
+    normalised by scales; nothing is read until a superposition or a slice
+    of them needs it.
+
+    Inputs:
+    :param basis_dir: directory of the basis
+    :type basis_dir: str
+    :param mmap_mode: mode in which the arrays are memory mapped
+    :type mmap_mode: str
+    """
+
+    def __init__(self, basis_dir, mmap_mode='r'):
+        with open(join(basis_dir, 'header.json')) as header_file:
+            header = json_load(header_file)
+
+        self.basis_dir = basis_dir
+        self.sources = header['sources']
+        self.file_names = [source['source'] for source in self.sources]
+        self.scales = numpy.array(header['scales'])
+        self.positions = [
+            numpy.array(p, dtype=numpy.float64) for p in header['positions']
+            ]
+        self.shape = tuple(len(p) - 1 for p in self.positions)
+
+        self._dose = numpy.load(
+            join(basis_dir, 'dose.npy'), mmap_mode=mmap_mode
+            )
+        self._variance = numpy.load(
+            join(basis_dir, 'variance.npy'), mmap_mode=mmap_mode
+            )
+        assert self._dose.shape == (len(self.scales),) + self.shape[::-1]
+        self.dose = self._dose.transpose((0,3,2,1))
+        self.variance = self._variance.transpose((0,3,2,1))
+        self.grid_index = GridIndex(self.positions)
+        self._point_bases = OrderedDict()
+
+    def __len__(self):
+        return len(self.scales)
+
+    def is_current(self, file_names):
+        """
+        Whether the basis was built from file_names, in this order, as they
+        are now on disk.
+        """
+        try:
+            return _source_keys(file_names) == self.sources
+        except OSError:
+            return False
+
+    def flat_index(self, ix, iy, iz):
+        """
+        Flat indices, into the stored (Z, Y, X) order of each reference, of
+        the voxels (ix, iy, iz).
+        """
+        x, y, z = self.shape
+        return (numpy.asarray(iz) * y + iy) * x + ix
+
+    def voxel_doses(self, flat_indices):
+        """
+        Description:
+        Dose of every reference at the given voxels, read from the memory
+        mapped basis without touching the rest of the grid.
+
+        Inputs:
+        :param flat_indices: voxels, as returned by flat_index
+        :type flat_indices: numpy.ndarray
+
+        Outputs:
+        :param doses: (n voxels, N references) doses, unnormalised
+        :type doses: numpy.ndarray
+        """
+
+        flat_indices = numpy.asarray(flat_indices, dtype=numpy.intp)
+        # reading in increasing order keeps the page accesses sequential
+        order = numpy.argsort(flat_indices, kind='mergesort')
+        doses = numpy.empty((len(flat_indices), len(self)))
+        doses[order] = self._dose.reshape(len(self), -1)[
+            :, flat_indices[order]
+            ].T
+        doses *= self.scales
+        return doses
+
+    def slabs(self, nz=8):
+        """
+        Description:
+        Iterates over the stored doses of every reference in contiguous
+        z-slabs, e.g. for products with many weight vectors at once (see
+        plan_sweep.sweep_plans). The slabs are views of the memory mapped
+        basis, so only the slabs used are read.
+
+        Inputs:
+        :param nz: number of z planes per slab (the last slab may be thinner)
+        :type nz: int
+
+        Outputs:
+        :param slab: (z_index, doses) where z_index is the first z plane of
+                     the slab and doses is (N references, voxels) float32,
+                     unnormalised, with the voxels in the order of flat_index
+        :type slab: tuple
+        """
+
+        z = self.shape[2]
+        stored = self._dose.reshape(len(self), z, -1)
+        for z_index in range(0, z, nz):
+            yield z_index, stored[:, z_index:z_index + nz].reshape(
+                len(self), -1
+                )
+
+    def point_basis(self, points, fill_value=numpy.nan):
+        """
+        Description:
+        Dose and squared absolute uncertainty of every reference at a set of
+        points, interpolated trilinearly between the voxel centres as
+        interpolation.interpolate_points does, for superposing the dose at
+        the points only (see PointBasis). Only the 8 voxels around each
+        point are read from the basis. The results for the last
+        MAX_POINT_BASES sets of points are kept, so asking again for them
+        costs nothing.
+
+        Inputs:
+        :param points: (P, 3) x, y and z coordinates in cm
+        :type points: numpy.ndarray
+        :param fill_value: dose of points outside the voxel centres, or None
+                           to extrapolate from the outermost voxels
+        :type fill_value: float
+
+        Outputs:
+        :param point_basis: the basis at the points
+        :type point_basis: PointBasis
+        """
+
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        key = (points.tobytes(), fill_value)
+        if key in self._point_bases:
+            # moved to the most recently used end
+            self._point_bases[key] = self._point_bases.pop(key)
+            return self._point_bases[key]
+
+        axes = [
+            _axis_weights(self, axis, points[:, axis], fill_value is None)
+            for axis in range(3)
+            ]
+        # strides of x, y and z in the stored (z, y, x) order
+        x, y, z = self.shape
+        strides = (1, x, x * y)
+        offset = numpy.zeros(len(points), dtype=numpy.intp)
+        steps = []
+        weights = []
+        for axis, (first, fraction, __) in enumerate(axes):
+            offset += first * strides[axis]
+            steps.append(
+                (numpy.minimum(first + 1, self.shape[axis] - 1) - first)
+                * strides[axis]
+                )
+            weights.append((1. - fraction, fraction))
+
+        corners = []
+        corner_weights = []
+        for x_corner in (0, 1):
+            for y_corner in (0, 1):
+                for z_corner in (0, 1):
+                    corners.append(
+                        offset + x_corner * steps[0] + y_corner * steps[1]
+                        + z_corner * steps[2]
+                        )
+                    corner_weights.append(
+                        weights[0][x_corner] * weights[1][y_corner]
+                        * weights[2][z_corner]
+                        )
+        # (8, P) corners, read with one gather per array
+        corners = numpy.array(corners)
+        corner_weights = numpy.array(corner_weights)[:, :, None]
+
+        dose = (self._gather(self._dose, corners) * corner_weights).sum(
+            axis=0
+            ) * self.scales
+        # the voxels are treated as independent, as in interpolate_points
+        variance = (
+            self._gather(self._variance, corners) * corner_weights ** 2
+            ).sum(axis=0) * self.scales ** 2
+
+        outside = axes[0][2] | axes[1][2] | axes[2][2]
+        if fill_value is not None:
+            dose[outside] = fill_value
+            variance[outside] = 0.
+
+        point_basis = PointBasis(points, dose, variance, self.file_names)
+        self._point_bases[key] = point_basis
+        while len(self._point_bases) > MAX_POINT_BASES:
+            self._point_bases.popitem(last=False)
+        return point_basis
+
+    def _gather(self, values, flat_indices):
+        # values of every reference at the flat indices (any shape), in
+        # float64 with the references last
+        flat_indices = numpy.asarray(flat_indices, dtype=numpy.intp)
+        gathered = values.reshape(len(self), -1)[:, flat_indices.ravel()]
+        return numpy.moveaxis(
+            gathered.astype(numpy.float64).reshape(
+                (len(self),) + flat_indices.shape
+                ), 0, -1
+            )
+
+    def superpose(self, weights, uncertainty=True):
+        """
+        Description:
+        Weighted superposition of the references (see
+        superposition.superpose) as a float32 matrix-vector product on the
+        memory mapped basis: the dose is sum(w_i * D_i) and the absolute
+        uncertainty sqrt(sum(w_i^2 * sigma_i^2)).
+
+        Inputs:
+        :param weights: weight of each reference, in the order of the basis
+        :type weights: list
+        :param uncertainty: also compute the uncertainty
+        :type uncertainty: bool
+
+        Outputs:
+        :param dose: superposed dose in (x, y, z) order
+        :type dose: numpy.ndarray
+        :param absolute_uncertainty: absolute uncertainty of the dose (None
+                                     with uncertainty=False)
+        :type absolute_uncertainty: numpy.ndarray
+        :param positions: x, y and z bounds of the grid
+        :type positions: list
+        """
+
+        assert len(weights) == len(self), \
+        "{0} weights for a basis of {1} references".format(
+            len(weights), len(self)
+            )
+        # float32 weights keep the product in single precision BLAS instead
+        # of converting the whole basis to float64
+        weights = (
+            numpy.asarray(weights, dtype=numpy.float64) * self.scales
+            ).astype(numpy.float32)
+        stored_shape = self._dose.shape[1:]
+
+        dose = numpy.dot(
+            weights, self._dose.reshape(len(self), -1)
+            ).reshape(stored_shape).transpose((2,1,0))
+        if not uncertainty:
+            return dose, None, self.positions
+
+        variance = numpy.dot(
+            weights * weights, self._variance.reshape(len(self), -1)
+            )
+        absolute_uncertainty = numpy.sqrt(variance, out=variance).reshape(
+            stored_shape
+            ).transpose((2,1,0))
+
+        return dose, absolute_uncertainty, self.positions
+
+class PointBasis(object):
+
+    """
+    Description:
+    Dose and squared absolute uncertainty of N references at P points (see
+    DoseBasis.point_basis), from which the dose at the points of any weight
+    vector is a (P, N) matrix-vector product.
+
+    Inputs:
+    :param points: (P, 3) x, y and z coordinates in cm
+    :type points: numpy.ndarray
+    :param dose: (P, N) dose of each reference at each point
+    :type dose: numpy.ndarray
+    :param variance: (P, N) squared absolute uncertainty of the dose
+    :type variance: numpy.ndarray
+    :param file_names: paths of the reference files
+    :type file_names: list
+    """
+
+    def __init__(self, points, dose, variance, file_names=None):
+        self.points = points
+        self.dose = numpy.ascontiguousarray(dose)
+        self.variance = numpy.ascontiguousarray(variance)
+        self.file_names = file_names
+
+    def __len__(self):
+        return len(self.points)
+
+    def superpose(self, weights, uncertainty=True):
+        """
+        Description:
+        Weighted superposition of the references at the points: the dose is
+        sum(w_i * D_i) and the absolute uncertainty sqrt(sum(w_i^2 *
+        sigma_i^2)), as in DoseBasis.superpose. A (K, N) array of weights
+        gives (K, P) results, one row per weight vector.
+
+        Inputs:
+        :param weights: weight of each reference, in the order of the basis
+        :type weights: numpy.ndarray
+        :param uncertainty: also compute the uncertainty
+        :type uncertainty: bool
+
+        Outputs:
+        :param dose: superposed dose at each point
+        :type dose: numpy.ndarray
+        :param absolute_uncertainty: absolute uncertainty of the dose (None
+                                     with uncertainty=False)
+        :type absolute_uncertainty: numpy.ndarray
+        """
+
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        assert weights.shape[-1] == self.dose.shape[1], \
+        "{0} weights for a basis of {1} references".format(
+            weights.shape[-1], self.dose.shape[1]
+            )
+        dose = numpy.dot(weights, self.dose.T)
+        if not uncertainty:
+            return dose, None
+        return dose, numpy.sqrt(numpy.dot(weights * weights, self.variance.T))
+
+def main(args):
+    """
+    Description:
+    Builds the dose basis of the reference files of each applicator
+    directory given (default: reference/<size>mm_applicator for every size
+    in APPLICATOR_SIZES), in a basis directory inside it. Usage:
+
+        python dose_basis.py [reference/25mm_applicator ...]
+    """
+
+    reference_dirs = args or [
+        join('reference', '{0}mm_applicator'.format(size))
+        for size in APPLICATOR_SIZES
+        ]
+    for reference_dir in reference_dirs:
+        # in name order, as construct_dose reads them
+        file_names = sorted(glob(reference_dir + '/*.3ddose.gz'))
+        if not file_names:
+            print("WARNING: no reference files in {0}".format(reference_dir))
+            continue
+        get_basis(file_names, join(reference_dir, 'basis'))
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
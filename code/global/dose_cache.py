@@ -0,0 +1,203 @@
+#!/usr/bin/env
+# purpose: process-wide cache of loaded dose files
+
+from __future__ import division
+
+from collections import OrderedDict
+from copy import copy
+from os import stat
+from os.path import abspath
+from threading import Lock
+
+import numpy
+
+from py3ddose import DoseFile
+
+
+def _dose_nbytes(dose_file):
+    # memory held by the arrays of a DoseFile (memory mapped arrays count
+    # too, as they are paged in when used)
+    arrays = [getattr(dose_file, name, None) for name in ('dose', 'uncertainty')]
+    arrays.extend(dose_file.positions)
+    return sum(a.nbytes for a in arrays if a is not None)
+
+def _file_state(file_name):
+    status = stat(file_name)
+    return status.st_size, status.st_mtime
+
+class DoseCache(object):
+
+    """
+    Description:
+    Least recently used cache of DoseFile objects, keyed by the absolute path
+    and the DoseFile options, and bounded by the memory of the arrays it
+    holds. Each get returns a shallow copy of the cached DoseFile that shares
+    its arrays, so lazy scaling (dose_file *= factor) only affects that copy;
+    the shared arrays must not be modified in place (dose_file.dose *= ...).
+
+    Pinned entries (e.g. a TG43 reference dose compared against every MBDCA
+    dose) are never evicted; they count towards the budget, so pinning more
+    than max_bytes evicts everything else. An entry is reloaded if its file
+    changes size or modification time, and an entry larger than the whole
+    budget is returned without being cached.
+
+    Inputs:
+    :param max_bytes: memory budget of the cached arrays
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_bytes=2 ** 31):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _key(self, file_name, options):
+        options = dict(options)
+        if 'dtype' in options:
+            options['dtype'] = numpy.dtype(options['dtype']).str
+        return abspath(file_name), tuple(sorted(options.items()))
+
+    def _lookup(self, key, state):
+        keys = [key]
+        options = dict(key[1])
+        if not options.get('load_uncertainty', False):
+            # a file loaded with its uncertainty also serves requests for the
+            # dose alone
+            options['load_uncertainty'] = True
+            keys.append((key[0], tuple(sorted(options.items()))))
+
+        for cached_key in keys:
+            entry = self._entries.get(cached_key)
+            if entry is None:
+                continue
+            if entry['state'] != state:
+                # the file changed since it was cached
+                del self._entries[cached_key]
+                continue
+            return cached_key, entry
+        return None, None
+
+    def get(self, file_name, pin=False, summary=False, **options):
+        """
+        Description:
+        Returns the DoseFile for file_name loaded with options, loading it
+        only if it is not cached.
+
+        Inputs:
+        :param file_name: path to the dose file
+        :type file_name: str
+        :param pin: keep the file cached until unpin or clear
+        :type pin: bool
+        :param summary: also store the DoseSummary sidecar of the file if it
+                        is missing or out of date (see DoseFile), from the
+                        cached arrays on a hit
+        :type summary: bool
+        :param options: keyword arguments of DoseFile
+        :type options: dict
+
+        Outputs:
+        :param dose_file: copy of the cached DoseFile sharing its arrays
+        :type dose_file: DoseFile
+        """
+
+        dose_file = self._get(file_name, pin, options)
+        if summary:
+            dose_file.summary(options.get('cache_dir'))
+        return dose_file
+
+    def _get(self, file_name, pin, options):
+        key = self._key(file_name, options)
+        state = _file_state(file_name)
+
+        with self._lock:
+            cached_key, entry = self._lookup(key, state)
+            if entry is not None:
+                self.hits += 1
+                # keep the entries in least to most recently used order
+                self._entries[cached_key] = self._entries.pop(cached_key)
+                entry['pinned'] = entry['pinned'] or pin
+                return copy(entry['dose_file'])
+            self.misses += 1
+
+        # load outside of the lock so other threads can use the cache
+        dose_file = DoseFile(file_name, **options)
+        size = _dose_nbytes(dose_file)
+
+        if not pin and size > self.max_bytes:
+            return dose_file
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                'dose_file': dose_file, 'state': state, 'size': size,
+                'pinned': pin
+                }
+            self._evict()
+
+        return copy(dose_file)
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if not self._entries[key]['pinned']:
+                del self._entries[key]
+                self.evictions += 1
+
+    def unpin(self, file_name):
+        """
+        Makes every cached entry of file_name evictable again.
+        """
+        file_name = abspath(file_name)
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key[0] == file_name:
+                    entry['pinned'] = False
+            self._evict()
+
+    def clear(self):
+        """
+        Drops every entry, pinned or not, and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def nbytes(self):
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def info(self):
+        """
+        Returns the hit, miss and eviction counts, the number of entries
+        (and of pinned entries) and the bytes held.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'pinned': sum(
+                    entry['pinned'] for entry in self._entries.values()
+                    ),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes
+                }
+
+# shared by every analysis function of the process; set
+# dose_cache.max_bytes to change the budget
+dose_cache = DoseCache()
+
+def get_dose(file_name, pin=False, **options):
+    """
+    Description:
+    Loads file_name through the process-wide dose_cache, so that plotting
+    functions run one after the other parse each file only once. See
+    DoseCache.get.
+    """
+
+    return dose_cache.get(file_name, pin, **options)
@@ -0,0 +1,181 @@
+#!/usr/bin/env
+# purpose: vectorized text and binary column tables of dose grids
+
+from __future__ import division
+
+from multiprocessing.pool import ThreadPool
+from os import rename
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from parallel_gzip import gzip_member
+from py3ddose import _format_scientific
+
+# columns of a table with and without the uncertainty
+COLUMNS = ('x', 'y', 'z', 'dose', 'uncertainty')
+
+
+def _columns(centres, arrays, x_range):
+    # the columns of the rows of the x planes in x_range: the rows run over
+    # x, then y, then z fastest, and the coordinates are broadcast from the
+    # voxel centres
+    x_start, x_stop = x_range
+    x_mid, y_mid, z_mid = centres
+    shape = (x_stop - x_start, len(y_mid), len(z_mid))
+    coordinates = [
+        numpy.broadcast_to(
+            x_mid[x_start:x_stop, None, None], shape
+            ).ravel(),
+        numpy.broadcast_to(y_mid[None, :, None], shape).ravel(),
+        numpy.broadcast_to(z_mid[None, None, :], shape).ravel(),
+        ]
+    return coordinates + [
+        numpy.ascontiguousarray(array[x_start:x_stop]).ravel()
+        for array in arrays
+        ]
+
+def _format_rows(columns, precision):
+    # one block of text per column (see py3ddose._format_scientific), laid
+    # side by side with tabs between them and a newline after the last
+    blocks = []
+    for column in columns:
+        text = _format_scientific(column, precision)
+        block = numpy.frombuffer(text, dtype=numpy.uint8).reshape(
+            len(column), -1
+            ).copy()
+        block[:, -1] = ord('\t')
+        blocks.append(block)
+    blocks[-1][:, -1] = ord('\n')
+    return numpy.hstack(blocks).tobytes()
+
+def _prepare(dose, uncertainty, positions):
+    arrays = [dose] if uncertainty is None else [dose, uncertainty]
+    for array in arrays[1:]:
+        assert array.shape == dose.shape, \
+        "the uncertainty has shape {0}, not {1}".format(
+            array.shape, dose.shape
+            )
+    centres = [
+        (numpy.asarray(p[:-1]) + numpy.asarray(p[1:])) / 2
+        if len(p) == n + 1 else numpy.asarray(p)
+        for p, n in zip(positions, dose.shape)
+        ]
+    for c, n in zip(centres, dose.shape):
+        assert len(c) == n, \
+        "positions do not match a grid of shape {0}".format(dose.shape)
+    return arrays, centres
+
+def _x_ranges(shape, rows):
+    # runs of whole x planes of about rows rows
+    nx = max(1, rows // (shape[1] * shape[2]))
+    return [(x, min(x + nx, shape[0])) for x in range(0, shape[0], nx)]
+
+def write_columns(file_name, dose, uncertainty, positions, precision=8,
+        compress=True, rows=2 ** 18, threads=None, level=6):
+    """
+    Description:
+    Writes a dose grid as a text table with one row per voxel: the x, y and
+    z coordinates of its centre, its dose and, if given, its uncertainty,
+    tab separated in scientific notation. The rows run over x, then y, with
+    z fastest, as construct_dose has always written them.
+
+    The coordinate columns are broadcast from the voxel centres and each
+    block of rows is formatted with array operations (see
+    py3ddose._format_scientific) instead of one format call per value.
+    With compress=True the blocks are gzipped in a thread pool as
+    independent gzip members (see parallel_gzip), which gzip/zcat read as
+    one stream. The file is written under a scratch name and renamed when
+    complete.
+
+    Inputs:
+    :param file_name: output path
+    :type file_name: str
+    :param dose: dose in (x, y, z) order
+    :type dose: numpy.ndarray
+    :param uncertainty: uncertainty in (x, y, z) order, or None for no
+                        uncertainty column
+    :type uncertainty: numpy.ndarray
+    :param positions: x, y and z voxel centres, or bounds
+    :type positions: tuple
+    :param precision: digits after the decimal point of each value
+    :type precision: int
+    :param compress: gzip the output
+    :type compress: bool
+    :param rows: rows per block (rounded to whole x planes)
+    :type rows: int
+    :param threads: number of worker threads (default: all cores)
+    :type threads: int
+    :param level: zlib compression level
+    :type level: int
+    """
+
+    arrays, centres = _prepare(dose, uncertainty, positions)
+
+    def write_block(x_range):
+        text = _format_rows(_columns(centres, arrays, x_range), precision)
+        return gzip_member(text, level) if compress else text
+
+    scratch_name = file_name + '.tmp'
+    pool = ThreadPool(threads)
+    try:
+        with open(scratch_name, 'wb') as out_file:
+            for data in pool.imap(write_block, _x_ranges(dose.shape, rows)):
+                out_file.write(data)
+    finally:
+        pool.close()
+        pool.join()
+
+    rename(scratch_name, file_name)
+
+def write_binary_columns(file_name, dose, uncertainty, positions,
+        dtype=numpy.float32, rows=2 ** 20):
+    """
+    Description:
+    Writes the table of write_columns in binary, for tools that memory map
+    it instead of parsing text. With a name ending in .npz the columns are
+    separate arrays (named as in COLUMNS) of an uncompressed .npz archive,
+    whose members py3ddose._mmap_npz_member maps; otherwise the table is a
+    single (rows, columns) .npy array, written block by block, that
+    numpy.load(file_name, mmap_mode='r') maps.
+
+    Inputs:
+    :param file_name: output path, ending in .npy or .npz
+    :type file_name: str
+    :param dose: dose in (x, y, z) order
+    :type dose: numpy.ndarray
+    :param uncertainty: uncertainty in (x, y, z) order, or None for no
+                        uncertainty column
+    :type uncertainty: numpy.ndarray
+    :param positions: x, y and z voxel centres, or bounds
+    :type positions: tuple
+    :param dtype: type of the values
+    :type dtype: numpy.dtype
+    :param rows: rows per block of the .npy table (rounded to whole x
+                 planes)
+    :type rows: int
+    """
+
+    arrays, centres = _prepare(dose, uncertainty, positions)
+    n_columns = 3 + len(arrays)
+
+    if file_name.endswith('.npz'):
+        columns = _columns(centres, arrays, (0, dose.shape[0]))
+        numpy.savez(file_name, **dict(
+            (name, column.astype(dtype))
+            for name, column in zip(COLUMNS, columns)
+            ))
+        return
+
+    assert file_name.endswith('.npy'), \
+    "binary tables are written to .npy or .npz files"
+    table = open_memmap(
+        file_name, mode='w+', dtype=dtype, shape=(dose.size, n_columns)
+        )
+    row = 0
+    for x_range in _x_ranges(dose.shape, rows):
+        columns = _columns(centres, arrays, x_range)
+        table[row:row + len(columns[0])] = numpy.column_stack(columns)
+        row += len(columns[0])
+    table.flush()
+    del table
@@ -0,0 +1,447 @@
+#!/usr/bin/env
+# purpose: chunked compressed dose store with random access
+
+from __future__ import division, print_function
+
+from collections import OrderedDict
+from json import dumps as json_dumps, loads as json_loads
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import rename, stat
+from os.path import basename, exists, join
+from struct import pack, unpack
+from sys import argv
+from threading import Lock
+from time import time
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+
+import numpy
+
+try:
+    from lzma import compress as lzma_compress, decompress as lzma_decompress
+except ImportError:  # python 2 without backports.lzma
+    lzma_compress = lzma_decompress = None
+
+# file layout: MAGIC, the length of the JSON header (uint64), the header,
+# the index of (offset, length) uint64 pairs of every chunk of every block
+# in (block, x chunk, y chunk, z chunk) order, then the compressed chunks;
+# each chunk holds its part of the (x, y, z) array in C order
+MAGIC = b'DSTORE01'
+STORE_EXTENSION = '.dstore'
+
+
+def _compressor(compression, level):
+    if compression == 'zlib':
+        return lambda data: zlib_compress(data, level)
+    if compression == 'lzma':
+        assert lzma_compress is not None, "lzma is not available"
+        return lambda data: lzma_compress(data, preset=level)
+    assert compression == 'none', \
+    "unknown compression {0!r}".format(compression)
+    return lambda data: data
+
+def _decompressor(compression):
+    if compression == 'zlib':
+        return zlib_decompress
+    if compression == 'lzma':
+        assert lzma_decompress is not None, "lzma is not available"
+        return lzma_decompress
+    assert compression == 'none', \
+    "unknown compression {0!r}".format(compression)
+    return lambda data: data
+
+def write_store(file_name, dose_file, uncertainty=True,
+        chunk_shape=(32, 32, 32), compression='zlib', level=6, dtype=None,
+        threads=None):
+    """
+    Description:
+    Writes the (scaled) dose, and the relative uncertainty, of a DoseFile or
+    dose expression to a chunked store: the grid is cut into chunk_shape
+    blocks that are compressed independently and located through an index
+    in the header, so DoseStore can decompress just the chunks a region
+    touches. The grid is streamed in z-slabs one chunk deep and the chunks
+    of a slab are compressed in a thread pool (zlib and lzma release the
+    GIL). The store is written under a scratch name and renamed when
+    complete.
+
+    Inputs:
+    :param file_name: path of the store (by convention ending in
+                      STORE_EXTENSION)
+    :type file_name: str
+    :param dose_file: dose grid to store
+    :type dose_file: DoseFile
+    :param uncertainty: also store the relative uncertainty
+    :type uncertainty: bool
+    :param chunk_shape: voxels per chunk along x, y and z
+    :type chunk_shape: tuple
+    :param compression: 'zlib', 'lzma' or 'none'
+    :type compression: str
+    :param level: zlib level or lzma preset
+    :type level: int
+    :param dtype: type of the stored values (default: that of dose_file);
+                  numpy.float32 about halves the store and keeps the 4
+                  significant digits of 3ddose files
+    :type dtype: numpy.dtype
+    :param threads: compression threads (default: all cores)
+    :type threads: int
+    """
+
+    compress = _compressor(compression, level)
+    shape = tuple(int(n) for n in dose_file.shape)
+    chunk_shape = tuple(int(n) for n in chunk_shape)
+    counts = tuple(-(-n // c) for n, c in zip(shape, chunk_shape))
+    blocks = ['dose', 'uncertainty'] if uncertainty else ['dose']
+    dtype = numpy.dtype(dtype or dose_file.dtype).newbyteorder('<')
+
+    header = json_dumps({
+        'shape': shape,
+        'chunk_shape': chunk_shape,
+        'dtype': dtype.str,
+        'compression': compression,
+        'blocks': blocks,
+        'positions': [numpy.asarray(p).tolist() for p in dose_file.positions]
+        }).encode('utf-8')
+    index = numpy.zeros((len(blocks),) + counts + (2,), dtype='<u8')
+    offset = len(MAGIC) + 8 + len(header) + index.nbytes
+
+    def compress_chunk(chunk):
+        return compress(numpy.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+    scratch_name = file_name + '.tmp'
+    pool = ThreadPool(threads or cpu_count())
+    try:
+        with open(scratch_name, 'wb') as store_file:
+            store_file.write(MAGIC + pack('<Q', len(header)) + header)
+            # the index is filled in once the chunks are written
+            store_file.write(index.tobytes())
+
+            for slab in dose_file.iter_slabs(chunk_shape[2], uncertainty):
+                z_chunk = slab[0] // chunk_shape[2]
+                keys = []
+                chunks = []
+                for block, values in enumerate(slab[1:]):
+                    for x_chunk in range(counts[0]):
+                        x0 = x_chunk * chunk_shape[0]
+                        for y_chunk in range(counts[1]):
+                            y0 = y_chunk * chunk_shape[1]
+                            keys.append((block, x_chunk, y_chunk, z_chunk))
+                            chunks.append(values[
+                                x0:x0 + chunk_shape[0], y0:y0 + chunk_shape[1]
+                                ])
+                for key, data in zip(keys, pool.imap(compress_chunk, chunks)):
+                    store_file.write(data)
+                    index[key] = (offset, len(data))
+                    offset += len(data)
+
+            store_file.seek(len(MAGIC) + 8 + len(header))
+            store_file.write(index.tobytes())
+    finally:
+        pool.terminate()
+        pool.join()
+
+    rename(scratch_name, file_name)
+
+class DoseStore(object):
+
+    """
+    Description:
+    Random access reader of a store written by write_store. Only the chunks
+    a region touches are read and decompressed; decompressed chunks are
+    kept in a least recently used cache bounded by cache_bytes, so that
+    neighbouring planes or profiles reuse them.
+
+    Inputs:
+    :param file_name: path to the store
+    :type file_name: str
+    :param threads: decompression threads for regions of many chunks
+                    (default: all cores)
+    :type threads: int
+    :param cache_bytes: memory budget of the decompressed chunk cache
+    :type cache_bytes: int
+    """
+
+    def __init__(self, file_name, threads=None, cache_bytes=2 ** 26):
+        self.file_name = file_name
+        self.threads = threads
+        self.cache_bytes = cache_bytes
+
+        with open(file_name, 'rb') as store_file:
+            magic = store_file.read(len(MAGIC))
+            assert magic == MAGIC, \
+            "{0} is not a dose store".format(file_name)
+            header_length, = unpack('<Q', store_file.read(8))
+            header = json_loads(store_file.read(header_length).decode('utf-8'))
+
+            self.shape = tuple(header['shape'])
+            self.chunk_shape = tuple(header['chunk_shape'])
+            self.counts = tuple(
+                -(-n // c) for n, c in zip(self.shape, self.chunk_shape)
+                )
+            self.dtype = numpy.dtype(header['dtype'])
+            self.compression = header['compression']
+            self.blocks = header['blocks']
+            self.positions = [
+                numpy.array(p, dtype=numpy.float64) for p in header['positions']
+                ]
+
+            index_shape = (len(self.blocks),) + self.counts + (2,)
+            self.index = numpy.frombuffer(
+                store_file.read(8 * int(numpy.prod(index_shape))), dtype='<u8'
+                ).reshape(index_shape)
+
+        self._decompress = _decompressor(self.compression)
+        self._chunks = OrderedDict()
+        self._chunk_bytes = 0
+        self._lock = Lock()
+
+    def _chunk_extent(self, key):
+        # shape of a chunk (those at the far edges may be smaller)
+        return tuple(
+            min(c, n - i * c)
+            for i, c, n in zip(key[1:], self.chunk_shape, self.shape)
+            )
+
+    def _cached(self, key):
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks[key] = self._chunks.pop(key)
+            return chunk
+
+    def _remember(self, key, chunk):
+        with self._lock:
+            if key in self._chunks or chunk.nbytes > self.cache_bytes:
+                return
+            self._chunks[key] = chunk
+            self._chunk_bytes += chunk.nbytes
+            while self._chunk_bytes > self.cache_bytes:
+                __, evicted = self._chunks.popitem(last=False)
+                self._chunk_bytes -= evicted.nbytes
+
+    def _read_chunks(self, keys, cache=True):
+        chunks = {}
+        missing = []
+        for key in keys:
+            chunk = self._cached(key) if cache else None
+            if chunk is None:
+                missing.append(key)
+            else:
+                chunks[key] = chunk
+
+        # the compressed chunks are read in file order with one handle and
+        # decompressed together
+        missing.sort(key=lambda key: self.index[key][0])
+        raw = []
+        with open(self.file_name, 'rb') as store_file:
+            for key in missing:
+                offset, length = self.index[key]
+                store_file.seek(int(offset))
+                raw.append(store_file.read(int(length)))
+
+        if len(raw) > 1 and self.threads != 1:
+            pool = ThreadPool(min(self.threads or cpu_count(), len(raw)))
+            try:
+                decompressed = pool.map(self._decompress, raw)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            decompressed = [self._decompress(data) for data in raw]
+
+        for key, data in zip(missing, decompressed):
+            chunk = numpy.frombuffer(data, dtype=self.dtype).reshape(
+                self._chunk_extent(key)
+                )
+            if cache:
+                self._remember(key, chunk)
+            chunks[key] = chunk
+
+        return chunks
+
+    def read_region(self, block='dose', x_range=None, y_range=None,
+            z_range=None, cache=True):
+        """
+        Description:
+        Reads the voxels of a box of the grid, decompressing only the chunks
+        that overlap it.
+
+        Inputs:
+        :param block: 'dose' or 'uncertainty'
+        :type block: str
+        :param x_range: (start, stop) voxel indices along x; None for all
+        :type x_range: tuple
+        :param y_range: (start, stop) voxel indices along y; None for all
+        :type y_range: tuple
+        :param z_range: (start, stop) voxel indices along z; None for all
+        :type z_range: tuple
+        :param cache: keep the decompressed chunks for later reads
+        :type cache: bool
+
+        Outputs:
+        :param region: values of the box in (x, y, z) order
+        :type region: numpy.ndarray
+        """
+
+        assert block in self.blocks, \
+        "{0} has no {1} block".format(self.file_name, block)
+        block_number = self.blocks.index(block)
+
+        bounds = [
+            slice(*(r or (None,))).indices(n)[:2]
+            for r, n in zip((x_range, y_range, z_range), self.shape)
+            ]
+        region = numpy.empty(
+            [stop - start for start, stop in bounds], dtype=self.dtype
+            )
+        if not region.size:
+            return region
+
+        chunk_ranges = [
+            range(start // c, (stop - 1) // c + 1)
+            for (start, stop), c in zip(bounds, self.chunk_shape)
+            ]
+        keys = [
+            (block_number, i, j, k)
+            for i in chunk_ranges[0]
+            for j in chunk_ranges[1]
+            for k in chunk_ranges[2]
+            ]
+        chunks = self._read_chunks(keys, cache)
+
+        for key in keys:
+            # overlap of the chunk and the box, in the coordinates of each
+            source = []
+            target = []
+            for i, c, (start, stop) in zip(key[1:], self.chunk_shape, bounds):
+                lower = max(start, i * c)
+                upper = min(stop, (i + 1) * c)
+                source.append(slice(lower - i * c, upper - i * c))
+                target.append(slice(lower - start, upper - start))
+            region[tuple(target)] = chunks[key][tuple(source)]
+
+        return region
+
+    def iter_slabs(self, nz=1, blocks=('dose',)):
+        """
+        Description:
+        Iterates over the grid in z-slabs like DoseFile.iter_slabs. Whole
+        rows of chunks are decompressed at a time (bypassing the chunk
+        cache) and the slabs cut from them.
+
+        Inputs:
+        :param nz: number of z planes per slab (the last slab may be thinner)
+        :type nz: int
+        :param blocks: blocks to yield for each slab
+        :type blocks: tuple
+
+        Outputs:
+        :param slab: (z_index, values of each block) in (x, y, z) order
+        :type slab: tuple
+        """
+
+        z = self.shape[2]
+        depth = self.chunk_shape[2]
+        rows = None
+        rows_start = rows_stop = 0
+        for z_index in range(0, z, nz):
+            z_stop = min(z_index + nz, z)
+            if z_index < rows_start or z_stop > rows_stop:
+                # the chunk aligned z range covering the slab
+                rows_start = z_index // depth * depth
+                rows_stop = min(-(-z_stop // depth) * depth, z)
+                rows = [
+                    self.read_region(
+                        block, z_range=(rows_start, rows_stop), cache=False
+                        )
+                    for block in blocks
+                    ]
+            yield (z_index,) + tuple(
+                values[:, :, z_index - rows_start:z_stop - rows_start]
+                for values in rows
+                )
+
+def store_name(file_name, output_dir=None):
+    """
+    Returns the name of the store converted from a .3ddose(.gz) file: the
+    same name with STORE_EXTENSION, in output_dir if given.
+    """
+    name = file_name
+    for extension in ('.gz', '.3ddose'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    name += STORE_EXTENSION
+    if output_dir is not None:
+        name = join(output_dir, basename(name))
+    return name
+
+def convert_archive(file_names, output_dir=None, overwrite=False, **options):
+    """
+    Description:
+    Converts .3ddose(.gz) files to chunked stores (see store_name), one
+    after the other, streaming each file so that only a slab of it is held
+    in memory. A store newer than its source is skipped unless overwrite
+    is set. Prints the time and the size of each conversion.
+
+    Inputs:
+    :param file_names: paths of the 3ddose files
+    :type file_names: list
+    :param output_dir: directory of the stores (default: next to each file)
+    :type output_dir: str
+    :param overwrite: convert even if an up to date store exists
+    :type overwrite: bool
+    :param options: keyword arguments of write_store
+    :type options: dict
+
+    Outputs:
+    :param store_names: paths of the stores
+    :type store_names: list
+    """
+
+    # imported here as py3ddose itself imports this module
+    from py3ddose import DoseFile
+
+    store_names = []
+    for file_name in file_names:
+        name = store_name(file_name, output_dir)
+        store_names.append(name)
+        if (not overwrite and exists(name)
+                and stat(name).st_mtime >= stat(file_name).st_mtime):
+            print("{0}: up to date".format(name))
+            continue
+
+        start = time()
+        write_store(name, DoseFile(file_name, load_dose=False), **options)
+        print("{0}: {1:.1f} s, {2:.1f} MB -> {3:.1f} MB".format(
+            name, time() - start, stat(file_name).st_size / 2 ** 20,
+            stat(name).st_size / 2 ** 20
+            ))
+
+    return store_names
+
+def main(args):
+    """
+    Description:
+    Converts 3ddose files to chunked stores. Usage:
+
+        python dose_store.py [--lzma] [--overwrite] [--output-dir=DIR]
+            file.3ddose.gz ...
+    """
+
+    options = {}
+    output_dir = None
+    for arg in args:
+        if arg == '--lzma':
+            options['compression'] = 'lzma'
+        elif arg == '--overwrite':
+            options['overwrite'] = True
+        elif arg.startswith('--output-dir='):
+            output_dir = arg.split('=', 1)[1]
+    file_names = [arg for arg in args if not arg.startswith('--')]
+
+    convert_archive(file_names, output_dir, **options)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
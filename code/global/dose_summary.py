@@ -0,0 +1,322 @@
+#!/usr/bin/env
+# purpose: dose summaries answering metadata queries without the dose blocks
+
+from __future__ import division, print_function
+
+from os import stat
+from os.path import abspath, join
+from hashlib import sha1
+
+import numpy
+
+# the log histogram has fixed bins, so it is filled in a single pass without
+# knowing the dose range first: LOG_BINS_PER_DECADE bins per decade from
+# 10 ** LOG_RANGE[0] to 10 ** LOG_RANGE[1], which covers doses per history
+# as well as doses in Gy (each bin spans 2.3 % of its dose)
+LOG_BINS_PER_DECADE = 100
+LOG_RANGE = (-30, 10)
+
+
+def _summary_path(file_name, cache_dir=None):
+    # next to the dose file, or under a hash of its path in cache_dir
+    if cache_dir is None:
+        return file_name + '.summary.npz'
+    return join(
+        cache_dir,
+        sha1(abspath(file_name).encode('utf-8')).hexdigest() + '.summary.npz'
+        )
+
+def _file_key(file_name):
+    status = stat(file_name)
+    return numpy.array([status.st_size, status.st_mtime], dtype=numpy.float64)
+
+def log_bin_edges():
+    """
+    Returns the edges of the bins of the log histogram of a DoseSummary.
+    """
+    lower, upper = LOG_RANGE
+    return numpy.logspace(
+        lower, upper, (upper - lower) * LOG_BINS_PER_DECADE + 1
+        )
+
+def summarize(slabs, positions):
+    """
+    Description:
+    Builds the DoseSummary of a grid from its z-slabs in one pass.
+
+    Inputs:
+    :param slabs: (z_index, dose_slab) pairs covering the grid in order, as
+                  yielded by DoseFile.iter_slabs
+    :type slabs: iterable
+    :param positions: x, y and z bounds of the grid
+    :type positions: list
+
+    Outputs:
+    :param summary: the summary
+    :type summary: DoseSummary
+    """
+
+    n_bins = (LOG_RANGE[1] - LOG_RANGE[0]) * LOG_BINS_PER_DECADE
+    counts = numpy.zeros(n_bins, dtype=numpy.int64)
+    underflow = overflow = 0
+    z_maxima = numpy.empty(len(positions[2]) - 1)
+    lower, upper = numpy.inf, -numpy.inf
+    total = 0.
+
+    for z_index, slab in slabs:
+        values = numpy.asarray(slab, dtype=numpy.float64).ravel()
+        lower = min(lower, values.min())
+        upper = max(upper, values.max())
+        total += values.sum()
+        z_maxima[z_index:z_index + slab.shape[2]] = slab.max(axis=(0, 1))
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            bins = numpy.floor(
+                (numpy.log10(values) - LOG_RANGE[0]) * LOG_BINS_PER_DECADE
+                )
+        # zero, negative and tiny doses are below the first bin
+        below = ~(bins >= 0)
+        above = bins >= n_bins
+        underflow += numpy.count_nonzero(below)
+        overflow += numpy.count_nonzero(above)
+        counts += numpy.bincount(
+            bins[~(below | above)].astype(numpy.intp), minlength=n_bins
+            )
+
+    size = int(numpy.prod([len(p) - 1 for p in positions]))
+    return DoseSummary(
+        positions=[numpy.asarray(p, dtype=numpy.float64) for p in positions],
+        min=lower, max=upper, sum=total, mean=total / size,
+        counts=counts, underflow=underflow, overflow=overflow,
+        z_maxima=z_maxima
+        )
+
+def read_summary(file_name, cache_dir=None):
+    """
+    Returns the DoseSummary stored for file_name, or None if there is none
+    or the file changed since it was written.
+    """
+    try:
+        with numpy.load(_summary_path(file_name, cache_dir)) as summary_file:
+            if not numpy.array_equal(summary_file['key'], _file_key(file_name)):
+                return None
+            return DoseSummary(
+                positions=[
+                    summary_file['positions_{0}'.format(axis)]
+                    for axis in range(3)
+                    ],
+                min=float(summary_file['min']),
+                max=float(summary_file['max']),
+                sum=float(summary_file['sum']),
+                mean=float(summary_file['mean']),
+                counts=summary_file['counts'],
+                underflow=int(summary_file['underflow']),
+                overflow=int(summary_file['overflow']),
+                z_maxima=summary_file['z_maxima']
+                )
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+def write_summary(file_name, summary, cache_dir=None):
+    """
+    Stores summary as the summary of file_name (see read_summary).
+    """
+    summary_path = _summary_path(file_name, cache_dir)
+    arrays = dict(
+        ('positions_{0}'.format(axis), p)
+        for axis, p in enumerate(summary.positions)
+        )
+    try:
+        numpy.savez(
+            summary_path, key=_file_key(file_name), min=summary.min,
+            max=summary.max, sum=summary.sum, mean=summary.mean,
+            counts=summary.counts, underflow=summary.underflow,
+            overflow=summary.overflow, z_maxima=summary.z_maxima, **arrays
+            )
+    except (IOError, OSError) as error:
+        print("WARNING: Could not write dose summary {0} ({1})".format(
+            summary_path, error
+            ))
+
+def load_summary(file_name, cache_dir=None):
+    """
+    Description:
+    Returns the DoseSummary of a dose file, read from its sidecar if it is
+    up to date and otherwise computed by streaming the file (and stored).
+    Use it to query many runs without touching their dose blocks.
+
+    Inputs:
+    :param file_name: path to the dose file
+    :type file_name: str
+    :param cache_dir: directory holding the summaries (default: next to the
+                      dose file)
+    :type cache_dir: str
+
+    Outputs:
+    :param summary: the summary
+    :type summary: DoseSummary
+    """
+
+    summary = read_summary(file_name, cache_dir)
+    if summary is None:
+        # imported here as py3ddose itself imports this module
+        from py3ddose import DoseFile
+        summary = DoseFile(file_name, load_dose=False).summary(cache_dir)
+    return summary
+
+class DoseSummary(object):
+
+    """
+    Description:
+    Compact summary of a dose grid: exact minimum, maximum, mean and sum,
+    a fine histogram with log spaced bins (see LOG_RANGE), the maximum of
+    each z plane and the bounds of the grid. Queries on the dose
+    distribution (fractions above a dose, D90, coarse dose volume
+    histograms) are interpolated from the histogram, so they are accurate
+    to a fraction of a bin.
+
+    Doses are those of the file times scale, which DoseFile.summary sets to
+    the lazy scale of the DoseFile; the query methods take a further scale
+    like DoseFile.histogram.
+    """
+
+    def __init__(self, positions, min, max, sum, mean, counts, underflow,
+            overflow, z_maxima, scale=1.0):
+        self.positions = positions
+        self.shape = tuple(len(p) - 1 for p in positions)
+        self.size = int(numpy.prod(self.shape))
+        self.min = min
+        self.max = max
+        self.sum = sum
+        self.mean = mean
+        self.counts = counts
+        self.underflow = underflow
+        self.overflow = overflow
+        self.z_maxima = z_maxima
+        self.scale = scale
+
+    def dose_range(self, scale=1.0):
+        """
+        Returns the (minimum, maximum) dose times scale.
+        """
+        scale = self.scale * scale
+        return self.min * scale, self.max * scale
+
+    def _knots(self):
+        # unscaled doses at which the number of voxels below them is known
+        # exactly (the extremes and the edges of the log bins between them)
+        # and those numbers; in between it is interpolated linearly
+        edges = log_bin_edges()
+        below = numpy.concatenate((
+            [self.underflow], self.underflow + numpy.cumsum(self.counts)
+            ))
+        inside = (edges > self.min) & (edges < self.max)
+        knots = numpy.concatenate(([self.min], edges[inside], [self.max]))
+        values = numpy.concatenate(([0], below[inside], [self.size]))
+        return knots, values
+
+    def _cumulative(self, doses, scale):
+        # number of voxels with less than each (scaled) dose
+        scale = self.scale * scale
+        assert scale > 0, "summaries need a positive scale"
+        knots, values = self._knots()
+        return numpy.interp(
+            numpy.asarray(doses, dtype=numpy.float64) / scale, knots, values
+            )
+
+    def fraction_above(self, dose, scale=1.0):
+        """
+        Description:
+        Fraction of the voxels receiving at least dose (e.g. the fraction of
+        the grid above 5 Gy).
+
+        Inputs:
+        :param dose: dose, or array of doses
+        :type dose: float
+        :param scale: factor applied to the doses of the summary
+        :type scale: float
+
+        Outputs:
+        :param fraction: fraction of the voxels at each dose
+        :type fraction: float
+        """
+
+        return 1. - self._cumulative(dose, scale) / self.size
+
+    def dose_at_volume(self, volume=90., scale=1.0):
+        """
+        Description:
+        Minimum dose received by the hottest volume percent of the voxels,
+        e.g. D90 (see py3ddose.dose_to_volume).
+
+        Inputs:
+        :param volume: percent of the voxels
+        :type volume: float
+        :param scale: factor applied to the doses of the summary
+        :type scale: float
+
+        Outputs:
+        :param dose_volume: dose covering the given volume
+        :type dose_volume: float
+        """
+
+        knots, values = self._knots()
+        return numpy.interp(
+            (100. - volume) / 100. * self.size, values, knots
+            ) * self.scale * scale
+
+    def histogram(self, bins=500, dose_range=None, scale=1.0):
+        """
+        Description:
+        Coarse histogram of the dose with equal width bins, redistributed
+        from the log histogram (see DoseFile.histogram).
+
+        Inputs:
+        :param bins: number of equal width bins
+        :type bins: int
+        :param dose_range: (lower, upper) range of the bins; defaults to the
+                           minimum and maximum scaled dose
+        :type dose_range: tuple
+        :param scale: factor applied to the doses of the summary
+        :type scale: float
+
+        Outputs:
+        :param counts: number of voxels in each bin (fractional)
+        :type counts: numpy.ndarray
+        :param bin_edges: edges of the bins (bins + 1 values)
+        :type bin_edges: numpy.ndarray
+        """
+
+        if dose_range is None:
+            dose_range = self.dose_range(scale)
+        bin_edges = numpy.linspace(dose_range[0], dose_range[1], bins + 1)
+
+        below = self._cumulative(bin_edges, scale)
+        # the last bin includes its upper edge, as in numpy.histogram
+        if bin_edges[-1] >= self.max * self.scale * scale:
+            below[-1] = self.size
+
+        return numpy.diff(below), bin_edges
+
+    def dose_volume_histogram(self, bins=500, dose_range=None, scale=1.0):
+        """
+        Description:
+        Coarse differential and cumulative dose volume histograms with
+        volumes in percent of the grid, as DoseFile.dose_volume_histogram
+        returns them.
+
+        Outputs:
+        :param volume: percent of voxels in each dose bin
+        :type volume: numpy.ndarray
+        :param cumulative_volume: percent of voxels receiving at least the
+                                  lower edge of each bin
+        :type cumulative_volume: numpy.ndarray
+        :param bin_edges: edges of the dose bins
+        :type bin_edges: numpy.ndarray
+        """
+
+        counts, bin_edges = self.histogram(bins, dose_range, scale)
+        volume = counts * (100. / self.size)
+        cumulative_volume = volume[::-1].cumsum()[::-1]
+
+        return volume, cumulative_volume, bin_edges
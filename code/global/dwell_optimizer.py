@@ -0,0 +1,367 @@
+#!/usr/bin/env
+# purpose: inverse planning of dwell weights against dose objectives
+
+from __future__ import division, print_function
+
+from glob import glob
+from json import load as json_load
+from os.path import basename, join
+from sys import argv
+from time import time
+
+import numpy
+
+try:
+    from scipy.optimize import nnls
+except ImportError:
+    nnls = None
+
+from dose_basis import get_basis
+from py3ddose import GridIndex
+
+# kinds of objective: the dose of a target should equal its prescription,
+# that of an organ at risk stay under its limit (and a minimum stay above)
+OBJECTIVE_KINDS = ('target', 'maximum', 'minimum')
+
+# first comment line of the weight files of write_weights: the weights give
+# the prescribed dose as they are, so construct_dose must not divide them by
+# their maximum
+ABSOLUTE_WEIGHTS = 'absolute dwell weights'
+
+
+class DoseObjective(object):
+
+    """
+    Description:
+    Dose objective on a set of voxels, given either as points or as a box.
+    The voxels of the points are those containing them; the voxels of a box
+    are those whose centres lie inside it. A target is penalised by the
+    squared deviation from its dose, a maximum (organ at risk upper limit)
+    by the squared excess over it and a minimum by the squared shortfall,
+    each averaged over the voxels of the objective and times its weight.
+
+    Inputs:
+    :param kind: one of OBJECTIVE_KINDS
+    :type kind: str
+    :param dose: prescribed dose or limit, in units of the basis dose times
+                 the scale given to optimize_weights (e.g. Gy)
+    :type dose: float
+    :param points: (n, 3) x, y and z coordinates in cm
+    :type points: numpy.ndarray
+    :param box: ((x0, x1), (y0, y1), (z0, z1)) bounds in cm
+    :type box: tuple
+    :param weight: relative importance of the objective
+    :type weight: float
+    :param name: name used in reports
+    :type name: str
+    """
+
+    def __init__(self, kind, dose, points=None, box=None, weight=1.0,
+            name=None):
+        assert kind in OBJECTIVE_KINDS, \
+        "unknown objective kind '{0}'".format(kind)
+        assert (points is None) != (box is None), \
+        "an objective needs either points or a box"
+        assert weight > 0, "objective weights must be positive"
+
+        self.kind = kind
+        self.dose = float(dose)
+        self.points = (
+            None if points is None
+            else numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+            )
+        self.box = box
+        self.weight = float(weight)
+        self.name = name or kind
+
+    def voxels(self, basis):
+        """
+        Returns the flat indices (see DoseBasis.flat_index) of the voxels of
+        the objective on the grid of basis.
+        """
+
+        if self.points is not None:
+            ix, iy, iz = GridIndex(basis.positions).voxel(
+                self.points[:, 0], self.points[:, 1], self.points[:, 2]
+                )
+            return basis.flat_index(ix, iy, iz)
+
+        centres = [(p[:-1] + p[1:]) / 2 for p in basis.positions]
+        inside = [
+            numpy.flatnonzero(
+                (c >= min(bounds)) & (c <= max(bounds))
+                )
+            for c, bounds in zip(centres, self.box)
+            ]
+        assert all(len(i) for i in inside), \
+        "the box of {0} contains no voxel centre".format(self.name)
+        ix, iy, iz = numpy.meshgrid(*inside, indexing='ij')
+        return basis.flat_index(ix.ravel(), iy.ravel(), iz.ravel())
+
+def read_objectives(file_name):
+    """
+    Description:
+    Reads dose objectives from a JSON file holding a list of objects with
+    the arguments of DoseObjective, e.g.
+
+        [{"kind": "target", "dose": 7.0, "points": [[0, 0, 2], [0, 0, 3]]},
+         {"kind": "maximum", "dose": 5.0, "weight": 10, "name": "rectum",
+          "box": [[-1, 1], [2, 3], [-2, 2]]}]
+
+    Outputs:
+    :param objectives: the objectives
+    :type objectives: list
+    """
+
+    with open(file_name) as objectives_file:
+        return [DoseObjective(**entry) for entry in json_load(objectives_file)]
+
+def _residual(kind, doses, prescription):
+    # deviations that are penalised: all of them for a target, only those
+    # above the limit for a maximum and below it for a minimum
+    residual = doses - prescription
+    if kind == 'maximum':
+        numpy.maximum(residual, 0., out=residual)
+    elif kind == 'minimum':
+        numpy.minimum(residual, 0., out=residual)
+    return residual
+
+class _Problem(object):
+
+    # the objectives reduced to the dose matrices of their voxels, which is
+    # all an iteration touches
+
+    def __init__(self, basis, objectives, scale):
+        self.terms = []
+        for objective in objectives:
+            matrix = basis.voxel_doses(objective.voxels(basis)) * scale
+            self.terms.append((
+                objective, matrix, objective.weight / len(matrix)
+                ))
+        self.size = len(basis)
+
+    def value_and_gradient(self, weights):
+        value = 0.
+        gradient = numpy.zeros(self.size)
+        for objective, matrix, factor in self.terms:
+            residual = _residual(
+                objective.kind, matrix.dot(weights), objective.dose
+                )
+            value += factor * residual.dot(residual)
+            gradient += (2 * factor) * matrix.T.dot(residual)
+        return value, gradient
+
+    def lipschitz(self):
+        # bound on the curvature of the objective: that of the problem in
+        # which every penalty is two-sided
+        hessian = numpy.zeros((self.size, self.size))
+        for __, matrix, factor in self.terms:
+            hessian += (2 * factor) * matrix.T.dot(matrix)
+        return max(numpy.linalg.eigvalsh(hessian)[-1], 1e-300)
+
+    def _stacked(self, weights=None):
+        # rows of the least squares problem of the penalties that are active
+        # at weights: all the target rows and the rows of the voxels over a
+        # maximum or under a minimum (with weights None, those of the targets
+        # and minima, or of every objective failing those)
+        matrices, doses = [], []
+        for objective, matrix, factor in self.terms:
+            if weights is None:
+                rows = objective.kind != 'maximum' or all(
+                    term[0].kind == 'maximum' for term in self.terms
+                    )
+            elif objective.kind == 'target':
+                rows = True
+            else:
+                rows = numpy.flatnonzero(_residual(
+                    objective.kind, matrix.dot(weights), objective.dose
+                    ))
+            if rows is True:
+                rows = slice(None)
+            elif rows is False:
+                continue
+            matrices.append(matrix[rows] * numpy.sqrt(factor))
+            doses.append(numpy.full(
+                len(matrices[-1]), objective.dose * numpy.sqrt(factor)
+                ))
+        return numpy.concatenate(matrices), numpy.concatenate(doses)
+
+    def initial_weights(self, rounds=50):
+        # the penalties are quadratic once it is known which voxels exceed
+        # their limits, so with scipy the non-negative least squares fit of
+        # the targets is refined by refitting the penalties active at the
+        # last fit until they no longer change, which is usually the optimum
+        # after a few rounds; without scipy equal weights scaled to the mean
+        # prescription
+        matrix, doses = self._stacked()
+        if nnls is None:
+            ones = matrix.sum(axis=1)
+            return numpy.full(
+                self.size,
+                max(ones.dot(doses), 0.) / max(ones.dot(ones), 1e-300)
+                )
+
+        weights = nnls(matrix, doses)[0]
+        for __ in range(rounds):
+            matrix, doses = self._stacked(weights)
+            updated = nnls(matrix, doses)[0]
+            if numpy.array_equal(updated, weights):
+                break
+            weights = updated
+        return weights
+
+def optimize_weights(basis, objectives, scale=1.0, max_iterations=2000,
+        tolerance=1e-8, report=False):
+    """
+    Description:
+    Solves for the non-negative dwell weights of the references of basis
+    (see dose_basis) that best meet the dose objectives, by accelerated
+    projected gradient descent (FISTA) on the sum of the objective
+    penalties (see DoseObjective), started from non-negative least squares
+    fits of the targets and of the penalties they leave active (with scipy,
+    see _Problem.initial_weights).
+
+    Only the dose of the references at the voxels of the objectives is read
+    from the basis, once, so an iteration is a few small matrix-vector
+    products whatever the size of the grid.
+
+    Inputs:
+    :param basis: dose basis of the references
+    :type basis: DoseBasis
+    :param objectives: dose objectives
+    :type objectives: list
+    :param scale: factor converting the basis dose to the dose of the
+                  objectives (e.g. Gy per history times histories)
+    :type scale: float
+    :param max_iterations: maximum number of iterations
+    :type max_iterations: int
+    :param tolerance: relative change of the weights below which the
+                      iterations stop
+    :type tolerance: float
+    :param report: print the dose achieved for each objective
+    :type report: bool
+
+    Outputs:
+    :param weights: dwell weight of each reference, in the order of basis
+    :type weights: numpy.ndarray
+    """
+
+    assert len(objectives) > 0, "nothing to optimize"
+    start = time()
+    problem = _Problem(basis, objectives, scale)
+    step = 1. / problem.lipschitz()
+
+    weights = problem.initial_weights()
+    momentum = weights.copy()
+    t = 1.
+    for iteration in range(1, max_iterations + 1):
+        __, gradient = problem.value_and_gradient(momentum)
+        updated = numpy.maximum(momentum - step * gradient, 0.)
+        change = numpy.linalg.norm(updated - weights)
+        t_next = (1. + numpy.sqrt(1. + 4. * t * t)) / 2.
+        momentum = updated + ((t - 1.) / t_next) * (updated - weights)
+        weights, t = updated, t_next
+        if change <= tolerance * max(numpy.linalg.norm(weights), 1e-300):
+            break
+
+    if report:
+        value, __ = problem.value_and_gradient(weights)
+        print("{0} iterations, objective {1:.6g}, {2:.2f} s".format(
+            iteration, value, time() - start
+            ))
+        for name, kind, dose, lower, mean, upper in evaluate_objectives(
+                basis, objectives, weights, scale):
+            print("{0} ({1} {2:g}): min {3:.4g}, mean {4:.4g}, max {5:.4g}"
+                .format(name, kind, dose, lower, mean, upper))
+
+    return weights
+
+def evaluate_objectives(basis, objectives, weights, scale=1.0):
+    """
+    Description:
+    Dose achieved at the voxels of each objective by the given weights.
+
+    Outputs:
+    :param doses: (name, kind, prescribed dose, minimum, mean, maximum) of
+                  each objective
+    :type doses: list
+    """
+
+    doses = []
+    for objective in objectives:
+        dose = basis.voxel_doses(objective.voxels(basis)).dot(weights) * scale
+        doses.append((
+            objective.name, objective.kind, objective.dose, dose.min(),
+            dose.mean(), dose.max()
+            ))
+    return doses
+
+def write_weights(file_name, weights, file_names=None):
+    """
+    Writes the weights one per line, preceded by a comment line marking them
+    as absolute (see ABSOLUTE_WEIGHTS) and comment lines naming the
+    reference file of each, in the format construct_dose reads weight files
+    in (numpy.loadtxt; see read_weights).
+    """
+    header = '\n'.join([ABSOLUTE_WEIGHTS] + [
+        basename(name) for name in (file_names or [])
+        ])
+    numpy.savetxt(file_name, weights, fmt='%.10e', header=header)
+
+def read_weights(file_name):
+    """
+    Description:
+    Reads a weight file, one weight per line (numpy.loadtxt format).
+
+    Outputs:
+    :param weights: the weights
+    :type weights: numpy.ndarray
+    :param absolute: whether the file was written by write_weights, whose
+                     weights are not to be divided by their maximum
+    :type absolute: bool
+    """
+
+    with open(file_name) as weights_file:
+        first_line = weights_file.readline()
+    absolute = first_line.lstrip('#').strip() == ABSOLUTE_WEIGHTS
+    return numpy.loadtxt(file_name, ndmin=1), absolute
+
+def main(args):
+    """
+    Description:
+    Optimizes the dwell weights of an applicator against the dose
+    objectives of a JSON file (see read_objectives) and writes them to a
+    weight file for construct_dose. Usage:
+
+        python dwell_optimizer.py reference/25mm_applicator objectives.json
+            weights.txt [--scale=S]
+
+    The dose basis of the reference files is built in the basis directory
+    of the applicator (see dose_basis) the first time.
+    """
+
+    scale = 1.0
+    for arg in args:
+        if arg.startswith('--scale='):
+            scale = float(arg.split('=', 1)[1])
+    args = [arg for arg in args if not arg.startswith('--')]
+    assert len(args) == 3, main.__doc__
+    reference_dir, objectives_name, weights_name = args
+
+    # in name order, as construct_dose reads them
+    file_names = sorted(glob(reference_dir + '/*.3ddose.gz'))
+    if not file_names:
+        print("WARNING: no reference files in {0}".format(reference_dir))
+        return 1
+    basis = get_basis(file_names, join(reference_dir, 'basis'))
+
+    weights = optimize_weights(
+        basis, read_objectives(objectives_name), scale, report=True
+        )
+    write_weights(weights_name, weights, basis.file_names)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
@@ -0,0 +1,262 @@
+#!/usr/bin/env
+# purpose: trilinear interpolation of dose grids
+
+from __future__ import division
+
+import numpy
+
+from py3ddose import DoseFile
+
+
+def _grid_arrays(dose_file, uncertainty=False):
+    # arrays to interpolate and the factor to apply to the interpolated dose;
+    # a loaded DoseFile is used as is (its lazy scale is applied to the
+    # output only), anything else is evaluated
+    if isinstance(dose_file, DoseFile) and hasattr(dose_file, 'dose'):
+        relative = dose_file.read_uncertainty() if uncertainty else None
+        return dose_file.dose, relative, dose_file.scale
+
+    if uncertainty:
+        dose, relative = dose_file.evaluate(load_uncertainty=True)
+        return dose, relative, 1.
+    return dose_file.evaluate(), None, 1.
+
+def _axis_weights(dose_file, axis, coordinates, extrapolate):
+    # index of the voxel centre at or below each coordinate and the linear
+    # weight of the next centre; flags the coordinates outside the centres
+    coordinates = numpy.asarray(coordinates, dtype=numpy.float64)
+    centre_index = dose_file.grid_index.centres[axis]
+    if centre_index is None:
+        # a single voxel along this axis: the dose is constant
+        first = numpy.zeros(coordinates.shape, dtype=numpy.intp)
+        return first, numpy.zeros(coordinates.shape), numpy.zeros(
+            coordinates.shape, dtype=bool
+            )
+
+    centres = centre_index.positions
+    first = centre_index(coordinates, mode='clip')
+    fraction = (coordinates - centres[first]) / (
+        centres[first + 1] - centres[first]
+        )
+    outside = (fraction < 0) | (fraction > 1) | numpy.isnan(coordinates)
+    if not extrapolate:
+        fraction = numpy.clip(fraction, 0., 1.)
+
+    return first, fraction, outside
+
+def _flat_view(values):
+    # 1D view of a C or F contiguous array (as loaded, the (x, y, z) arrays
+    # are transposed views) with the strides of its axes in elements, so
+    # the corners of many points can be gathered with one take each
+    if not (values.flags.c_contiguous or values.flags.f_contiguous):
+        values = numpy.ascontiguousarray(values)
+    strides = [stride // values.itemsize for stride in values.strides]
+    return values.ravel(order='K'), strides
+
+def interpolate_points(dose_file, points, uncertainty=False,
+        fill_value=numpy.nan, chunk_size=2 ** 16):
+    """
+    Description:
+    Trilinear interpolation of the dose between the voxel centres at an
+    arbitrary set of points, with the voxels either side of each point
+    looked up through the grid index of the DoseFile. The points are
+    processed in chunks so that, besides the output, only chunk-sized
+    temporaries are allocated.
+
+    Points outside the voxel centres get fill_value, or are extrapolated
+    linearly from the outermost voxels if fill_value is None (the
+    behaviour of RegularGridInterpolator with the same fill_value).
+
+    Inputs:
+    :param dose_file: dose grid (a DoseFile or a dose expression)
+    :type dose_file: DoseFile
+    :param points: (N, 3) array of x, y, z positions
+    :type points: numpy.ndarray
+    :param uncertainty: also return the propagated relative uncertainty,
+                        treating the voxels as independent
+    :type uncertainty: bool
+    :param fill_value: value of points outside the voxel centres
+    :type fill_value: float
+    :param chunk_size: points interpolated at a time
+    :type chunk_size: int
+
+    Outputs:
+    :param dose: interpolated dose at each point
+    :type dose: numpy.ndarray
+    :param relative_uncertainty: relative uncertainty at each point (only
+                                 with uncertainty=True)
+    :type relative_uncertainty: numpy.ndarray
+    """
+
+    points = numpy.asarray(points, dtype=numpy.float64)
+    shape = points.shape[:-1]
+    points = points.reshape(-1, 3)
+    dose, relative, scale = _grid_arrays(dose_file, uncertainty)
+    flat_dose, strides = _flat_view(dose)
+    if uncertainty:
+        # the uncertainty is indexed with the strides of the dose
+        relative = numpy.asarray(relative)
+        if relative.strides != dose.strides or not (
+                relative.flags.c_contiguous or relative.flags.f_contiguous):
+            relative = numpy.array(
+                relative,
+                order='F' if dose.flags.f_contiguous
+                and not dose.flags.c_contiguous else 'C'
+                )
+        flat_relative, relative_strides = _flat_view(relative)
+        assert relative_strides == strides
+
+    result = numpy.empty(len(points), dtype=dose.dtype)
+    if uncertainty:
+        result_uncertainty = numpy.empty(len(points), dtype=dose.dtype)
+
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        axes = [
+            _axis_weights(dose_file, axis, chunk[:, axis], fill_value is None)
+            for axis in range(3)
+            ]
+
+        # flat offset of the lower corner and of the step to the upper one
+        # along each axis (no step along an axis with a single voxel)
+        offset = numpy.zeros(len(chunk), dtype=numpy.intp)
+        steps = []
+        weights = []
+        for axis, (first, fraction, __) in enumerate(axes):
+            offset += first * strides[axis]
+            steps.append(
+                (numpy.minimum(first + 1, dose.shape[axis] - 1) - first)
+                * strides[axis]
+                )
+            weights.append((1. - fraction, fraction))
+
+        value = numpy.zeros(len(chunk))
+        variance = numpy.zeros(len(chunk)) if uncertainty else None
+        for x_corner in (0, 1):
+            x_offset = offset + steps[0] if x_corner else offset
+            for y_corner in (0, 1):
+                y_offset = x_offset + steps[1] if y_corner else x_offset
+                xy_weight = weights[0][x_corner] * weights[1][y_corner]
+                for z_corner in (0, 1):
+                    corner = y_offset + steps[2] if z_corner else y_offset
+                    weight = xy_weight * weights[2][z_corner]
+                    corner_dose = flat_dose.take(corner)
+                    value += weight * corner_dose
+                    if uncertainty:
+                        variance += (
+                            weight * corner_dose * flat_relative.take(corner)
+                            ) ** 2
+
+        value *= scale
+        if fill_value is not None:
+            value[axes[0][2] | axes[1][2] | axes[2][2]] = fill_value
+        result[start:start + len(chunk)] = value
+
+        if uncertainty:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                relative_chunk = numpy.sqrt(variance) * abs(scale) / abs(value)
+            relative_chunk[(value == 0) | numpy.isnan(value)] = 0.
+            result_uncertainty[start:start + len(chunk)] = relative_chunk
+
+    if uncertainty:
+        return result.reshape(shape), result_uncertainty.reshape(shape)
+    return result.reshape(shape)
+
+def _interpolate_axis(values, first, fraction, axis):
+    shape = [1] * values.ndim
+    shape[axis] = -1
+    fraction = fraction.reshape(shape)
+
+    upper = numpy.minimum(first + 1, values.shape[axis] - 1)
+    result = values.take(first, axis=axis)
+    result *= 1. - fraction
+    result += values.take(upper, axis=axis) * fraction
+
+    return result
+
+def interpolate_grid(dose_file, x=None, y=None, z=None, uncertainty=False,
+        fill_value=numpy.nan):
+    """
+    Description:
+    Trilinear interpolation of the dose onto the axis aligned grid of
+    points x by y by z (e.g. the voxel bounds), done as one linear pass per
+    axis instead of evaluating every point of a meshgrid. The axis that
+    shrinks the array most is interpolated first, so the temporaries are at
+    most the size of the larger of the source and the output.
+
+    Inputs:
+    :param dose_file: dose grid (a DoseFile or a dose expression)
+    :type dose_file: DoseFile
+    :param x: x coordinates; None for the voxel centres
+    :type x: numpy.ndarray
+    :param y: y coordinates; None for the voxel centres
+    :type y: numpy.ndarray
+    :param z: z coordinates; None for the voxel centres
+    :type z: numpy.ndarray
+    :param uncertainty: also return the propagated relative uncertainty,
+                        treating the voxels as independent
+    :type uncertainty: bool
+    :param fill_value: value outside the voxel centres, or None to
+                       extrapolate (see interpolate_points)
+    :type fill_value: float
+
+    Outputs:
+    :param dose: interpolated dose of shape (len(x), len(y), len(z))
+    :type dose: numpy.ndarray
+    :param relative_uncertainty: relative uncertainty of the same shape
+                                 (only with uncertainty=True)
+    :type relative_uncertainty: numpy.ndarray
+    """
+
+    dose, relative, scale = _grid_arrays(dose_file, uncertainty)
+
+    passes = []
+    outside = []
+    for axis, coordinates in enumerate((x, y, z)):
+        if coordinates is None:
+            outside.append(numpy.zeros(dose.shape[axis], dtype=bool))
+            continue
+        first, fraction, axis_outside = _axis_weights(
+            dose_file, axis, numpy.ravel(coordinates), fill_value is None
+            )
+        passes.append((len(first) / dose.shape[axis], axis, first, fraction))
+        outside.append(axis_outside)
+    passes.sort(key=lambda p: p[0])
+
+    result = dose
+    variance = (
+        (numpy.asarray(dose, dtype=numpy.float64) * relative) ** 2
+        if uncertainty else None
+        )
+    for __, axis, first, fraction in passes:
+        result = _interpolate_axis(result, first, fraction, axis)
+        if uncertainty:
+            # the variance of a weighted sum uses the squared weights
+            shape = [1] * 3
+            shape[axis] = -1
+            upper = numpy.minimum(first + 1, variance.shape[axis] - 1)
+            lower_variance = variance.take(first, axis=axis)
+            lower_variance *= ((1. - fraction) ** 2).reshape(shape)
+            lower_variance += variance.take(upper, axis=axis) * (
+                fraction ** 2
+                ).reshape(shape)
+            variance = lower_variance
+
+    if result is dose or scale != 1:
+        result = result * scale
+
+    outside = (
+        outside[0][:, None, None] | outside[1][None, :, None]
+        | outside[2][None, None, :]
+        )
+    if fill_value is not None and outside.any():
+        result[outside] = fill_value
+
+    if not uncertainty:
+        return result
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        relative_result = numpy.sqrt(variance) * abs(scale) / abs(result)
+    relative_result[(result == 0) | numpy.isnan(result)] = 0.
+
+    return result, relative_result.astype(result.dtype, copy=False)
@@ -0,0 +1,299 @@
+#!/usr/bin/env
+# purpose: isodose volumes and surfaces of dose grids, cached per file
+
+from __future__ import division
+
+from collections import OrderedDict
+from hashlib import sha1
+from json import dumps as json_dumps
+from os import makedirs, rename
+from os.path import abspath, isdir, isfile, join
+from threading import Lock
+
+import numpy
+
+from py3ddose import DoseFile, _cache_key
+
+try:
+    from skimage.measure import marching_cubes
+except ImportError:
+    marching_cubes = None
+
+# results of the current process, most recently used last; each entry is
+# also stored on disk, so this only saves reading the small npz files again
+_results = OrderedDict()
+_results_lock = Lock()
+MAX_RESULTS = 64
+
+
+def _isodose_path(file_name, cache_dir=None):
+    # next to the dose file, or under a hash of its path in cache_dir (as
+    # the sidecar cache of DoseFile)
+    if cache_dir is None:
+        return file_name + '.isodose'
+    return join(
+        cache_dir,
+        sha1(abspath(file_name).encode('utf-8')).hexdigest() + '.isodose'
+        )
+
+def _result_key(dose_file, kind, levels, options):
+    # digest identifying a result; None if the dose is not that of an
+    # unmodified file on disk (arrays, expressions), which is never cached
+    if not isinstance(dose_file, DoseFile):
+        return None
+    file_name = dose_file.file_name
+    if file_name is None or not isfile(file_name):
+        return None
+
+    key = {
+        'file': _cache_key(file_name),
+        'dtype': dose_file.dtype.str,
+        'scale': float(dose_file.scale),
+        'kind': kind,
+        'levels': [float(level) for level in levels],
+        'options': options
+        }
+    return sha1(json_dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _load_result(dose_file, digest, cache_dir):
+    with _results_lock:
+        if digest in _results:
+            _results[digest] = _results.pop(digest)
+            return _results[digest]
+
+    result_path = join(
+        _isodose_path(dose_file.file_name, cache_dir), digest + '.npz'
+        )
+    try:
+        with numpy.load(result_path) as result_file:
+            result = dict(result_file.items())
+    except (IOError, OSError, ValueError):
+        return None
+
+    _remember(digest, result)
+    return result
+
+def _store_result(dose_file, digest, result, cache_dir):
+    _remember(digest, result)
+
+    # write under a scratch name first so that an interrupted write never
+    # leaves a result that looks valid
+    result_dir = _isodose_path(dose_file.file_name, cache_dir)
+    result_path = join(result_dir, digest + '.npz')
+    try:
+        if not isdir(result_dir):
+            makedirs(result_dir)
+        with open(result_path + '.tmp', 'wb') as result_file:
+            numpy.savez(result_file, **result)
+        rename(result_path + '.tmp', result_path)
+    except (IOError, OSError) as error:
+        print("WARNING: Could not write isodose cache {0} ({1})".format(
+            result_path, error
+            ))
+
+def _remember(digest, result):
+    with _results_lock:
+        _results.pop(digest, None)
+        _results[digest] = result
+        while len(_results) > MAX_RESULTS:
+            _results.popitem(last=False)
+
+def clear_memory():
+    """
+    Forgets the results held by this process; they are then read from the
+    files on disk again.
+    """
+    with _results_lock:
+        _results.clear()
+
+def dose_levels(levels, reference=None):
+    """
+    Description:
+    Isodose levels in the units of the dose, as isodose_volumes reads them.
+
+    Inputs:
+    :param levels: isodose levels, in the units of the dose or in percent
+                   of reference
+    :type levels: list
+    :param reference: dose of the 100 % level, if levels are in percent
+    :type reference: float
+
+    Outputs:
+    :param levels: the levels as a float64 array in the units of the dose
+    :type levels: numpy.ndarray
+    """
+    levels = numpy.array(levels, dtype=numpy.float64, ndmin=1)
+    if reference is not None:
+        levels *= reference / 100.
+    return levels
+
+def isodose_volumes(dose_file, levels, reference=None, nz=8, cache=True,
+        cache_dir=None):
+    """
+    Description:
+    Volume enclosed by each isodose level, i.e. the volume of the voxels
+    receiving at least that dose (V100, V50, ... with reference set to the
+    prescribed dose). Every level is done in the same single pass over the
+    grid, streamed in z-slabs: each voxel is placed among the sorted levels
+    by a binary search and its volume added to that bin, and the enclosed
+    volumes are the cumulative sums of the bins from the top.
+
+    Results for a DoseFile read from disk are cached, in memory and in a
+    .isodose directory next to the file (or in cache_dir), per file version,
+    scale and level set.
+
+    Inputs:
+    :param dose_file: dose grid (a DoseFile or a dose expression)
+    :type dose_file: DoseFile
+    :param levels: isodose levels, in the units of the dose or in percent of
+                   reference
+    :type levels: list
+    :param reference: dose of the 100 % level, if levels are in percent
+    :type reference: float
+    :param nz: z planes per slab
+    :type nz: int
+    :param cache: use and update the cached results
+    :type cache: bool
+    :param cache_dir: directory holding the cached results (default: next
+                      to the dose file)
+    :type cache_dir: str
+
+    Outputs:
+    :param volumes: enclosed volume of each level in cm^3, in the order of
+                    levels
+    :type volumes: numpy.ndarray
+    """
+
+    levels = dose_levels(levels, reference)
+    digest = _result_key(
+        dose_file, 'volumes', levels, {}
+        ) if cache else None
+    if digest is not None:
+        result = _load_result(dose_file, digest, cache_dir)
+        if result is not None:
+            return result['volumes'].copy()
+
+    order = numpy.argsort(levels)
+    sorted_levels = levels[order]
+
+    # voxel volumes; a uniform grid only needs the voxel counts
+    bounds = dose_file.grid_index.bounds
+    uniform = all(axis.uniform for axis in bounds)
+    if uniform:
+        voxel_volume = numpy.prod([axis.step for axis in bounds])
+    else:
+        x_pos, y_pos, z_pos = dose_file.positions
+        area = numpy.outer(numpy.diff(x_pos), numpy.diff(y_pos))[:, :, None]
+        z_widths = numpy.diff(z_pos)
+
+    # bin b holds the voxels with exactly b levels at or below their dose
+    bin_volumes = numpy.zeros(len(levels) + 1)
+    for z_index, slab in dose_file.iter_slabs(nz):
+        bins = sorted_levels.searchsorted(slab, side='right')
+        # voxels without a dose (e.g. 0 / 0 in a ratio) enclose nothing
+        bins[numpy.isnan(slab)] = 0
+        if uniform:
+            bin_volumes += numpy.bincount(
+                bins.ravel(), minlength=len(levels) + 1
+                )
+        else:
+            weights = area * z_widths[z_index:z_index + slab.shape[2]]
+            bin_volumes += numpy.bincount(
+                bins.ravel(), weights=weights.ravel(),
+                minlength=len(levels) + 1
+                )
+    if uniform:
+        bin_volumes *= voxel_volume
+
+    volumes = numpy.empty(len(levels))
+    volumes[order] = bin_volumes[::-1].cumsum()[::-1][1:]
+
+    if digest is not None:
+        _store_result(dose_file, digest, {'volumes': volumes}, cache_dir)
+
+    return volumes.copy()
+
+def isodose_surfaces(dose_file, levels, reference=None, step_size=1,
+        cache=True, cache_dir=None):
+    """
+    Description:
+    Triangulated isodose surfaces, extracted with marching cubes
+    (scikit-image) from the dose at the voxel centres. A level outside the
+    range of the dose has no surface and gives empty arrays. Cached like
+    isodose_volumes; the cached arrays are returned as is, so copy them
+    before modifying them.
+
+    Inputs:
+    :param dose_file: dose grid (a DoseFile or a dose expression)
+    :type dose_file: DoseFile
+    :param levels: isodose levels, in the units of the dose or in percent of
+                   reference
+    :type levels: list
+    :param reference: dose of the 100 % level, if levels are in percent
+    :type reference: float
+    :param step_size: voxels per marching cubes step; larger is coarser and
+                      faster
+    :type step_size: int
+    :param cache: use and update the cached results
+    :type cache: bool
+    :param cache_dir: directory holding the cached results (default: next
+                      to the dose file)
+    :type cache_dir: str
+
+    Outputs:
+    :param surfaces: (vertices, faces) of each level, in the order of levels,
+                     with the vertices as (n, 3) x, y, z positions in cm and
+                     the faces as (m, 3) indices into the vertices
+    :type surfaces: list
+    """
+
+    if marching_cubes is None:
+        raise ImportError(
+            "isodose_surfaces needs scikit-image (skimage.measure)"
+            )
+
+    levels = dose_levels(levels, reference)
+    digest = _result_key(
+        dose_file, 'surfaces', levels, {'step_size': step_size}
+        ) if cache else None
+    result = None
+    if digest is not None:
+        result = _load_result(dose_file, digest, cache_dir)
+
+    if result is None:
+        assert min(dose_file.shape) > 1, \
+        "marching cubes needs at least 2 voxels along each axis, not {0}".format(
+            dose_file.shape
+            )
+        dose = dose_file.evaluate()
+        lower, upper = numpy.nanmin(dose), numpy.nanmax(dose)
+        centres = [(p[:-1] + p[1:]) / 2. for p in dose_file.positions]
+
+        result = {}
+        for number, level in enumerate(levels):
+            if not lower < level < upper:
+                vertices = numpy.empty((0, 3))
+                faces = numpy.empty((0, 3), dtype=numpy.intp)
+            else:
+                vertices, faces = marching_cubes(
+                    dose, level, step_size=step_size
+                    )[:2]
+                # from fractional voxel indices to positions
+                vertices = numpy.column_stack([
+                    numpy.interp(
+                        vertices[:, axis], numpy.arange(len(centres[axis])),
+                        centres[axis]
+                        )
+                    for axis in range(3)
+                    ])
+            result['vertices_{0}'.format(number)] = vertices
+            result['faces_{0}'.format(number)] = faces
+
+        if digest is not None:
+            _store_result(dose_file, digest, result, cache_dir)
+
+    return [
+        (result['vertices_{0}'.format(number)],
+         result['faces_{0}'.format(number)])
+        for number in range(len(levels))
+        ]
@@ -0,0 +1,272 @@
+#!/usr/bin/env
+# purpose: multi-member gzip writing and threaded gzip decompression
+
+from __future__ import division
+
+from collections import deque
+from struct import pack, unpack
+from threading import Thread, Event
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from zlib import (
+    compressobj, decompressobj, crc32, DEFLATED, MAX_WBITS, Z_FINISH
+    )
+
+try:
+    from queue import Queue, Full, Empty
+except ImportError:  # python 2
+    from Queue import Queue, Full, Empty
+
+# gzip extra subfield holding the total size of the member it belongs to, so
+# that the members of a file can be located without inflating them (the same
+# idea as the BGZF 'BC' subfield, with an 8 byte size for large members)
+MEMBER_SIZE_ID = b'DZ'
+
+
+def gzip_member(data, level=6):
+    """
+    Description:
+    Compresses data into one complete gzip member whose header records the
+    size of the member. Concatenated members form a valid multi-member gzip
+    file that gzip/zcat read as a single stream.
+
+    Inputs:
+    :param data: bytes to compress
+    :type data: bytes
+    :param level: zlib compression level
+    :type level: int
+
+    Outputs:
+    :param member: gzip member
+    :type member: bytes
+    """
+
+    compressor = compressobj(level, DEFLATED, -MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush(Z_FINISH)
+
+    # ID1 ID2 CM FLG(FEXTRA) MTIME XFL OS XLEN, subfield SI1 SI2 LEN size
+    header_size = 10 + 2 + 12
+    trailer_size = 8
+    member_size = header_size + len(deflated) + trailer_size
+    header = (
+        b'\x1f\x8b\x08\x04' + pack('<I', 0) + b'\x00\xff' + pack('<H', 12)
+        + MEMBER_SIZE_ID + pack('<H', 8) + pack('<Q', member_size)
+        )
+    trailer = pack('<II', crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+    return header + deflated + trailer
+
+def find_members(file_name):
+    """
+    Description:
+    Locates the members of a gzip file written with gzip_member by hopping
+    from header to header.
+
+    Inputs:
+    :param file_name: path to the gzip file
+    :type file_name: str
+
+    Outputs:
+    :param members: (start, stop) byte ranges of the members, or None if any
+                    member does not record its size
+    :type members: list
+    """
+
+    members = []
+    with open(file_name, 'rb') as raw_file:
+        offset = 0
+        while True:
+            raw_file.seek(offset)
+            header = raw_file.read(12)
+            if not header:
+                return members
+            if (len(header) < 12 or header[:3] != b'\x1f\x8b\x08'
+                    or not ord(header[3:4]) & 4):
+                return None
+
+            extra_length, = unpack('<H', header[10:12])
+            extra = raw_file.read(extra_length)
+            member_size = None
+            position = 0
+            while position + 4 <= len(extra):
+                subfield_length, = unpack('<H', extra[position + 2:position + 4])
+                if (extra[position:position + 2] == MEMBER_SIZE_ID
+                        and subfield_length == 8):
+                    member_size, = unpack(
+                        '<Q', extra[position + 4:position + 12]
+                        )
+                position += 4 + subfield_length
+            if member_size is None:
+                return None
+
+            members.append((offset, offset + member_size))
+            offset += member_size
+
+def _inflate_range(file_name, start, stop):
+    with open(file_name, 'rb') as raw_file:
+        raw_file.seek(start)
+        data = raw_file.read(stop - start)
+    decompressor = decompressobj(16 + MAX_WBITS)
+    inflated = decompressor.decompress(data)
+    assert decompressor.eof, \
+    "gzip member at byte {0} of {1} is truncated".format(start, file_name)
+    return inflated
+
+def _inflate_members(file_name, members, threads):
+    # a sliding window of pending members keeps at most a few inflated
+    # members in memory while the pool works ahead of the consumer
+    threads = threads or cpu_count()
+    pool = ThreadPool(threads)
+    window = 2 * threads
+    pending = deque()
+    try:
+        for start, stop in members:
+            pending.append(
+                pool.apply_async(_inflate_range, (file_name, start, stop))
+                )
+            if len(pending) > window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _inflate_sequential(file_name, chunk_size):
+    with open(file_name, 'rb') as raw_file:
+        decompressor = decompressobj(16 + MAX_WBITS)
+        while True:
+            data = raw_file.read(chunk_size)
+            if not data:
+                break
+            while data:
+                inflated = decompressor.decompress(data)
+                if inflated:
+                    yield inflated
+                if not decompressor.eof:
+                    break
+                # the next member starts right after this one
+                data = decompressor.unused_data
+                decompressor = decompressobj(16 + MAX_WBITS)
+
+class InflateStream(object):
+
+    """
+    Description:
+    Read-only file-like object over the decompressed contents of a gzip
+    file. Decompression runs ahead of the reader in a background thread so
+    that inflating the next chunk overlaps with processing the current one
+    (zlib releases the GIL while inflating). If the members of the file are
+    known (from find_members or an index) and there is more than one, they
+    are inflated in parallel in a thread pool.
+
+    Inputs:
+    :param file_name: path to the gzip file
+    :type file_name: str
+    :param threads: number of threads for parallel member inflation
+                    (default: all cores)
+    :type threads: int
+    :param members: (start, stop) byte ranges of the members; looked up
+                    with find_members if not given
+    :type members: list
+    :param chunk_size: compressed bytes inflated at a time for files that
+                       cannot be split into members
+    :type chunk_size: int
+    :param prefetch: number of inflated chunks buffered ahead of the reader
+    :type prefetch: int
+    """
+
+    def __init__(self, file_name, threads=None, members=None,
+            chunk_size=2 ** 20, prefetch=4):
+        if members is None:
+            members = find_members(file_name)
+
+        if members is not None and len(members) > 1 and threads != 1:
+            chunks = _inflate_members(file_name, members, threads)
+        else:
+            chunks = _inflate_sequential(file_name, chunk_size)
+
+        self._queue = Queue(maxsize=prefetch)
+        self._stop = Event()
+        self._thread = Thread(target=self._produce, args=(chunks,))
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._chunk = b''
+        self._position = 0
+        self._finished = False
+
+    def _produce(self, chunks):
+        try:
+            for chunk in chunks:
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put((chunk, None), timeout=0.1)
+                        break
+                    except Full:
+                        continue
+                if self._stop.is_set():
+                    return
+            item = (None, None)
+        except Exception as error:
+            item = (None, error)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def _next_chunk(self):
+        if self._finished:
+            return False
+        chunk, error = self._queue.get()
+        if error is not None:
+            self._finished = True
+            raise error
+        if chunk is None:
+            self._finished = True
+            return False
+        self._chunk = chunk
+        self._position = 0
+        return True
+
+    def read(self, size=-1):
+        """
+        Returns up to size decompressed bytes (everything left if size is
+        negative); an empty result means the end of the stream.
+        """
+        if size is None or size < 0:
+            pieces = [self._chunk[self._position:]]
+            while self._next_chunk():
+                pieces.append(self._chunk)
+            self._chunk = b''
+            self._position = 0
+            return b''.join(pieces)
+
+        while self._position >= len(self._chunk):
+            if not self._next_chunk():
+                return b''
+        data = self._chunk[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._stop.set()
+        # unblock the producer if it is waiting on a full queue
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Empty:
+            pass
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
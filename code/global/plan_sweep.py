@@ -0,0 +1,200 @@
+#!/usr/bin/env
+# purpose: summary metrics of many dwell weight sets in one pass over a basis
+
+from __future__ import division, print_function
+
+from glob import glob
+from os.path import join
+from sys import argv
+from time import time
+
+import numpy
+
+from dose_basis import get_basis
+from isodose import dose_levels
+from py3ddose import GridIndex
+
+
+def sweep_plans(basis, weights, points=None, levels=(), reference=None,
+        scale=1.0, nz=None):
+    """
+    Description:
+    Summary metrics of K plans, i.e. K weight vectors of the references of
+    basis (see dose_basis), without building their dose grids. The basis is
+    streamed in z-slabs and the doses of all the plans in a slab are one
+    float32 matrix product, (K, N) weights by (N, slab) basis, of which only
+    the maxima and the isodose volumes are kept; the doses at the points are
+    read from the basis at their voxels only.
+
+    The weights of each plan are used as given (construct_dose divides its
+    weights by their maximum first, except for the absolute weights of
+    dwell_optimizer.write_weights).
+
+    Inputs:
+    :param basis: dose basis of the references
+    :type basis: DoseBasis
+    :param weights: (K, N) weights, one plan per row
+    :type weights: numpy.ndarray
+    :param points: (P, 3) x, y and z coordinates in cm of reference points;
+                   the dose of a point is that of the voxel containing it
+    :type points: numpy.ndarray
+    :param levels: isodose levels, in the units of the dose or in percent of
+                   reference (see isodose.isodose_volumes)
+    :type levels: list
+    :param reference: dose of the 100 % level, if levels are in percent
+    :type reference: float
+    :param scale: factor applied to the basis dose (e.g. to Gy)
+    :type scale: float
+    :param nz: z planes per slab; by default about 2**22 doses per slab over
+               all the plans
+    :type nz: int
+
+    Outputs:
+    :param max_dose: maximum dose of each plan, (K,)
+    :type max_dose: numpy.ndarray
+    :param point_doses: dose of each plan at each point, (K, P)
+    :type point_doses: numpy.ndarray
+    :param volumes: volume in cm^3 enclosed by each isodose level for each
+                    plan, (K, L)
+    :type volumes: numpy.ndarray
+    """
+
+    weights = numpy.array(weights, dtype=numpy.float64, ndmin=2)
+    assert weights.shape[1] == len(basis), \
+    "{0} weights per plan for a basis of {1} references".format(
+        weights.shape[1], len(basis)
+        )
+    plans = len(weights)
+    x, y, z = basis.shape
+    if nz is None:
+        nz = max(1, 2 ** 22 // (plans * x * y))
+
+    if points is None:
+        point_doses = numpy.empty((plans, 0))
+    else:
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        ix, iy, iz = GridIndex(basis.positions).voxel(
+            points[:, 0], points[:, 1], points[:, 2]
+            )
+        point_doses = basis.voxel_doses(
+            basis.flat_index(ix, iy, iz)
+            ).dot(weights.T).T * scale
+
+    # float32, the type of the doses, so that no slab is converted
+    levels = dose_levels(levels, reference).astype(numpy.float32)
+    volumes = numpy.zeros((plans, len(levels)))
+
+    # voxel volumes; a uniform grid only needs the voxel counts
+    grid_index = GridIndex(basis.positions)
+    uniform = all(axis.uniform for axis in grid_index.bounds)
+    if not uniform:
+        x_pos, y_pos, z_pos = basis.positions
+        # (y, x) areas, as the basis is stored in (z, y, x) order
+        area = numpy.outer(numpy.diff(y_pos), numpy.diff(x_pos)).ravel()
+        z_widths = numpy.diff(z_pos)
+
+    # the normalisation of the basis goes into the weights, which are
+    # float32 so that the product stays in single precision
+    plan_weights = (weights * (basis.scales * scale)).astype(numpy.float32)
+    max_dose = numpy.full(plans, -numpy.inf)
+
+    for z_index, slab in basis.slabs(nz):
+        planes = min(nz, z - z_index)
+        doses = numpy.dot(plan_weights, slab)
+        numpy.maximum(max_dose, doses.max(axis=1), out=max_dose)
+        if not uniform:
+            voxel_volumes = numpy.outer(
+                z_widths[z_index:z_index + planes], area
+                ).ravel()
+        # a comparison per level is several times faster than placing each
+        # voxel among the levels by a binary search (as isodose_volumes
+        # does) for the few levels of a sweep
+        for number, level in enumerate(levels):
+            enclosed = doses >= level
+            if uniform:
+                volumes[:, number] += numpy.count_nonzero(enclosed, axis=1)
+            else:
+                volumes[:, number] += enclosed.dot(voxel_volumes)
+    if uniform:
+        volumes *= numpy.prod([axis.step for axis in grid_index.bounds])
+
+    return max_dose, point_doses, volumes
+
+def main(args):
+    """
+    Description:
+    Prints the summary metrics (see sweep_plans) of the plans of a weight
+    file, one plan per row (numpy.loadtxt format), for an applicator.
+    Usage:
+
+        python plan_sweep.py reference/25mm_applicator plans.txt
+            [--points=points.txt] [--levels=L1,L2,...] [--reference=D]
+            [--scale=S] [--output=metrics.txt]
+
+    The points file holds x, y and z in cm, one point per row; with
+    --reference the levels are in percent of it. --output also writes the
+    table with numpy.savetxt. The dose basis of the reference files is
+    built in the basis directory of the applicator (see dose_basis) the
+    first time.
+    """
+
+    options = dict(
+        arg[2:].split('=', 1) for arg in args if arg.startswith('--')
+        )
+    args = [arg for arg in args if not arg.startswith('--')]
+    assert len(args) == 2, main.__doc__
+    reference_dir, plans_name = args
+
+    # in name order, as construct_dose reads them
+    file_names = sorted(glob(reference_dir + '/*.3ddose.gz'))
+    if not file_names:
+        print("WARNING: no reference files in {0}".format(reference_dir))
+        return 1
+    basis = get_basis(file_names, join(reference_dir, 'basis'))
+
+    weights = numpy.loadtxt(plans_name, ndmin=2)
+    if weights.shape == (len(basis), 1):
+        # a single plan written one weight per line (see
+        # dwell_optimizer.write_weights)
+        weights = weights.T
+    points = (
+        numpy.loadtxt(options['points'], ndmin=2)
+        if 'points' in options else None
+        )
+    levels = [
+        float(level) for level in options.get('levels', '').split(',')
+        if level
+        ]
+    reference = (
+        float(options['reference']) if 'reference' in options else None
+        )
+
+    start = time()
+    max_dose, point_doses, volumes = sweep_plans(
+        basis, weights, points, levels, reference,
+        float(options.get('scale', 1.0))
+        )
+    print("{0} plans in {1:.2f} s".format(len(weights), time() - start))
+
+    columns = ['plan', 'max_dose'] + [
+        'point_{0}'.format(number) for number in range(point_doses.shape[1])
+        ] + ['V({0:g})'.format(level) for level in levels]
+    table = numpy.column_stack((
+        numpy.arange(len(weights)), max_dose, point_doses, volumes
+        ))
+    print('\t'.join(columns))
+    for row in table:
+        print('\t'.join(['{0:d}'.format(int(row[0]))] + [
+            '{0:.6g}'.format(value) for value in row[1:]
+            ]))
+    if 'output' in options:
+        numpy.savetxt(
+            options['output'], table, fmt='%.10g', delimiter='\t',
+            header='\t'.join(columns)
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    main(argv[1:])
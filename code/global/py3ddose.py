@@ -5,133 +5,2112 @@
 
 from __future__ import division
 
-from gzip import open as gOpen
+from bisect import bisect_right
+from gzip import GzipFile
+from hashlib import sha1
+from itertools import repeat
+from json import dump as json_dump, load as json_load
+from multiprocessing.pool import ThreadPool
+from numbers import Number
+from os import stat, makedirs, rename
+from os.path import abspath, isdir, isfile, join
+from shutil import rmtree
+from zipfile import ZipFile, ZIP_STORED
+from zlib import decompressobj, MAX_WBITS
 
 import numpy
+from numpy.lib.format import (
+    read_magic, read_array_header_1_0, read_array_header_2_0
+    )
 
+from dose_store import DoseStore, STORE_EXTENSION, write_store
+from dose_summary import read_summary, summarize, write_summary
+from parallel_gzip import InflateStream, gzip_member
 
-def position_to_index(p, A):
+try:
+    from itertools import izip
+except ImportError:  # python 3
+    izip = zip
+
+
+def position_to_index(p, A, mode='raise'):
     """
     Description:
-    Checks entire position array A until it finds the smallest value that is 
-    less than the input position p and gives out the index of that position.
+    Gives the index i of the interval [A[i], A[i+1]) of the increasing
+    position array A that contains the position p. Uses a binary search, so
+    for repeated lookups on the same array an AxisIndex is faster still.
     
     Inputs:
+    :param p: position(s) to look up
+    :type p: float or array_like
+    :param A: increasing positions (bounds or voxel centres)
+    :type A: numpy.ndarray
+    :param mode: out of range behaviour, see AxisIndex
+    :type mode: str
+
+    Outputs:
+    :param index: interval index (or array of indices)
+    :type index: int or numpy.ndarray
+    """
+
+    A = numpy.asarray(A)
+    index = A.searchsorted(p, side='right') - 1
+
+    return _finish_lookup(p, index, len(A) - 1, A[0], A[-1], mode)
+
+def _finish_lookup(p, index, size, lower, upper, mode):
+    if numpy.ndim(index) == 0 and 0 <= index < size:
+        return int(index)
+
+    outside = (index < 0) | (index >= size)
+    if numpy.any(outside):
+        if mode == 'raise':
+            raise ValueError(
+                "position(s) {0} outside of the grid [{1}, {2})".format(
+                    numpy.asarray(p)[outside], lower, upper
+                    )
+                )
+        elif mode == 'clip':
+            index = numpy.clip(index, 0, size - 1)
+        elif mode == 'mask':
+            index = numpy.where(outside, -1, index)
+        else:
+            raise ValueError("unknown mode '{0}'".format(mode))
+
+    if numpy.ndim(index) == 0:
+        return int(index)
+    return index
+
+class AxisIndex(object):
+
+    """
+    Description:
+    Constant time lookup of the interval [A[i], A[i+1]) of an increasing
+    position array that contains a position. If the spacing is uniform (to
+    rtol) the index is computed arithmetically and corrected by one step
+    against the stored positions, so the result is exactly that of
+    position_to_index; otherwise the lookup falls back to a binary search.
+
+    Inputs:
+    :param positions: increasing positions (bounds or voxel centres)
+    :type positions: numpy.ndarray
+    :param rtol: relative tolerance on the spacing for the uniform path
+    :type rtol: float
+    """
+
+    def __init__(self, positions, rtol=1e-6):
+        self.positions = numpy.asarray(positions, dtype=numpy.float64)
+        self.size = len(self.positions) - 1
+        assert self.size > 0, "need at least two positions"
+
+        spacing = numpy.diff(self.positions)
+        assert (spacing > 0).all(), "positions must be increasing"
+        self.step = spacing.mean()
+        self.uniform = numpy.allclose(spacing, self.step, rtol=rtol, atol=0)
+        # python floats for the scalar path, which skips numpy's per call
+        # overhead
+        self._bounds = self.positions.tolist()
+
+    def __call__(self, p, mode='raise'):
+        """
+        Returns the interval index of the position(s) p. Positions outside
+        [A[0], A[-1]) raise a ValueError with mode='raise', are moved to the
+        first or last interval with mode='clip' and give -1 with mode='mask'.
+        """
+        A = self.positions
+        if self.uniform and isinstance(p, (int, float)):
+            bounds = self._bounds
+            if bounds[0] <= p < bounds[-1]:
+                index = min(int((p - bounds[0]) / self.step), self.size - 1)
+                if p < bounds[index]:
+                    index -= 1
+                elif p >= bounds[index + 1]:
+                    index += 1
+                return index
+            return _finish_lookup(
+                p, -1 if p < bounds[0] else self.size, self.size,
+                bounds[0], bounds[-1], mode
+                )
+
+        if not self.uniform:
+            index = numpy.searchsorted(A, p, side='right') - 1
+            return _finish_lookup(p, index, self.size, A[0], A[-1], mode)
+
+        p = numpy.asarray(p, dtype=numpy.float64)
+        with numpy.errstate(invalid='ignore'):
+            index = numpy.floor(
+                numpy.clip((p - A[0]) / self.step, -1, self.size)
+                ).astype(numpy.intp)
+        # the arithmetic guess can be one off at a bound because of rounding
+        guess = numpy.clip(index, 0, self.size - 1)
+        index = numpy.where(
+            (index >= 0) & (p < A[guess]), index - 1, index
+            )
+        index = numpy.where(
+            (index < self.size) & (p >= A[guess + 1]), index + 1, index
+            )
+        # outside of the grid (this also catches nan)
+        index = numpy.where(
+            (p >= A[0]) & (p < A[-1]), index, numpy.where(p < A[0], -1, self.size)
+            )
+
+        return _finish_lookup(p, index, self.size, A[0], A[-1], mode)
+
+class GridIndex(object):
+
+    """
+    Description:
+    Position to voxel lookups on the grid of a DoseFile, with an AxisIndex
+    per axis for the bounds (the voxel containing a point) and one for the
+    voxel centres (the centre at or below a point, as used to pick the
+    voxels either side of a point for interpolation).
+
+    Inputs:
+    :param positions: x, y and z bounds of the grid
+    :type positions: list
+    """
+
+    def __init__(self, positions):
+        self.bounds = [AxisIndex(p) for p in positions]
+        self.centres = [
+            AxisIndex((p[:-1] + p[1:]) / 2.) if len(p) > 2 else None
+            for p in positions
+            ]
+
+    def voxel(self, x, y, z, mode='raise'):
+        """
+        Returns the (ix, iy, iz) indices of the voxels containing the points
+        (x, y, z); the coordinates may be scalars or arrays. See AxisIndex
+        for mode.
+        """
+        return tuple(
+            axis(p, mode) for axis, p in zip(self.bounds, (x, y, z))
+            )
+
+    def centre(self, x, y, z, mode='raise'):
+        """
+        Returns the (ix, iy, iz) indices of the voxel centres at or below the
+        points (x, y, z). See AxisIndex for mode.
+        """
+        return tuple(
+            axis(p, mode) for axis, p in zip(self.centres, (x, y, z))
+            )
+
+def _open_3ddose(file_name, threads=None):
+    """
+    Description:
+    Opens a .3ddose or .3ddose.gz file for reading in binary mode. Gzip input
+    is decompressed ahead of the reader in background threads, in parallel
+    when the gzip members of the file can be located (see
+    parallel_gzip.InflateStream).
+
+    Inputs:
+    :param file_name: path to the dose file
+    :type file_name: str
+    :param threads: number of decompression threads (default: all cores)
+    :type threads: int
+
+    Outputs:
+    :param data_file: open file object yielding decompressed bytes
+    :type data_file: file
+    """
+
+    if file_name[-3:] == '.gz':
+        return InflateStream(
+            file_name, threads, members=_index_members(file_name)
+            )
+    return open(file_name, 'rb')
+
+class _ValueReader(object):
+
+    """
+    Description:
+    Tokenizes the whitespace separated numbers of an open 3ddose file chunk
+    by chunk, so that only one chunk of text and the values asked for are
+    held in memory at a time.
+
+    Inputs:
+    :param data_file: file object opened in binary mode
+    :type data_file: file
+    :param chunk_size: number of bytes read from the file at a time
+    :type chunk_size: int
+    :param limit: number of bytes to read at most, e.g. up to the end of a
+                  block known from the byte-offset index
+    :type limit: int
+    """
+
+    def __init__(self, data_file, chunk_size=2 ** 22, limit=None):
+        self.data_file = data_file
+        self.chunk_size = chunk_size
+        self.limit = limit
+        self._values = numpy.empty(0)
+        self._next = 0
+        self._tail = b''
+
+    def _fill(self):
+        # keep reading until a chunk holds at least one complete number; a
+        # number cut by the chunk boundary is carried over to the next read
+        while True:
+            size = self.chunk_size
+            if self.limit is not None:
+                size = min(size, self.limit)
+            chunk = self.data_file.read(size) if size > 0 else b''
+            if self.limit is not None:
+                self.limit -= len(chunk)
+            data = self._tail + chunk
+            if chunk:
+                split = max(data.rfind(c) for c in (b' ', b'\n', b'\t', b'\r'))
+                self._tail = data[split + 1:]
+                data = data[:split + 1]
+            else:
+                self._tail = b''
+            # fromstring turns a whitespace only string into [-1.]
+            if data.strip():
+                self._values = numpy.fromstring(
+                    data, dtype=numpy.float64, sep=' '
+                    )
+                self._next = 0
+                return True
+            if not chunk:
+                return False
+
+    def read(self, count, dtype=numpy.float64):
+        """
+        Returns the next count values as an array of the given type.
+        """
+        values = numpy.empty(count, dtype=dtype)
+        filled = 0
+        while filled < count:
+            if self._next >= len(self._values) and not self._fill():
+                break
+            piece = self._values[self._next:self._next + count - filled]
+            values[filled:filled + len(piece)] = piece
+            self._next += len(piece)
+            filled += len(piece)
+
+        assert filled == count, \
+        "read {0} values (expected {1})".format(filled, count)
+        return values
+
+    def skip(self, count):
+        """
+        Discards the next count values without keeping them.
+        """
+        needed = count
+        while needed > 0:
+            if self._next >= len(self._values) and not self._fill():
+                break
+            step = min(needed, len(self._values) - self._next)
+            self._next += step
+            needed -= step
+        assert needed == 0, \
+        "could not skip {0} values (missing {1})".format(count, needed)
+
+def _cache_key(file_name):
+    """
+    Description:
+    Identifies the current version of a source dose file by its absolute
+    path, size and modification time. A sidecar cache is only reused when its
+    stored key matches this one.
+
+    Inputs:
+    :param file_name: path to the source dose file
+    :type file_name: str
+
+    Outputs:
+    :param key: source path, size in bytes and mtime
+    :type key: dict
+    """
+
+    file_stat = stat(file_name)
+    return {
+        'source': abspath(file_name),
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime
+        }
+
+def _cache_path(file_name, cache_dir=None):
+    """
+    Description:
+    Location of the sidecar cache for a dose file. By default the cache sits
+    next to the file (<file_name>.cache); if cache_dir is given the cache is
+    placed there under a hash of the absolute source path.
+
+    Inputs:
+    :param file_name: path to the source dose file
+    :type file_name: str
+    :param cache_dir: optional directory holding all caches
+    :type cache_dir: str
+
+    Outputs:
+    :param cache_path: directory holding the cached blocks
+    :type cache_path: str
+    """
+
+    if cache_dir is None:
+        return file_name + '.cache'
+    return join(
+        cache_dir, sha1(abspath(file_name).encode('utf-8')).hexdigest()
+        )
+
+def _pyramid_path(file_name, cache_dir=None):
+    # the pyramid of coarser levels sits next to the sidecar cache
+    if cache_dir is None:
+        return file_name + '.pyramid'
+    return join(
+        cache_dir,
+        sha1(abspath(file_name).encode('utf-8')).hexdigest() + '.pyramid'
+        )
+
+def _mmap_npz_member(file_name, member, mmap_mode='c'):
+    """
+    Description:
+    Memory maps one array of an uncompressed .npz archive in place. Members
+    written with numpy.savez are stored without compression, so the .npy
+    payload is a contiguous run of bytes inside the zip file.
+
+    Inputs:
+    :param file_name: path to the .npz archive
+    :type file_name: str
+    :param member: name of the array (without the .npy suffix)
+    :type member: str
+    :param mmap_mode: mode passed on to numpy.memmap
+    :type mmap_mode: str
+
+    Outputs:
+    :param array: memory mapped array, or None if the member is compressed
+    :type array: numpy.memmap
+    """
+
+    with ZipFile(file_name) as archive:
+        info = archive.getinfo(member + '.npy')
+    if info.compress_type != ZIP_STORED:
+        return None
+
+    with open(file_name, 'rb') as npz_file:
+        # skip the local file header, whose name and extra field lengths may
+        # differ from those in the central directory
+        npz_file.seek(info.header_offset + 26)
+        name_length, extra_length = numpy.frombuffer(
+            npz_file.read(4), dtype='<u2'
+            )
+        npz_file.seek(
+            info.header_offset + 30 + int(name_length) + int(extra_length)
+            )
+
+        version = read_magic(npz_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = read_array_header_1_0(npz_file)
+        else:
+            shape, fortran_order, dtype = read_array_header_2_0(npz_file)
+        offset = npz_file.tell()
+
+    if not shape:
+        # memmap cannot map zero dimensional arrays
+        return None
+
+    return numpy.memmap(
+        file_name, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape,
+        order='F' if fortran_order else 'C'
+        )
+
+def _index_path(file_name):
+    """
+    Description:
+    Location of the persisted byte-offset index of a dose file.
+    """
+
+    return file_name + '.index.npz'
+
+def _load_index(file_name, shape=None):
+    """
+    Description:
+    Loads the persisted byte-offset index of a dose file if it is still
+    valid for the current version of the file (and for shape, if given).
+
+    Outputs:
+    :param index: (row_offsets, members) or None
+    :type index: tuple
+    """
+
+    key = _cache_key(file_name)
+    key = numpy.array([key['size'], key['mtime']], dtype=numpy.float64)
+    try:
+        with numpy.load(_index_path(file_name)) as index:
+            if numpy.array_equal(index['key'], key) and (
+                    shape is None or tuple(index['shape']) == tuple(shape)):
+                return index['row_offsets'], index['members']
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    return None
+
+def _index_members(file_name):
+    """
+    Description:
+    Byte ranges of the gzip members of a file taken from its persisted
+    index, or None if there is no valid index.
+    """
+
+    index = _load_index(file_name)
+    if index is None:
+        return None
+    starts = [int(m) for m in index[1][:, 0]] + [stat(file_name).st_size]
+    return list(zip(starts[:-1], starts[1:]))
+
+def _scan_offsets(file_name, shape, chunk_size=2 ** 22):
+    """
+    Description:
+    Scans a .3ddose(.gz) file once without converting any numbers and
+    records the byte offset (in the decompressed stream) of the first value
+    of every x-row of the dose and uncertainty blocks. For gzip input the
+    compressed and decompressed offsets of every gzip member are recorded as
+    well, so that later reads can start decompressing at the member holding
+    the requested bytes instead of at the start of the file.
+
+    Inputs:
+    :param file_name: path to the dose file
+    :type file_name: str
+    :param shape: number of voxels along (x, y, z)
+    :type shape: tuple
+    :param chunk_size: number of bytes processed at a time
+    :type chunk_size: int
+
+    Outputs:
+    :param row_offsets: offsets of the rows, ordered (block, z, y), followed
+                        by the length of the decompressed stream
+    :type row_offsets: numpy.ndarray
+    :param members: (compressed, decompressed) offsets of each gzip member;
+                    empty for uncompressed files
+    :type members: numpy.ndarray
+    """
+
+    x, y, z = shape
+    header_length = 3 + (x + 1) + (y + 1) + (z + 1)
+    n_rows = 2 * z * y
+    row_offsets = numpy.zeros(n_rows + 1, dtype=numpy.int64)
+
+    state = {'tokens': 0, 'bytes': 0, 'row': 0, 'whitespace': True}
+
+    def process(data):
+        if not data:
+            return
+        values = numpy.frombuffer(data, dtype=numpy.uint8)
+        whitespace = (
+            (values == 32) | (values == 10) | (values == 9) | (values == 13)
+            )
+        previous = numpy.empty_like(whitespace)
+        previous[0] = state['whitespace']
+        previous[1:] = whitespace[:-1]
+        starts = numpy.flatnonzero(~whitespace & previous)
+
+        # rows whose first value starts in this chunk
+        n_tokens = state['tokens'] + len(starts)
+        last_row = min(n_rows, max(0, -(-(n_tokens - header_length) // x)))
+        rows = numpy.arange(state['row'], last_row)
+        if len(rows):
+            row_offsets[rows] = state['bytes'] + starts[
+                header_length + rows * x - state['tokens']
+                ]
+            state['row'] = last_row
+
+        state['tokens'] = n_tokens
+        state['bytes'] += len(data)
+        state['whitespace'] = bool(whitespace[-1])
+
+    members = []
+    with open(file_name, 'rb') as raw_file:
+        if file_name[-3:] == '.gz':
+            compressed_size = stat(file_name).st_size
+            compressed_offset = 0
+            members.append((0, 0))
+            decompressor = decompressobj(16 + MAX_WBITS)
+            while True:
+                data = raw_file.read(chunk_size)
+                if not data:
+                    break
+                data_offset = compressed_offset
+                compressed_offset += len(data)
+                while data:
+                    process(decompressor.decompress(data))
+                    if not decompressor.eof:
+                        break
+                    # a new gzip member starts right after this one
+                    data = decompressor.unused_data
+                    member_start = compressed_offset - len(data)
+                    if member_start < compressed_size:
+                        members.append((member_start, state['bytes']))
+                    decompressor = decompressobj(16 + MAX_WBITS)
+            if not decompressor.eof:
+                process(decompressor.flush())
+        else:
+            while True:
+                data = raw_file.read(chunk_size)
+                if not data:
+                    break
+                process(data)
+
+    assert state['row'] >= n_rows // 2, \
+    "{0} holds fewer values than its header specifies".format(file_name)
+
+    # files without an uncertainty block only index the dose rows
+    n_rows = state['row'] if state['row'] < n_rows else n_rows
+    row_offsets = row_offsets[:n_rows + 1]
+    row_offsets[n_rows] = state['bytes']
+
+    return row_offsets, numpy.array(members, dtype=numpy.int64).reshape(-1, 2)
+
+class _OffsetReader(object):
+
+    """
+    Description:
+    Reads runs of values from a dose file at decompressed byte offsets taken
+    from its index. Gzip input is repositioned at the nearest gzip member at
+    or before the requested offset; within a member (or for single member
+    files) the gap is decompressed and discarded without being tokenized.
+    Reads are fastest when issued in increasing offset order.
+
+    Inputs:
+    :param file_name: path to the dose file
+    :type file_name: str
+    :param members: (compressed, decompressed) offsets of the gzip members
+    :type members: numpy.ndarray
+    """
+
+    def __init__(self, file_name, members):
+        self.file_name = file_name
+        self.member_starts = [int(m) for m in members[:, 1]]
+        self.member_offsets = [int(m) for m in members[:, 0]]
+        self.raw_file = open(file_name, 'rb')
+        self.data_file = None
+        self.base = 0
+
+    def _seek(self, offset):
+        if not self.member_starts:
+            self.raw_file.seek(offset)
+            return self.raw_file
+
+        member = bisect_right(self.member_starts, offset) - 1
+        current = None
+        if self.data_file is not None:
+            current = self.base + self.data_file.tell()
+
+        if (current is None or offset < current
+                or self.member_starts[member] > current):
+            self.raw_file.seek(self.member_offsets[member])
+            self.data_file = GzipFile(fileobj=self.raw_file, mode='rb')
+            self.base = self.member_starts[member]
+
+        self.data_file.seek(offset - self.base)
+        return self.data_file
+
+    def read(self, start, stop, count, dtype=numpy.float64):
+        """
+        Returns the count values stored between the decompressed byte
+        offsets start and stop.
+        """
+        data = self._seek(start).read(stop - start)
+        values = numpy.fromstring(data, dtype=dtype, sep=' ', count=count)
+        assert len(values) == count, \
+        "read {0} values (expected {1})".format(len(values), count)
+        return values
+
+    def close(self):
+        if self.data_file is not None:
+            self.data_file.close()
+        self.raw_file.close()
+
+def _format_scientific(values, precision=4, line_length=None):
+    """
+    Description:
+    Formats numbers as fixed width scientific notation text ("-1.2345E-13")
+    with numpy array operations instead of one python format call per value.
+    The mantissa is rounded in float64, so it can differ from printf in the
+    last digit for values within one float64 rounding of a decimal tie.
+    nan and inf are written as printf writes them, right aligned in the
+    field, and subnormals as zero; the exponent field has three digits only
+    if a finite value needs them.
+
+    Inputs:
+    :param values: numbers to format
+    :type values: numpy.ndarray
+    :param precision: number of digits after the decimal point
+    :type precision: int
+    :param line_length: number of values per line; all on one line if None
+    :type line_length: int
+
+    Outputs:
+    :param text: space separated values, ending in a newline
+    :type text: bytes
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float64).ravel()
+    magnitude = numpy.absolute(values)
+    # nan and inf are written as printf writes them once the rest is done;
+    # subnormals are flushed to zero, as their mantissa cannot be scaled by
+    # a power of ten that is itself a float64
+    finite = numpy.isfinite(values)
+    magnitude[~finite | (magnitude < numpy.finfo(numpy.float64).tiny)] = 0.
+    nonzero = magnitude > 0
+
+    exponent = numpy.zeros(len(values), dtype=numpy.int64)
+    with numpy.errstate(divide='ignore'):
+        exponent[nonzero] = numpy.floor(numpy.log10(magnitude[nonzero]))
+
+    def scale_mantissa(mask):
+        # multiply or divide by an exact power of ten so that only one
+        # rounding happens before rint
+        shift = precision - exponent[mask]
+        up = shift >= 0
+        scaled = numpy.empty(shift.shape)
+        # in two factors past 10**300, which would overflow near the
+        # smallest normal numbers (the second factor is 1 otherwise)
+        scaled[up] = (
+            magnitude[mask][up] * 10. ** numpy.minimum(shift[up], 300)
+            * 10. ** numpy.maximum(shift[up] - 300, 0)
+            )
+        scaled[~up] = magnitude[mask][~up] / 10. ** -shift[~up]
+        return numpy.rint(scaled).astype(numpy.int64)
+
+    mantissa = scale_mantissa(slice(None))
+    # log10 can be off by one near powers of ten and rounding can carry into
+    # an extra digit; fix both cases
+    too_small = nonzero & (mantissa < 10 ** precision)
+    exponent[too_small] -= 1
+    mantissa[too_small] = scale_mantissa(too_small)
+    too_large = mantissa >= 10 ** (precision + 1)
+    exponent[too_large] += 1
+    mantissa[too_large] = scale_mantissa(too_large)
+
+    exponent_digits = 3 if len(values) and abs(exponent).max() >= 100 else 2
+    # sign, digit, point, decimals, E, exponent sign, exponent, separator
+    width = 6 + precision + exponent_digits
+    chars = numpy.empty((len(values), width), dtype=numpy.uint8)
+
+    chars[:, 0] = numpy.where(numpy.signbit(values), ord('-'), ord(' '))
+    column = 1
+    for digit in range(precision + 1):
+        chars[:, column] = (
+            mantissa // 10 ** (precision - digit) % 10 + ord('0')
+            )
+        column += 1
+        if digit == 0:
+            chars[:, column] = ord('.')
+            column += 1
+    chars[:, column] = ord('E')
+    chars[:, column + 1] = numpy.where(exponent < 0, ord('-'), ord('+'))
+    column += 2
+    exponent = abs(exponent)
+    for digit in range(exponent_digits):
+        chars[:, column] = (
+            exponent // 10 ** (exponent_digits - 1 - digit) % 10 + ord('0')
+            )
+        column += 1
+
+    for index in numpy.flatnonzero(~finite):
+        # right aligned in the field, as printf pads them
+        token = ('%E' % values[index]).encode('ascii')
+        chars[index, :width - 1] = ord(' ')
+        chars[index, width - 1 - len(token):width - 1] = numpy.frombuffer(
+            token, dtype=numpy.uint8
+            )
+
+    chars[:, column] = ord(' ')
+    if line_length is not None:
+        chars[line_length - 1::line_length, column] = ord('\n')
+    chars[-1:, column] = ord('\n')
+
+    return chars.tobytes()
+
+def _3ddose_header(shape, positions):
+    # voxel counts and one line of bounds per axis, as written by egs_brachy
+    header = '{0} {1} {2}\n'.format(*shape).encode('ascii')
+    for p in positions:
+        header += (
+            ' '.join('{0:.8g}'.format(b) for b in p) + '\n'
+            ).encode('ascii')
+    return header
+
+def _volume_weights(source, target):
+    # overlap of each target interval with the source intervals, as a band
+    # of k source intervals starting at first[i] for target interval i
+    source = numpy.asarray(source, dtype=numpy.float64)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    n_source = len(source) - 1
+
+    first = numpy.clip(
+        source.searchsorted(target[:-1], side='right') - 1, 0, n_source - 1
+        )
+    last = numpy.clip(
+        source.searchsorted(target[1:], side='left') - 1, 0, n_source - 1
+        )
+    band = numpy.clip(first[:, None] + numpy.arange((last - first).max() + 1),
+        0, n_source - 1)
+
+    overlap = (
+        numpy.minimum(target[1:, None], source[band + 1])
+        - numpy.maximum(target[:-1, None], source[band])
+        )
+    overlap[overlap < 0] = 0.
+    # clipped band entries repeat the last interval; count it only once
+    overlap[:, 1:][band[:, 1:] == band[:, :-1]] = 0.
+
+    covered = overlap.sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        weights = numpy.where(covered[:, None] > 0, overlap / covered[:, None], 0.)
+
+    return first, weights, covered > 0
+
+def _linear_weights(source, target):
+    # linear interpolation between the voxel centres either side of each
+    # target voxel centre; constant beyond the outermost centres
+    source = numpy.asarray(source, dtype=numpy.float64)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    centres = (source[:-1] + source[1:]) / 2.
+    target_centres = (target[:-1] + target[1:]) / 2.
+
+    inside = (target_centres >= source[0]) & (target_centres <= source[-1])
+    if len(centres) == 1:
+        first = numpy.zeros(len(target_centres), dtype=numpy.intp)
+        return first, numpy.ones((len(target_centres), 1)), inside
+
+    first = numpy.clip(
+        centres.searchsorted(target_centres, side='right') - 1,
+        0, len(centres) - 2
+        )
+    fraction = numpy.clip(
+        (target_centres - centres[first])
+        / (centres[first + 1] - centres[first]), 0., 1.
+        )
+
+    return first, numpy.column_stack((1. - fraction, fraction)), inside
+
+def _apply_band(values, first, weights, axis):
+    # sum over the band of weights[:, j] * values[first + j] along axis
+    n_source = values.shape[axis]
+    shape = [1] * values.ndim
+    shape[axis] = -1
+
+    result = None
+    for j in range(weights.shape[1]):
+        if not weights[:, j].any():
+            continue
+        term = values.take(numpy.minimum(first + j, n_source - 1), axis=axis)
+        term *= weights[:, j].reshape(shape)
+        if result is None:
+            result = term
+        else:
+            result += term
+
+    if result is None:
+        shape = list(values.shape)
+        shape[axis] = len(first)
+        result = numpy.zeros(shape, dtype=values.dtype)
+
+    return result
+
+def _block_reduce(mean, maximum, widths, factor, axis):
+    # width weighted means and maxima of blocks of factor voxels along axis
+    # (the last block may be smaller), with the widths of the blocks
+    starts = numpy.arange(0, mean.shape[axis], factor)
+    shape = [1, 1, 1]
+    shape[axis] = -1
+
+    block_widths = numpy.add.reduceat(widths, starts)
+    mean = numpy.add.reduceat(mean * widths.reshape(shape), starts, axis=axis)
+    mean /= block_widths.reshape(shape)
+    maximum = numpy.maximum.reduceat(maximum, starts, axis=axis)
+
+    return mean, maximum, block_widths
+
+class _DoseArithmetic(object):
+
+    """
+    Description:
+    Operators and slab reductions shared by DoseFile and DoseExpression.
+    Subclasses provide shape, size, positions, dtype, read_region, iter_slabs
+    and _read. Arithmetic between dose grids, or between a grid and a number,
+    builds a DoseExpression; nothing is computed until a region, plane, slab
+    or histogram of the result is requested.
+    """
+
+    # make numpy scalars and arrays defer to the operators below
+    __array_ufunc__ = None
+    __array_priority__ = 100
+
+    def _operate(self, operator, left, right):
+        for operand in (left, right):
+            if not isinstance(operand, (_DoseArithmetic, Number)):
+                return NotImplemented
+        return DoseExpression(operator, left, right)
+
+    def __add__(self, other):
+        return self._operate('+', self, other)
+
+    def __radd__(self, other):
+        return self._operate('+', other, self)
+
+    def __sub__(self, other):
+        return self._operate('-', self, other)
+
+    def __rsub__(self, other):
+        return self._operate('-', other, self)
+
+    def __mul__(self, other):
+        return self._operate('*', self, other)
+
+    def __rmul__(self, other):
+        return self._operate('*', other, self)
+
+    def __truediv__(self, other):
+        return self._operate('/', self, other)
+
+    def __rtruediv__(self, other):
+        return self._operate('/', other, self)
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        return self._operate('*', self, -1.)
+
+    def evaluate(self, load_uncertainty=False):
+        """
+        Returns the whole dose array (and the relative uncertainty array with
+        load_uncertainty=True) in (x, y, z) order.
+        """
+        dose, uncertainty = self._read((None, None, None), load_uncertainty)
+        if load_uncertainty:
+            return dose, uncertainty
+        return dose
+
+    def read_plane(self, axis, index, uncertainty=False):
+        """
+        Description:
+        Reads a single plane of the grid through read_region, e.g.
+        read_plane(2, position_to_index(0.0, z_pos_mid)) for the z = 0 plane.
+
+        Inputs:
+        :param axis: axis normal to the plane (0 = x, 1 = y, 2 = z)
+        :type axis: int
+        :param index: voxel index of the plane along that axis
+        :type index: int
+        :param uncertainty: read the uncertainty block instead of the dose
+        :type uncertainty: bool
+
+        Outputs:
+        :param plane: 2D array of the remaining two axes in (x, y, z) order
+        :type plane: numpy.ndarray
+        """
+
+        ranges = [None, None, None]
+        ranges[axis] = (index, index + 1)
+        region = self.read_region(*ranges, uncertainty=uncertainty)
+
+        return region.take(0, axis=axis)
+
+    def profiles(self, lines, axis=2, lookup='voxel', uncertainty=True,
+            fill_value=numpy.nan):
+        """
+        Description:
+        Extracts many line profiles of the dose at once. Each line is either
+
+          (a, b): the line along axis through the voxels at positions a and
+                  b of the other two axes, in x, y, z order (e.g. (x, y) for
+                  a line along z); every voxel along the line is returned
+          (start, stop, samples): the segment from the point start to the
+                  point stop, sampled at samples evenly spaced points by
+                  trilinear interpolation between the voxel centres
+
+        and every line of a call must have the same number of values. The
+        axis lines are read as the one box of the grid that spans them (only
+        the rows of the box if the dose is not loaded) and picked out of it
+        with a single fancy index; the segments are interpolated together
+        with one call of interpolation.interpolate_points.
+
+        Inputs:
+        :param lines: line specifications
+        :type lines: list
+        :param axis: axis of the (a, b) lines (0 = x, 1 = y, 2 = z)
+        :type axis: int
+        :param lookup: 'voxel' picks the voxels containing a and b (the
+                       voxel bounds); 'centre' the voxels whose centres are
+                       at or below them, like position_to_index(a, mids)
+        :type lookup: str
+        :param uncertainty: also return the absolute uncertainty profiles
+        :type uncertainty: bool
+        :param fill_value: dose of segment samples outside the voxel centres,
+                           or None to extrapolate
+        :type fill_value: float
+
+        Outputs:
+        :param dose: (len(lines), values per line) dose profiles
+        :type dose: numpy.ndarray
+        :param err: absolute uncertainty profiles of the same shape (only
+                    with uncertainty=True)
+        :type err: numpy.ndarray
+        """
+
+        assert lookup in ('voxel', 'centre'), \
+        "lookup must be 'voxel' or 'centre', not {0!r}".format(lookup)
+
+        axis_lines = []
+        segments = []
+        lengths = set()
+        for number, line in enumerate(lines):
+            if len(line) == 2:
+                axis_lines.append((number, line))
+                lengths.add(self.shape[axis])
+            else:
+                assert len(line) == 3, \
+                "line {0} is neither (a, b) nor (start, stop, samples)".format(
+                    number
+                    )
+                segments.append((number, line))
+                lengths.add(line[2])
+        assert len(lengths) <= 1, \
+        "the lines have different lengths {0}".format(sorted(lengths))
+
+        length = lengths.pop() if lengths else 0
+        dose = numpy.empty((len(lines), length), dtype=self.dtype)
+        err = numpy.empty((len(lines), length), dtype=self.dtype)
+
+        if axis_lines:
+            numbers = [number for number, __ in axis_lines]
+            coordinates = numpy.array(
+                [line for __, line in axis_lines], dtype=numpy.float64
+                )
+            others = [other for other in range(3) if other != axis]
+            axis_indices = (
+                self.grid_index.bounds if lookup == 'voxel'
+                else self.grid_index.centres
+                )
+
+            ranges = [None, None, None]
+            selection = [None, None, None]
+            selection[axis] = numpy.arange(length)[None, :]
+            for column, other in enumerate(others):
+                if axis_indices[other] is None:
+                    # a single voxel along this axis
+                    indices = numpy.zeros(len(numbers), dtype=numpy.intp)
+                else:
+                    indices = numpy.atleast_1d(
+                        axis_indices[other](coordinates[:, column])
+                        )
+                start = indices.min()
+                ranges[other] = (start, indices.max() + 1)
+                selection[other] = (indices - start)[:, None]
+            selection = tuple(selection)
+
+            box_dose, box_uncertainty = self._read(ranges, uncertainty)
+            dose[numbers] = box_dose[selection]
+            if uncertainty:
+                err[numbers] = absolute_uncertainty(
+                    box_dose[selection], box_uncertainty[selection]
+                    )
+
+        if segments:
+            # imported here as interpolation itself imports this module
+            from interpolation import interpolate_points
+
+            numbers = [number for number, __ in segments]
+            points = numpy.concatenate([
+                numpy.asarray(start, dtype=numpy.float64)
+                + numpy.linspace(0., 1., samples)[:, None] * (
+                    numpy.asarray(stop, dtype=numpy.float64)
+                    - numpy.asarray(start, dtype=numpy.float64)
+                    )
+                for __, (start, stop, samples) in segments
+                ])
+            values = interpolate_points(
+                self, points, uncertainty=uncertainty, fill_value=fill_value
+                )
+            if uncertainty:
+                values, relative_uncertainty = values
+                err[numbers] = absolute_uncertainty(
+                    values, relative_uncertainty
+                    ).reshape((len(numbers), length))
+            dose[numbers] = values.reshape((len(numbers), length))
+
+        if uncertainty:
+            return dose, err
+        return dose
+
+    def resample(self, target_bounds, mode='volume', load_uncertainty=False,
+            fill_value=0., nz=None):
+        """
+        Description:
+        Puts the dose (and uncertainty) on another grid, e.g. a 0.5 mm run on
+        the 1 mm grid of another run, so the two can be compared voxel by
+        voxel. Separable passes: each z-slab of the source is resampled along
+        x and then y, and the stacked result along z, so at most one source
+        slab is held in memory besides the output.
+
+        mode='volume' averages the source voxels over the volume of each
+        target voxel (conservative: the integral dose over a fully covered
+        region is preserved); mode='trilinear' interpolates linearly between
+        the source voxel centres around each target voxel centre. The
+        uncertainties are propagated as those of a weighted sum of
+        independent voxels. Target voxels outside the source grid are set to
+        fill_value (with zero uncertainty).
+
+        Inputs:
+        :param target_bounds: x, y and z bounds of the target grid, or a
+                              DoseFile whose grid is used
+        :type target_bounds: list
+        :param mode: 'volume' or 'trilinear'
+        :type mode: str
+        :param load_uncertainty: also resample the relative uncertainty
+        :type load_uncertainty: bool
+        :param fill_value: dose of target voxels outside the source grid
+        :type fill_value: float
+        :param nz: source z planes per slab; by default about 2**22 values
+        :type nz: int
+
+        Outputs:
+        :param resampled: dose on the target grid
+        :type resampled: DoseFile
+        """
+
+        if isinstance(target_bounds, _DoseArithmetic):
+            target_bounds = target_bounds.positions
+        target_bounds = [
+            numpy.asarray(b, dtype=numpy.float64) for b in target_bounds
+            ]
+        assert len(target_bounds) == 3, "need x, y and z target bounds"
+
+        if mode == 'volume':
+            axis_weights = _volume_weights
+        elif mode == 'trilinear':
+            axis_weights = _linear_weights
+        else:
+            raise ValueError("unknown resampling mode '{0}'".format(mode))
+        bands = [
+            axis_weights(source, target)
+            for source, target in zip(self.positions, target_bounds)
+            ]
+
+        x, y, z = self.shape
+        if nz is None:
+            nz = max(1, 2 ** 22 // (x * y))
+
+        # x and y passes slab by slab; the variance of the absolute
+        # uncertainty is carried with the squared weights
+        dose_planes = []
+        variance_planes = []
+        for slab in self.iter_slabs(nz, load_uncertainty):
+            dose_slab = numpy.asarray(slab[1], dtype=self.dtype)
+            for axis in (0, 1):
+                first, weights, __ = bands[axis]
+                dose_slab = _apply_band(dose_slab, first, weights, axis)
+            dose_planes.append(dose_slab)
+
+            if load_uncertainty:
+                # squared doses can underflow float32, so the variance is
+                # always carried in float64
+                variance_slab = (
+                    numpy.asarray(slab[1], dtype=numpy.float64) * slab[2]
+                    ) ** 2
+                for axis in (0, 1):
+                    first, weights, __ = bands[axis]
+                    variance_slab = _apply_band(
+                        variance_slab, first, weights ** 2, axis
+                        )
+                variance_planes.append(variance_slab)
+
+        first, weights, __ = bands[2]
+        dose = _apply_band(numpy.concatenate(dose_planes, axis=2),
+            first, weights, 2)
+        del dose_planes
+
+        uncertainty = None
+        if load_uncertainty:
+            variance = _apply_band(numpy.concatenate(variance_planes, axis=2),
+                first, weights ** 2, 2)
+            del variance_planes
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                uncertainty = numpy.sqrt(variance)
+                uncertainty /= abs(dose)
+            uncertainty[dose == 0] = 0.
+            uncertainty = uncertainty.astype(dose.dtype, copy=False)
+
+        outside = ~(
+            bands[0][2][:, None, None] & bands[1][2][None, :, None]
+            & bands[2][2][None, None, :]
+            )
+        if outside.any():
+            dose[outside] = fill_value
+            if uncertainty is not None:
+                uncertainty[outside] = 0.
+
+        return DoseFile.from_arrays(target_bounds, dose, uncertainty)
+
+    def max(self, nz=1):
+        return max(slab.max() for __, slab in self.iter_slabs(nz))
+
+    def min(self, nz=1):
+        return min(slab.min() for __, slab in self.iter_slabs(nz))
+
+    def histogram(self, bins=500, dose_range=None, scale=1.0, nz=1):
+        """
+        Description:
+        Histogram of the (scaled) dose values, accumulated slab by slab so it
+        also works on files opened with load_dose=False. Matches
+        numpy.histogram(self.dose * scale, bins).
+
+        Inputs:
+        :param bins: number of equal width bins
+        :type bins: int
+        :param dose_range: (lower, upper) range of the bins; defaults to the
+                           minimum and maximum scaled dose, which costs an
+                           extra pass when streaming
+        :type dose_range: tuple
+        :param scale: factor applied to the dose before binning
+        :type scale: float
+        :param nz: slab thickness used when streaming
+        :type nz: int
+
+        Outputs:
+        :param counts: number of voxels in each bin
+        :type counts: numpy.ndarray
+        :param bin_edges: edges of the bins (bins + 1 values)
+        :type bin_edges: numpy.ndarray
+        """
+
+        if dose_range is None:
+            lower, upper = numpy.inf, -numpy.inf
+            for __, slab in self.iter_slabs(nz):
+                slab = slab * scale
+                lower = min(lower, slab.min())
+                upper = max(upper, slab.max())
+            dose_range = (lower, upper)
 
-    Outputs:
-    """
-    
-    return numpy.where(numpy.logical_and(p >= A[:-1], p < A[1:]))[0][0]
+        counts = numpy.zeros(bins, dtype=numpy.int64)
+        for __, slab in self.iter_slabs(nz):
+            slab_counts, bin_edges = numpy.histogram(
+                slab * scale, bins=bins, range=dose_range
+                )
+            counts += slab_counts
+
+        return counts, bin_edges
+
+    def dose_volume_histogram(self, bins=500, dose_range=None, scale=1.0,
+            nz=1):
+        """
+        Description:
+        Differential and cumulative dose volume histograms with volumes in
+        percent of the grid, computed from histogram.
+
+        Outputs:
+        :param volume: percent of voxels in each dose bin
+        :type volume: numpy.ndarray
+        :param cumulative_volume: percent of voxels receiving at least the
+                                  lower edge of each bin
+        :type cumulative_volume: numpy.ndarray
+        :param bin_edges: edges of the dose bins
+        :type bin_edges: numpy.ndarray
+        """
+
+        counts, bin_edges = self.histogram(bins, dose_range, scale, nz)
+        volume = counts * (100. / self.size)
+        cumulative_volume = volume[::-1].cumsum()[::-1]
 
-class DoseFile(object):
+        return volume, cumulative_volume, bin_edges
+
+class DoseFile(_DoseArithmetic):
 
     # copied from github/christopherpoole/3DDose
 
-    def __init__(self, file_name, load_uncertainty=False):
+    def __init__(self, file_name, load_uncertainty=False, cache=False,
+            cache_dir=None, mmap_mode='c', load_dose=True,
+            dtype=numpy.float64, threads=None, summary=False):
         """
         Attempts to detect the dose file etension automatically. If an unknown
         extension is detected, loads a .3ddose file by default.
+
+        With cache=True the parsed blocks of a .3ddose file are stored in a
+        sidecar cache (see _cache_path) and later loads memory map them
+        instead of parsing the text again. Uncompressed .npz files and caches
+        are memory mapped with mmap_mode; the default copy-on-write mode lets
+        the arrays be scaled in place without touching the files on disk.
+
+        With load_dose=False only the header and bounds of a .3ddose file are
+        read; the data blocks can then be streamed with iter_slabs.
+
+        Chunked stores (STORE_EXTENSION, see dose_store) opened with
+        load_dose=False decompress only the chunks that the regions, planes
+        and profiles read from them touch.
+
+        dtype sets the type of the dose and uncertainty arrays (the bounds are
+        always float64). numpy.float32 halves the memory of every block and of
+        the arrays derived from them while keeping about 7 significant digits
+        (6e-8 relative); see test_float32 in tests/test_float32.py for the
+        D90 and percent difference tolerances.
+
+        threads sets the number of threads used to decompress .gz input
+        (default: all cores).
+
+        With summary=True the DoseSummary of the file (see summary) is built
+        from the blocks just parsed and stored in its .summary.npz sidecar
+        (in cache_dir if given), unless an up to date one exists, so that
+        later queries on the run need not read the dose again. A file opened
+        with load_dose=False is streamed once for it.
+
+        Multiplying or dividing a DoseFile in place by a number (dose_file *=
+        factor) only updates its scale, which is applied to the regions,
+        planes, slabs and histograms read from it; the dose array holds the
+        values as loaded. Use evaluate() for the whole scaled grid. Other
+        arithmetic builds a lazy DoseExpression.
         """
+        self.file_name = file_name
+        self.dtype = numpy.dtype(dtype)
+        self.threads = threads
+        self.scale = 1.0
         if file_name[-3:] == 'npz':
-            self._load_npz(file_name)
+            self._load_npz(file_name, mmap_mode)
+        elif file_name.endswith(STORE_EXTENSION):
+            self._load_store(file_name, load_dose, load_uncertainty)
+        elif not load_dose:
+            self._load_header(file_name)
+        elif cache:
+            self._load_cached(
+                file_name, load_uncertainty, cache_dir, mmap_mode
+                )
         else:
             self._load_3ddose(file_name, load_uncertainty)
-    
-    def _load_npz(self, file_name):
-        data = numpy.load(file_name)
-        self.dose = data['dose']
-        self.uncertainty = data['uncertainty']
-        self.positions = [data['x_positions'], data['y_positions'], data['z_positions']]
-        self.spacing = [numpy.diff(p) for p in self.positions]
-        self.resolution = [s[0] for s in self.spacing if s.all()] 
-        
-        self.shape = self.dose.shape
-        self.size = self.dose.size
-    
-    def _load_3ddose(self, file_name, load_uncertainty=False):
-        if file_name[-3:] == '.gz':
-            with gOpen(file_name, 'rb') as data_file:
-                data = data_file.read().split('\n')
-        else:
-            with open(file_name, 'rb') as data_file:
-                data = data_file.read().split('\n')
-        
-        cur_line = 0
-        
-        x, y, z = map(int, data[cur_line].split())
-        self.shape = (z,y,x)
-        # print self.shape
-        self.size = numpy.multiply.reduce(self.shape)
-        
-        cur_line += 1
-        
-        positions = []
-        for i in range(0,3):
-            bounds = []
-            while len(bounds) < [x, y, z][i]:
-                line_positions = map(float, data[cur_line].split())
-                bounds += line_positions
-                cur_line += 1
-            positions.append(bounds)
-        
-        # recall that dimensions are read in order x, y, z
-        positions = [positions[0], positions[1], positions[2]]
-        
+
+        if summary:
+            self.summary(cache_dir)
+
+    @classmethod
+    def from_arrays(cls, positions, dose, uncertainty=None, file_name=None):
+        """
+        Description:
+        Builds a DoseFile from bounds and arrays already in memory, e.g. a
+        resampled or combined dose, so that it can be plotted, written with
+        write_3ddose or dumped like a loaded file.
+
+        Inputs:
+        :param positions: x, y and z bounds
+        :type positions: list
+        :param dose: dose array in (x, y, z) order
+        :type dose: numpy.ndarray
+        :param uncertainty: relative uncertainty array in (x, y, z) order
+        :type uncertainty: numpy.ndarray
+        :param file_name: name reported for the grid (nothing is read)
+        :type file_name: str
+
+        Outputs:
+        :param dose_file: the grid
+        :type dose_file: DoseFile
+        """
+
+        positions = [numpy.asarray(p, dtype=numpy.float64) for p in positions]
+        shape = tuple(len(p) - 1 for p in positions)
+        assert dose.shape == shape, \
+        "dose of shape {0} does not fit bounds of shape {1}".format(
+            dose.shape, shape
+            )
+
+        dose_file = cls.__new__(cls)
+        dose_file.file_name = file_name
+        dose_file.dtype = dose.dtype
+        dose_file.threads = None
+        dose_file.scale = 1.0
+        dose_file._set_geometry(positions)
+        dose_file.shape = shape
+        dose_file.size = dose.size
+        dose_file.dose = dose
+        if uncertainty is not None:
+            assert uncertainty.shape == shape, \
+            "uncertainty of shape {0} does not fit bounds of shape {1}".format(
+                uncertainty.shape, shape
+                )
+            dose_file.uncertainty = uncertainty
+
+        return dose_file
+
+    def __imul__(self, other):
+        if not isinstance(other, Number):
+            return NotImplemented
+        self.scale = self.scale * other
+        return self
+
+    def __itruediv__(self, other):
+        if not isinstance(other, Number):
+            return NotImplemented
+        self.scale = self.scale / other
+        return self
+
+    __idiv__ = __itruediv__
+
+    def _set_geometry(self, positions):
         self.positions = positions
+        self._grid_index = None
         self.spacing = [numpy.diff(p) for p in self.positions]
         self.resolution = [s[0] for s in self.spacing if s.all()]
-        self.origin = numpy.add( 
+        self.origin = numpy.add(
             [p[0] for p in positions], numpy.array(self.resolution)/2.
             )
+
+    def _load_store(self, file_name, load_dose=True, load_uncertainty=False):
+        self.store = DoseStore(file_name, self.threads)
+        self._set_geometry(self.store.positions)
+        self.shape = self.store.shape
+        self.size = int(numpy.prod(self.shape))
+
+        if load_dose:
+            self.dose = self.store.read_region('dose', cache=False).astype(
+                self.dtype, copy=False
+                )
+        if load_uncertainty:
+            self.read_uncertainty()
+
+    def _load_npz(self, file_name, mmap_mode=None):
+        data = numpy.load(file_name)
+        members = {}
+        for name in data.files:
+            if mmap_mode is not None:
+                members[name] = _mmap_npz_member(file_name, name, mmap_mode)
+            if members.get(name) is None:
+                members[name] = data[name]
+        data.close()
+
+        self.dose = members['dose'].astype(self.dtype, copy=False)
+        if 'uncertainty' in members:
+            self.uncertainty = members['uncertainty'].astype(
+                self.dtype, copy=False
+                )
+        self._set_geometry(
+            [members['x_positions'], members['y_positions'],
+            members['z_positions']]
+            )
         
+        self.shape = self.dose.shape
+        self.size = self.dose.size
+
+    def _load_cached(self, file_name, load_uncertainty=False, cache_dir=None,
+            mmap_mode='c'):
+        cache_path = _cache_path(file_name, cache_dir)
+        key = _cache_key(file_name)
+
+        try:
+            with open(join(cache_path, 'header.json')) as header_file:
+                header = json_load(header_file)
+        except (IOError, OSError, ValueError):
+            header = None
+
+        if (header is None or header['key'] != key
+                or (load_uncertainty and not header['uncertainty'])):
+            # the cache always holds float64 so that it serves any dtype
+            self._load_3ddose(file_name, load_uncertainty, numpy.float64)
+            self._write_cache(cache_path, key)
+            self.dose = self.dose.astype(self.dtype, copy=False)
+            if load_uncertainty:
+                self.uncertainty = self.uncertainty.astype(
+                    self.dtype, copy=False
+                    )
+            return
+
+        self.dose = numpy.load(
+            join(cache_path, 'dose.npy'), mmap_mode=mmap_mode
+            ).astype(self.dtype, copy=False)
+        if load_uncertainty:
+            self.uncertainty = numpy.load(
+                join(cache_path, 'uncertainty.npy'), mmap_mode=mmap_mode
+                ).astype(self.dtype, copy=False)
+        self._set_geometry(
+            [numpy.array(p, dtype=numpy.float64) for p in header['positions']]
+            )
+
+        self.shape = self.dose.shape
+        self.size = self.dose.size
+
+    def _write_cache(self, cache_path, key):
+        # write into a scratch directory first so that an interrupted write
+        # never leaves a cache that looks valid
+        scratch_path = cache_path + '.tmp'
+        try:
+            if isdir(scratch_path):
+                rmtree(scratch_path)
+            makedirs(scratch_path)
+
+            numpy.save(join(scratch_path, 'dose.npy'), self.dose)
+            if hasattr(self, 'uncertainty'):
+                numpy.save(
+                    join(scratch_path, 'uncertainty.npy'), self.uncertainty
+                    )
+            with open(join(scratch_path, 'header.json'), 'w') as header_file:
+                json_dump({
+                    'key': key,
+                    'shape': list(self.shape),
+                    'positions': [numpy.asarray(p).tolist() for p in self.positions],
+                    'uncertainty': hasattr(self, 'uncertainty')
+                    }, header_file)
+
+            if isdir(cache_path):
+                rmtree(cache_path)
+            rename(scratch_path, cache_path)
+        except (IOError, OSError) as error:
+            print("WARNING: Could not write dose cache {0} ({1})".format(
+                cache_path, error
+                ))
+
+    def _read_header(self, reader):
+        x, y, z = [int(n) for n in reader.read(3)]
+        positions = []
+        for n_voxels in (x, y, z):
+            positions.append(reader.read(n_voxels + 1))
+
+        self._set_geometry(positions)
         assert len(self.resolution) == 3, \
         "Non-linear resolution in either x, y or z."
-        
-        dose = []
-        while len(dose) < self.size:
-            line_data = map(float, data[cur_line].split())
-            dose += line_data
-            cur_line += 1
-        
-        self.dose = numpy.array(dose)
-        assert len(self.dose) == self.size, \
-        "len of dose = {} (expect {})".format(len(self.dose), self.size)
-        # have dose array be in order (x, y, z)
-        self.dose = self.dose.reshape((self.shape)).transpose((2,1,0))
-        assert self.dose.size == self.size, \
-        "Dose array size does not match that specified."
-        
-        if load_uncertainty:
-            uncertainty = []
-            while len(uncertainty) < self.size:
-                line_data = map(float, data[cur_line].split())
-                uncertainty += line_data
-                cur_line += 1
-            self.uncertainty = numpy.array(uncertainty)  
-            assert len(self.uncertainty) == self.size, \
-            "len of uncertainty = {} (expected {})".format(
-                len(self.uncertainty), self.size
-                )
-            # have uncertainty array be in order (x, y, z)
-            self.uncertainty = self.uncertainty.reshape(
-                (self.shape)
+
+        self.shape = (x, y, z)
+        self.size = x * y * z
+
+    def _load_header(self, file_name):
+        # small chunks, so that the data blocks are barely tokenized
+        with _open_3ddose(file_name, self.threads) as data_file:
+            self._read_header(_ValueReader(data_file, chunk_size=2 ** 16))
+
+    def _load_3ddose(self, file_name, load_uncertainty=False, dtype=None):
+        if dtype is None:
+            dtype = self.dtype
+
+        # tokenize the header, the bounds and the data blocks chunk by chunk
+        # instead of building python lists line by line; for gzip input the
+        # next chunk is decompressed while the current one is parsed. Reading
+        # stops at the end of the dose block unless the uncertainty is
+        # requested.
+        with _open_3ddose(file_name, self.threads) as data_file:
+            reader = _ValueReader(data_file)
+            self._read_header(reader)
+            x, y, z = self.shape
+
+            # have the arrays be in order (x, y, z)
+            self.dose = reader.read(self.size, dtype).reshape(
+                (z,y,x)
                 ).transpose((2,1,0))
-            assert self.uncertainty.size == self.size, \
-            "uncertainty array size does not match that specified."
-
-        # reset the shape of array to have the proper (x,y,z) ordering
-        self.shape = (x, y, z) 
-            
-    def dump(self, file_name):
-        numpy.savez(file_name, dose=self.dose, uncertainty=self.uncertainty,
-            x_positions=self.positions[0], y_positions=self.positions[1],
-            z_positions=self.positions[2])
-
-    def max(self):
-        return self.dose.max()
-        
-    def min(self):
-        return self.dose.min()
+
+            if load_uncertainty:
+                self.uncertainty = reader.read(self.size, dtype).reshape(
+                    (z,y,x)
+                    ).transpose((2,1,0))
+
+    def dump(self, file_name, compress=False):
+        """
+        Writes the dose (and uncertainty, if loaded) to an .npz archive. The
+        default uncompressed archive can be memory mapped when loaded again;
+        compress=True trades that for a smaller file.
+        """
+        arrays = {
+            'dose': self.dose if self.scale == 1 else self.dose * self.scale,
+            'x_positions': self.positions[0],
+            'y_positions': self.positions[1],
+            'z_positions': self.positions[2]
+            }
+        if hasattr(self, 'uncertainty'):
+            arrays['uncertainty'] = self.uncertainty
+
+        if compress:
+            numpy.savez_compressed(file_name, **arrays)
+        else:
+            numpy.savez(file_name, **arrays)
+
+    def _get_index(self):
+        """
+        Returns the byte-offset index (row_offsets, members) of the source
+        file, loading it from the persisted index if it is still valid and
+        scanning the file (and persisting the result) otherwise.
+        """
+        if getattr(self, '_index', None) is not None:
+            return self._index
+
+        self._index = _load_index(self.file_name, self.shape)
+        if self._index is None:
+            self._index = _scan_offsets(self.file_name, self.shape)
+            index_path = _index_path(self.file_name)
+            key = _cache_key(self.file_name)
+            key = numpy.array(
+                [key['size'], key['mtime']], dtype=numpy.float64
+                )
+            try:
+                numpy.savez(
+                    index_path, key=key, shape=numpy.array(self.shape),
+                    row_offsets=self._index[0], members=self._index[1]
+                    )
+            except (IOError, OSError) as error:
+                print("WARNING: Could not write dose index {0} ({1})".format(
+                    index_path, error
+                    ))
+
+        return self._index
+
+    def read_uncertainty(self):
+        """
+        Description:
+        Loads the uncertainty block on demand for a file that was opened
+        without load_uncertainty, seeking straight to the block through the
+        byte-offset index.
+
+        Outputs:
+        :param uncertainty: uncertainty array in (x, y, z) order
+        :type uncertainty: numpy.ndarray
+        """
+
+        if not hasattr(self, 'uncertainty') and hasattr(self, 'store'):
+            self.uncertainty = self.store.read_region(
+                'uncertainty', cache=False
+                ).astype(self.dtype, copy=False)
+        elif not hasattr(self, 'uncertainty'):
+            x, y, z = self.shape
+            row_offsets, members = self._get_index()
+            assert len(row_offsets) > 2 * z * y, \
+            "{0} has no uncertainty block".format(self.file_name)
+
+            reader = _OffsetReader(self.file_name, members)
+            try:
+                uncertainty = reader.read(
+                    row_offsets[z * y], row_offsets[-1], self.size, self.dtype
+                    )
+            finally:
+                reader.close()
+            self.uncertainty = uncertainty.reshape((z, y, x)).transpose((2,1,0))
+
+        return self.uncertainty
+
+    def read_region(self, x_range=None, y_range=None, z_range=None,
+            uncertainty=False):
+        """
+        Description:
+        Reads the voxels of a box of the grid. If the block is already in
+        memory it is sliced; otherwise only the rows of the file covering the
+        box are read, through the byte-offset index.
+
+        Inputs:
+        :param x_range: (start, stop) voxel indices along x; None for all
+        :type x_range: tuple
+        :param y_range: (start, stop) voxel indices along y; None for all
+        :type y_range: tuple
+        :param z_range: (start, stop) voxel indices along z; None for all
+        :type z_range: tuple
+        :param uncertainty: read the uncertainty block instead of the dose
+        :type uncertainty: bool
+
+        Outputs:
+        :param region: values of the box in (x, y, z) order
+        :type region: numpy.ndarray
+        """
+
+        x, y, z = self.shape
+        x0, x1 = slice(*(x_range or (None,))).indices(x)[:2]
+        y0, y1 = slice(*(y_range or (None,))).indices(y)[:2]
+        z0, z1 = slice(*(z_range or (None,))).indices(z)[:2]
+
+        name = 'uncertainty' if uncertainty else 'dose'
+        if hasattr(self, name):
+            region = getattr(self, name)[x0:x1, y0:y1, z0:z1]
+        elif hasattr(self, 'store'):
+            region = self.store.read_region(
+                name, (x0, x1), (y0, y1), (z0, z1)
+                ).astype(self.dtype, copy=False)
+        else:
+            region = self._read_region_rows(
+                (x0, x1), (y0, y1), (z0, z1), uncertainty
+                )
+
+        # relative uncertainties are unchanged by scaling
+        if not uncertainty and self.scale != 1:
+            region = region * self.scale
+
+        return region
+
+    def _read_region_rows(self, x_range, y_range, z_range, uncertainty):
+        x, y, z = self.shape
+        x0, x1 = x_range
+        y0, y1 = y_range
+        z0, z1 = z_range
+
+        row_offsets, members = self._get_index()
+        first_row = z * y if uncertainty else 0
+        assert first_row + z * y < len(row_offsets), \
+        "{0} has no uncertainty block".format(self.file_name)
+
+        region = numpy.empty((z1 - z0, y1 - y0, x1 - x0), dtype=self.dtype)
+        reader = _OffsetReader(self.file_name, members)
+        try:
+            for z_index in range(z0, z1):
+                # rows y0..y1-1 of a z plane are contiguous in the file
+                row = first_row + z_index * y + y0
+                values = reader.read(
+                    row_offsets[row], row_offsets[row + y1 - y0],
+                    (y1 - y0) * x
+                    )
+                region[z_index - z0] = values.reshape((y1 - y0, x))[:, x0:x1]
+        finally:
+            reader.close()
+
+        return region.transpose((2,1,0))
+
+    def _read(self, ranges, uncertainty=False):
+        dose = self.read_region(*ranges)
+        if uncertainty:
+            return dose, self.read_region(*ranges, uncertainty=True)
+        return dose, None
+
+    def write_store(self, file_name, uncertainty=None, **options):
+        """
+        Description:
+        Writes the (scaled) dose, and the uncertainty if it is available, to
+        a chunked store that can be opened with random access (see
+        dose_store.write_store for the options).
+
+        Inputs:
+        :param file_name: path of the store, ending in STORE_EXTENSION
+        :type file_name: str
+        :param uncertainty: store the uncertainty; by default it is stored
+                            if it is loaded or in the source file
+        :type uncertainty: bool
+        """
+
+        if uncertainty is None:
+            uncertainty = self._has_uncertainty()
+        write_store(file_name, self, uncertainty, **options)
+
+    def _has_uncertainty(self):
+        # whether the uncertainty is loaded or can be read from the source
+        # (the uncertainty block of a .3ddose file is found through the
+        # byte-offset index)
+        if hasattr(self, 'uncertainty'):
+            return True
+        if hasattr(self, 'store'):
+            return 'uncertainty' in self.store.blocks
+        if self.file_name is None or self.file_name[-3:] == 'npz':
+            return False
+        x, y, z = self.shape
+        return len(self._get_index()[0]) > 2 * z * y
+
+    def write_3ddose(self, file_name, compress=True, precision=4, nz=None,
+            threads=None, level=6, uncertainty=None):
+        """
+        Description:
+        Writes the dose and uncertainty in the egs_brachy .3ddose text
+        format: the voxel counts, one line of bounds per axis and then the
+        dose and uncertainty blocks with one line per z plane. An uncertainty
+        that is not loaded is read slab by slab from the source file (or
+        store). Values are formatted with _format_scientific. Slabs of nz
+        planes are formatted and, with compress=True, gzipped in a thread pool
+        as independent gzip members, which gzip/zcat and DoseFile read as one
+        stream.
+
+        Inputs:
+        :param file_name: output path (conventionally ending in .3ddose.gz
+                          when compress=True)
+        :type file_name: str
+        :param compress: gzip the output
+        :type compress: bool
+        :param precision: digits after the decimal point of each value
+        :type precision: int
+        :param nz: z planes per slab; by default about 2**20 values per slab
+        :type nz: int
+        :param threads: number of worker threads (default: all cores)
+        :type threads: int
+        :param level: zlib compression level
+        :type level: int
+        :param uncertainty: write the uncertainty; False writes a block of
+                            zeros instead, and the default writes it if the
+                            grid has one and raises a ValueError otherwise
+        :type uncertainty: bool
+        """
+
+        x, y, z = self.shape
+        if nz is None:
+            nz = max(1, 2 ** 20 // (x * y))
+
+        if uncertainty is not False and not self._has_uncertainty():
+            raise ValueError(
+                "{0} has no uncertainty to write; pass uncertainty=False to "
+                "write a block of zeros".format(self.file_name)
+                )
+
+        header = _3ddose_header(self.shape, self.positions)
+
+        slabs = [
+            (block, z_index) for block in (0, 1) for z_index in range(0, z, nz)
+            ]
+
+        def write_slab(slab):
+            block, z_index = slab
+            if block == 1 and uncertainty is False:
+                values = numpy.zeros((x, y, min(nz, z - z_index)))
+            else:
+                values = self.read_region(
+                    z_range=(z_index, z_index + nz), uncertainty=block == 1
+                    )
+            # 3ddose blocks run fastest along x
+            text = _format_scientific(
+                values.transpose((2,1,0)), precision, line_length=x * y
+                )
+            return gzip_member(text, level) if compress else text
+
+        pool = ThreadPool(threads)
+        try:
+            with open(file_name, 'wb') as out_file:
+                out_file.write(gzip_member(header, level) if compress else header)
+                for data in pool.imap(write_slab, slabs):
+                    out_file.write(data)
+        finally:
+            pool.close()
+            pool.join()
+
+    def iter_slabs(self, nz=1, load_uncertainty=False):
+        """
+        Description:
+        Iterates over the grid in contiguous z-slabs. If the dose has not been
+        loaded (load_dose=False) the slabs are streamed from the file so that
+        at most one slab (per block) is held in memory; otherwise the loaded
+        arrays are sliced.
+
+        Inputs:
+        :param nz: number of z planes per slab (the last slab may be thinner)
+        :type nz: int
+        :param load_uncertainty: also yield the matching uncertainty slab
+        :type load_uncertainty: bool
+
+        Outputs:
+        :param slab: (z_index, dose_slab) or (z_index, dose_slab,
+                     uncertainty_slab) where z_index is the first z plane of
+                     the slab and the slabs are in (x, y, z) order
+        :type slab: tuple
+        """
+
+        if self.scale != 1:
+            for slab in self._iter_slabs(nz, load_uncertainty):
+                yield (slab[0], slab[1] * self.scale) + slab[2:]
+        else:
+            for slab in self._iter_slabs(nz, load_uncertainty):
+                yield slab
+
+    def _iter_slabs(self, nz, load_uncertainty):
+        x, y, z = self.shape
+
+        if hasattr(self, 'dose'):
+            for z_index in range(0, z, nz):
+                dose_slab = self.dose[:, :, z_index:z_index + nz]
+                if load_uncertainty:
+                    # an uncertainty that is not loaded is read from the
+                    # source a slab at a time
+                    yield (z_index, dose_slab, self.read_region(
+                        z_range=(z_index, z_index + nz), uncertainty=True
+                        ))
+                else:
+                    yield z_index, dose_slab
+            return
+
+        if hasattr(self, 'store'):
+            blocks = ('dose', 'uncertainty') if load_uncertainty else ('dose',)
+            for slab in self.store.iter_slabs(nz, blocks):
+                yield (slab[0],) + tuple(
+                    values.astype(self.dtype, copy=False)
+                    for values in slab[1:]
+                    )
+            return
+
+        # with a byte-offset index the end of the dose block is known, so
+        # the dose reader does not tokenize the uncertainty block that
+        # follows it in its last chunk
+        index = getattr(self, '_index', None)
+        if index is None:
+            index = _load_index(self.file_name, self.shape)
+
+        dose_file = _open_3ddose(self.file_name, self.threads)
+        uncertainty_file = None
+        try:
+            dose_reader = _ValueReader(
+                dose_file,
+                limit=int(index[0][z * y]) if index is not None else None
+                )
+            dose_reader.skip(3 + (x + 1) + (y + 1) + (z + 1))
+
+            if load_uncertainty:
+                # the uncertainty block follows the whole dose block, so a
+                # second reader starts at its offset in the persisted index
+                # or, without one, is advanced past the dose block
+                if index is not None:
+                    uncertainty_file = _OffsetReader(self.file_name, index[1])
+                    uncertainty_reader = _ValueReader(
+                        uncertainty_file._seek(int(index[0][z * y]))
+                        )
+                else:
+                    uncertainty_file = _open_3ddose(
+                        self.file_name, self.threads
+                        )
+                    uncertainty_reader = _ValueReader(uncertainty_file)
+                    uncertainty_reader.skip(
+                        3 + (x + 1) + (y + 1) + (z + 1) + self.size
+                        )
+
+            for z_index in range(0, z, nz):
+                n_planes = min(nz, z - z_index)
+                dose_slab = dose_reader.read(n_planes * y * x).astype(
+                    self.dtype, copy=False
+                    ).reshape((n_planes, y, x)).transpose((2,1,0))
+                if load_uncertainty:
+                    uncertainty_slab = uncertainty_reader.read(
+                        n_planes * y * x
+                        ).astype(self.dtype, copy=False).reshape(
+                            (n_planes, y, x)
+                            ).transpose((2,1,0))
+                    yield z_index, dose_slab, uncertainty_slab
+                else:
+                    yield z_index, dose_slab
+        finally:
+            dose_file.close()
+            if uncertainty_file is not None:
+                uncertainty_file.close()
+
+    def summary(self, cache_dir=None, nz=16):
+        """
+        Description:
+        Summary of the dose (see dose_summary.DoseSummary): extremes, mean,
+        sum, a fine log histogram and the maximum of each z plane, from which
+        fractions above a dose, D90 and coarse dose volume histograms are
+        answered without the dose blocks. For a file on disk it is read from
+        the .summary.npz sidecar (see dose_summary.load_summary) when that is
+        up to date, and otherwise computed in one streamed pass and stored.
+
+        Inputs:
+        :param cache_dir: directory holding the summaries (default: next to
+                          the dose file)
+        :type cache_dir: str
+        :param nz: slab thickness used when streaming
+        :type nz: int
+
+        Outputs:
+        :param summary: the summary, with the scale of the DoseFile
+        :type summary: DoseSummary
+        """
+
+        on_disk = self.file_name is not None and isfile(self.file_name)
+        summary = read_summary(self.file_name, cache_dir) if on_disk else None
+        if summary is None:
+            summary = summarize(self._iter_slabs(nz, False), self.positions)
+            if on_disk:
+                write_summary(self.file_name, summary, cache_dir)
+
+        summary.scale = self.scale
+        return summary
+
+    def max(self, nz=1):
+        if hasattr(self, 'dose'):
+            return (self.dose.max() if self.scale >= 0
+                else self.dose.min()) * self.scale
+        return _DoseArithmetic.max(self, nz)
+
+    def min(self, nz=1):
+        if hasattr(self, 'dose'):
+            return (self.dose.min() if self.scale >= 0
+                else self.dose.max()) * self.scale
+        return _DoseArithmetic.min(self, nz)
+
+    def pyramid(self, factor, kind='mean', factors=(2, 4, 8),
+            cache_dir=None):
+        """
+        Description:
+        Level of the multi-resolution pyramid of the dose that is coarser by
+        factor along each axis, as a DoseFile with its own bounds (factor 1
+        is the DoseFile itself). Each level holds the means of blocks of
+        factor^3 voxels, weighted by the voxel volumes, or with kind='max'
+        their maxima, so hot spots survive in quick looks.
+
+        All levels are built together on first use in one pass over the
+        grid (streamed if the dose is not loaded), each from the previous
+        one, and stored in float64 next to the dose file (see
+        _pyramid_path) for later runs; they are rebuilt if the file
+        changes. The lazy scale of the DoseFile carries over to the level.
+
+        Inputs:
+        :param factor: coarsening factor, one of factors
+        :type factor: int
+        :param kind: 'mean' or 'max'
+        :type kind: str
+        :param factors: factors of the levels of the pyramid; each must
+                        divide the next
+        :type factors: tuple
+        :param cache_dir: directory holding the pyramid (default: next to
+                          the dose file)
+        :type cache_dir: str
+
+        Outputs:
+        :param level: the coarser grid
+        :type level: DoseFile
+        """
+
+        assert kind in ('mean', 'max'), \
+        "kind must be 'mean' or 'max', not {0!r}".format(kind)
+        if factor == 1:
+            return self
+        factors = tuple(sorted(factors))
+        assert factor in factors, \
+        "factor {0} is not one of the pyramid factors {1}".format(
+            factor, factors
+            )
+
+        levels = getattr(self, '_pyramid', None)
+        if levels is None or levels['factors'] != factors:
+            levels = self._load_pyramid(factors, cache_dir)
+            self._pyramid = levels
+
+        positions = []
+        for p in self.positions:
+            # every factor-th bound, keeping the last one
+            starts = numpy.arange(0, len(p) - 1, factor)
+            positions.append(numpy.append(p[starts], p[-1]))
+
+        level = DoseFile.from_arrays(
+            positions,
+            levels[kind][factor].astype(self.dtype, copy=False)
+            )
+        level.scale = self.scale
+
+        return level
+
+    def preview(self, pixels, axis=None, kind='mean', factors=(2, 4, 8),
+            cache_dir=None):
+        """
+        Description:
+        Coarsest level of the pyramid (see pyramid) that still has at least
+        pixels voxels in the planes normal to axis (or in the whole grid if
+        axis is None), e.g. preview(200 ** 2, axis=2) for a quick look at an
+        xy plane. The DoseFile itself is returned if no level has enough.
+
+        Inputs:
+        :param pixels: voxels the plotted plane (or grid) should have
+        :type pixels: int
+        :param axis: axis normal to the plotted planes (0 = x, 1 = y, 2 = z)
+        :type axis: int
+
+        Outputs:
+        :param level: the chosen level
+        :type level: DoseFile
+        """
+
+        best = 1
+        for factor in sorted(factors):
+            shape = [-(-n // factor) for n in self.shape]
+            if axis is not None:
+                del shape[axis]
+            if numpy.prod(shape) >= pixels:
+                best = factor
+
+        return self.pyramid(best, kind, factors, cache_dir)
+
+    def _load_pyramid(self, factors, cache_dir):
+        persist = self.file_name is not None and isfile(self.file_name)
+        if persist:
+            pyramid_path = _pyramid_path(self.file_name, cache_dir)
+            key = _cache_key(self.file_name)
+            try:
+                with open(join(pyramid_path, 'header.json')) as header_file:
+                    header = json_load(header_file)
+                if header['key'] == key and tuple(header['factors']) == factors:
+                    return {
+                        'factors': factors,
+                        'mean': dict(
+                            (factor, numpy.load(join(
+                                pyramid_path, 'mean_{0}.npy'.format(factor)
+                                )))
+                            for factor in factors
+                            ),
+                        'max': dict(
+                            (factor, numpy.load(join(
+                                pyramid_path, 'max_{0}.npy'.format(factor)
+                                )))
+                            for factor in factors
+                            )
+                        }
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+
+        levels = self._build_pyramid(factors)
+        if persist:
+            self._write_pyramid(levels, pyramid_path, key)
+
+        return levels
+
+    def _build_pyramid(self, factors):
+        for smaller, larger in zip(factors, factors[1:]):
+            assert larger % smaller == 0, \
+            "pyramid factors {0} do not divide each other".format(factors)
+
+        # slabs of the largest factor in z keep the blocks of every level
+        # inside one slab
+        means = dict((factor, []) for factor in factors)
+        maxima = dict((factor, []) for factor in factors)
+        for z_index, slab in self._iter_slabs(factors[-1], False):
+            mean = maximum = numpy.asarray(slab, dtype=numpy.float64)
+            widths = [
+                self.spacing[0], self.spacing[1],
+                self.spacing[2][z_index:z_index + slab.shape[2]]
+                ]
+            previous = 1
+            for factor in factors:
+                for axis in range(3):
+                    mean, maximum, widths[axis] = _block_reduce(
+                        mean, maximum, widths[axis], factor // previous, axis
+                        )
+                means[factor].append(mean)
+                maxima[factor].append(maximum)
+                previous = factor
+
+        return {
+            'factors': factors,
+            'mean': dict(
+                (factor, numpy.concatenate(means[factor], axis=2))
+                for factor in factors
+                ),
+            'max': dict(
+                (factor, numpy.concatenate(maxima[factor], axis=2))
+                for factor in factors
+                )
+            }
+
+    def _write_pyramid(self, levels, pyramid_path, key):
+        # written like the sidecar cache (see _write_cache)
+        scratch_path = pyramid_path + '.tmp'
+        try:
+            if isdir(scratch_path):
+                rmtree(scratch_path)
+            makedirs(scratch_path)
+
+            for factor in levels['factors']:
+                for kind in ('mean', 'max'):
+                    numpy.save(
+                        join(scratch_path, '{0}_{1}.npy'.format(kind, factor)),
+                        levels[kind][factor]
+                        )
+            with open(join(scratch_path, 'header.json'), 'w') as header_file:
+                json_dump({
+                    'key': key, 'factors': list(levels['factors'])
+                    }, header_file)
+
+            if isdir(pyramid_path):
+                rmtree(pyramid_path)
+            rename(scratch_path, pyramid_path)
+        except (IOError, OSError) as error:
+            print("WARNING: Could not write dose pyramid {0} ({1})".format(
+                pyramid_path, error
+                ))
+
+    @property
+    def grid_index(self):
+        """
+        GridIndex of the dose grid for constant time position to voxel
+        lookups, built on first use.
+        """
+        if self._grid_index is None:
+            self._grid_index = GridIndex(self.positions)
+        return self._grid_index
 
     @property
     def x_extent(self):
@@ -144,3 +2123,204 @@ class DoseFile(object):
     @property
     def z_extent(self):
         return self.positions[2][0], self.positions[2][-1]
+
+_OPERATORS = {
+    '+': numpy.add,
+    '-': numpy.subtract,
+    '*': numpy.multiply,
+    '/': numpy.true_divide
+    }
+
+def _propagate(operator, left, right):
+    # left and right are (dose, relative uncertainty) pairs; the uncertainty
+    # is None when it is not wanted and 0 for numbers
+    (a, a_uncertainty), (b, b_uncertainty) = left, right
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        dose = _OPERATORS[operator](a, b)
+        if a_uncertainty is None or b_uncertainty is None:
+            return dose, None
+
+        if operator in '+-':
+            # absolute uncertainties add in quadrature
+            uncertainty = numpy.sqrt(
+                (a_uncertainty * a) ** 2 + (b_uncertainty * b) ** 2
+                ) / abs(dose)
+            uncertainty = numpy.where(dose == 0, 0., uncertainty)
+        else:
+            # relative uncertainties add in quadrature
+            uncertainty = numpy.sqrt(a_uncertainty ** 2 + b_uncertainty ** 2)
+            uncertainty = uncertainty * numpy.ones_like(dose)
+
+    return dose, uncertainty
+
+class DoseExpression(_DoseArithmetic):
+
+    """
+    Description:
+    Lazy arithmetic on dose grids, built by the operators of DoseFile and of
+    other expressions, e.g. (shielded * factor - unshielded) / unshielded.
+    The operands are only read when a region, plane, slab or histogram of the
+    expression is requested, and then only for that part of the grid, so
+    scaling a large grid costs nothing until a slice of it is used.
+
+    Relative uncertainties are propagated assuming independent operands:
+    absolute uncertainties add in quadrature for + and -, relative
+    uncertainties add in quadrature for * and /, and numbers are exact. The
+    uncertainty is 0 where the resulting dose is 0.
+
+    Inputs:
+    :param operator: one of '+', '-', '*' and '/'
+    :type operator: str
+    :param left: left operand
+    :type left: DoseFile, DoseExpression or number
+    :param right: right operand
+    :type right: DoseFile, DoseExpression or number
+    """
+
+    def __init__(self, operator, left, right):
+        assert operator in _OPERATORS, "unknown operator " + operator
+        grids = [
+            operand for operand in (left, right)
+            if isinstance(operand, _DoseArithmetic)
+            ]
+        assert grids, "an expression needs at least one dose grid"
+        if len(grids) == 2:
+            assert tuple(grids[0].shape) == tuple(grids[1].shape), \
+            "cannot combine grids of shape {0} and {1}".format(
+                grids[0].shape, grids[1].shape
+                )
+            for p, q in zip(grids[0].positions, grids[1].positions):
+                assert numpy.allclose(p, q), "the grid bounds differ"
+
+        self.operator = operator
+        self.left = left
+        self.right = right
+        self.grid = grids[0]
+        self.shape = grids[0].shape
+        self.size = grids[0].size
+        self.positions = grids[0].positions
+        self.dtype = numpy.result_type(*[grid.dtype for grid in grids])
+
+    @property
+    def grid_index(self):
+        return self.grid.grid_index
+
+    def _read(self, ranges, uncertainty=False):
+        operands = [
+            operand._read(ranges, uncertainty)
+            if isinstance(operand, _DoseArithmetic)
+            else (operand, 0. if uncertainty else None)
+            for operand in (self.left, self.right)
+            ]
+        return _propagate(self.operator, *operands)
+
+    def read_region(self, x_range=None, y_range=None, z_range=None,
+            uncertainty=False):
+        """
+        Evaluates the expression on a box of the grid (see
+        DoseFile.read_region); with uncertainty=True the propagated relative
+        uncertainty of the box is returned instead of the dose.
+        """
+        dose, relative_uncertainty = self._read(
+            (x_range, y_range, z_range), uncertainty
+            )
+        return relative_uncertainty if uncertainty else dose
+
+    def iter_slabs(self, nz=1, load_uncertainty=False):
+        """
+        Evaluates the expression slab by slab, streaming the operands with
+        their own iter_slabs (see DoseFile.iter_slabs).
+        """
+        streams = [
+            operand.iter_slabs(nz, load_uncertainty)
+            if isinstance(operand, _DoseArithmetic)
+            else repeat((None, operand, 0.))
+            for operand in (self.left, self.right)
+            ]
+        for left, right in izip(*streams):
+            z_index = left[0] if left[0] is not None else right[0]
+            dose, uncertainty = _propagate(
+                self.operator,
+                (left[1], left[2] if load_uncertainty else None),
+                (right[1], right[2] if load_uncertainty else None)
+                )
+            if load_uncertainty:
+                yield z_index, dose, uncertainty
+            else:
+                yield z_index, dose
+
+def absolute_uncertainty(dose, uncertainty, dtype=None):
+    """
+    Description:
+    Converts the relative uncertainty stored in 3ddose files to an absolute
+    uncertainty, uncertainty * |dose|, allocating only the result.
+
+    Inputs:
+    :param dose: dose array
+    :type dose: numpy.ndarray
+    :param uncertainty: relative uncertainty array of the same shape
+    :type uncertainty: numpy.ndarray
+    :param dtype: type of the result; defaults to that of the inputs
+    :type dtype: numpy.dtype
+
+    Outputs:
+    :param err: absolute uncertainty
+    :type err: numpy.ndarray
+    """
+
+    if dtype is None:
+        dtype = numpy.result_type(dose, uncertainty)
+
+    err = numpy.absolute(dose, dtype=dtype)
+    err *= uncertainty
+
+    return err
+
+def percent_difference(A, B, dtype=None):
+    """
+    Description:
+    Percentage difference ((A - B) / B) * 100 with NaNs turned to 0 and
+    infinities to the largest representable number, computed in place so
+    only the result is allocated.
+
+    Inputs:
+    :param A: compared dose array
+    :type A: numpy.ndarray
+    :param B: reference dose array
+    :type B: numpy.ndarray
+    :param dtype: type of the result; defaults to that of the inputs
+    :type dtype: numpy.dtype
+
+    Outputs:
+    :param per_diff: percentage difference
+    :type per_diff: numpy.ndarray
+    """
+
+    if dtype is None:
+        dtype = numpy.result_type(A, B)
+
+    per_diff = numpy.subtract(A, B, dtype=dtype)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        per_diff /= B
+    per_diff *= 100
+
+    return numpy.nan_to_num(per_diff, copy=False)
+
+def dose_to_volume(dose, volume=90.):
+    """
+    Description:
+    Minimum dose received by the hottest volume percent of the voxels, e.g.
+    D90 for volume=90.
+
+    Inputs:
+    :param dose: dose array (any shape)
+    :type dose: numpy.ndarray
+    :param volume: percent of the voxels
+    :type volume: float
+
+    Outputs:
+    :param dose_volume: dose covering the given volume
+    :type dose_volume: float
+    """
+
+    return numpy.percentile(dose, 100. - volume)
@@ -0,0 +1,218 @@
+#!/usr/bin/env
+# purpose: streaming weighted superposition of reference dose files
+
+from __future__ import division, print_function
+
+from multiprocessing import Lock, Pool, RawArray, cpu_count
+from os.path import basename
+from time import time
+
+import numpy
+
+from py3ddose import DoseFile
+
+# accumulators and locks of a worker process, set by _init_worker
+_worker = {}
+
+
+def _accumulator(shape, dtype, buffer=None):
+    # zeroed (x, y, z) accumulator, in buffer if given (shared memory), laid
+    # out in the (z, y, x) order of the file like the arrays of DoseFile so
+    # that a z-slab is one contiguous block matching the slabs read
+    if buffer is None:
+        values = numpy.zeros(tuple(shape)[::-1], dtype=dtype)
+    else:
+        values = numpy.frombuffer(buffer, dtype=dtype).reshape(
+            tuple(shape)[::-1]
+            )
+    return values.transpose((2,1,0))
+
+def _open_reference(file_name, dtype, uncertainty, threads=None):
+    reference = DoseFile(
+        file_name, load_dose=False, dtype=dtype, threads=threads
+        )
+    if uncertainty and not (
+            hasattr(reference, 'dose') or hasattr(reference, 'store')):
+        # a text file is streamed with a second reader for the uncertainty
+        # block; the persisted byte-offset index lets it start there instead
+        # of tokenizing the dose block again, which pays for the scan on the
+        # first run
+        reference._get_index()
+    return reference
+
+def _accumulate(reference, weight, dose, variance, nz, locks=None):
+    # adds the weighted dose and squared absolute uncertainty of reference
+    # slab by slab; with locks (one per slab) several processes can add
+    # into the same shared accumulators
+    for slab in reference.iter_slabs(nz, variance is not None):
+        z_index = slab[0]
+        planes = slice(z_index, z_index + slab[1].shape[2])
+        weighted = slab[1] * weight
+        if variance is not None:
+            # in the float64 of the variance accumulator
+            squared = numpy.multiply(weighted, slab[2], dtype=numpy.float64)
+            squared *= squared
+
+        if locks is not None:
+            locks[z_index // nz].acquire()
+        try:
+            dose[:, :, planes] += weighted
+            if variance is not None:
+                variance[:, :, planes] += squared
+        finally:
+            if locks is not None:
+                locks[z_index // nz].release()
+
+def _init_worker(dose_buffer, variance_buffer, locks, shape, dtype, nz):
+    _worker['dose'] = _accumulator(shape, dtype, dose_buffer)
+    _worker['variance'] = (
+        _accumulator(shape, numpy.float64, variance_buffer)
+        if variance_buffer is not None else None
+        )
+    _worker['locks'] = locks
+    _worker['dtype'] = dtype
+    _worker['nz'] = nz
+
+def _add_reference(task):
+    file_name, weight = task
+    start = time()
+    # the workers share the cores, so each one decompresses in one thread
+    reference = _open_reference(
+        file_name, _worker['dtype'], _worker['variance'] is not None, 1
+        )
+    _accumulate(
+        reference, weight, _worker['dose'], _worker['variance'],
+        _worker['nz'], _worker['locks']
+        )
+    return file_name, time() - start
+
+def _check_grid(reference, shape, positions):
+    assert tuple(reference.shape) == tuple(shape), \
+    "{0} has shape {1}, not {2}".format(
+        reference.file_name, reference.shape, shape
+        )
+    for p, q in zip(positions, reference.positions):
+        assert numpy.allclose(p, q), \
+        "the grid bounds of {0} differ".format(reference.file_name)
+
+def superpose(file_names, weights, uncertainty=True, dtype=numpy.float64,
+        nz=8, processes=1, report=False):
+    """
+    Description:
+    Weighted superposition of reference dose files (e.g. the dwell positions
+    of an applicator) streamed slab by slab: each file is read in z-slabs of
+    nz planes and its weighted dose and squared absolute uncertainty are
+    added into two preallocated accumulators. Only the accumulators and a
+    slab per file being read are held in memory, whatever the number of
+    files.
+
+    With processes > 1 the files are parsed in a pool of worker processes
+    that add into accumulators in shared memory, each slab under its own
+    lock, so that with as many processes as files the superposition takes
+    about as long as parsing one file.
+
+    The reference files are independent simulations, so the absolute
+    uncertainties w_i * r_i * D_i add in quadrature. Their squares are
+    summed in float64 whatever dtype is, as in float32 they underflow for
+    doses per history of about 1e-19 and below.
+
+    Inputs:
+    :param file_names: paths of the reference dose files, on the same grid
+    :type file_names: list
+    :param weights: weight of each reference file
+    :type weights: list
+    :param uncertainty: also accumulate the uncertainty
+    :type uncertainty: bool
+    :param dtype: type of the dose accumulator and of the results;
+                  numpy.float32 halves the memory of the dose and keeps
+                  about 7 significant digits
+    :type dtype: numpy.dtype
+    :param nz: z planes per slab
+    :type nz: int
+    :param processes: number of worker processes; 1 reads the files one
+                      after the other in this process and None uses all
+                      cores
+    :type processes: int
+    :param report: print the time taken by each file and in total
+    :type report: bool
+
+    Outputs:
+    :param dose: superposed dose in (x, y, z) order
+    :type dose: numpy.ndarray
+    :param absolute_uncertainty: absolute uncertainty of the dose (None with
+                                 uncertainty=False)
+    :type absolute_uncertainty: numpy.ndarray
+    :param positions: x, y and z bounds of the grid
+    :type positions: list
+    """
+
+    assert len(weights) == len(file_names), \
+    "{0} weights for {1} reference files".format(len(weights), len(file_names))
+    assert len(file_names) > 0, "nothing to superpose"
+
+    start = time()
+    dtype = numpy.dtype(dtype)
+    processes = min(processes or cpu_count(), len(file_names))
+
+    # the headers give the grid, which every file must share
+    first = DoseFile(file_names[0], load_dose=False, dtype=dtype)
+    shape = tuple(first.shape)
+    positions = first.positions
+    for file_name in file_names[1:]:
+        _check_grid(DoseFile(file_name, load_dose=False), shape, positions)
+
+    if processes == 1:
+        # separate accumulators: the squared uncertainties must not be added
+        # into the dose
+        dose = _accumulator(shape, dtype)
+        variance = (
+            _accumulator(shape, numpy.float64) if uncertainty else None
+            )
+        timings = []
+        for file_name, weight in zip(file_names, weights):
+            file_start = time()
+            _accumulate(
+                _open_reference(file_name, dtype, uncertainty), weight, dose,
+                variance, nz
+                )
+            timings.append((file_name, time() - file_start))
+    else:
+        # zero filled shared memory, inherited by the workers
+        size = int(numpy.prod(shape))
+        type_code = {'float32': 'f', 'float64': 'd'}[dtype.name]
+        dose_buffer = RawArray(type_code, size)
+        variance_buffer = RawArray('d', size) if uncertainty else None
+        locks = [Lock() for __ in range(0, shape[2], nz)]
+
+        pool = Pool(
+            processes, _init_worker,
+            (dose_buffer, variance_buffer, locks, shape, dtype, nz)
+            )
+        try:
+            timings = pool.map(
+                _add_reference, list(zip(file_names, weights)), chunksize=1
+                )
+        finally:
+            pool.close()
+            pool.join()
+
+        dose = _accumulator(shape, dtype, dose_buffer)
+        variance = _accumulator(
+            shape, numpy.float64, variance_buffer
+            ) if uncertainty else None
+
+    if report:
+        for file_name, elapsed in timings:
+            print("{0}: {1:.2f} s".format(basename(file_name), elapsed))
+        print("superposed {0} files in {1:.2f} s with {2} process{3}".format(
+            len(file_names), time() - start, processes,
+            'es' if processes > 1 else ''
+            ))
+
+    if uncertainty:
+        # in place, so that no third float64 grid is allocated
+        absolute_uncertainty = numpy.sqrt(variance, out=variance).astype(
+            dtype, copy=False
+            )
+        return dose, absolute_uncertainty, positions
+    return dose, None, positions
@@ -9,11 +9,14 @@ from sys import argv, exit
 from os import getcwd
 
 from numpy import (
-    linspace, zeros_like, histogram, arange, sqrt, isnan, array, meshgrid,
-    empty, nan_to_num, loadtxt
+    linspace, zeros_like, histogram, arange, sqrt, isnan, array,
+    empty, nan_to_num, loadtxt, float64
     )
-from scipy.interpolate import RegularGridInterpolator as RGI
-from py3ddose import DoseFile, position_to_index
+from py3ddose import position_to_index, percent_difference
+from dose_cache import dose_cache, get_dose
+from interpolation import interpolate_grid
+from dose_summary import load_summary
+from isodose import isodose_volumes
 from normalize import get_conversion_factor
 
 from matplotlib.cm import get_cmap, tab10
@@ -24,7 +27,20 @@ from matplotlib.pyplot import subplots, close, figure
 from matplotlib.gridspec import GridSpec
 from matplotlib.ticker import MultipleLocator
 
-def generate_tdvh_mlwa():
+def generate_tdvh_mlwa(from_summary=False):
+    """
+    Description:
+    Plots the differential and cumulative dose volume histograms of the
+    MBDCA runs for each shield and voxel size.
+
+    Inputs:
+    :param from_summary: read the coarse histograms from the dose summary
+                         sidecars (see dose_summary.load_summary) instead of
+                         streaming every dose file, for quick renders of
+                         many runs; they are off by up to about 1 % of the
+                         volume
+    :type from_summary: bool
+    """
 
     pwd = getcwd()
 
@@ -102,22 +118,27 @@ def generate_tdvh_mlwa():
     for index1 in xrange(3):
         for index2 in xrange(4):
 
-            main_data = DoseFile(file_dict[(index1,index2)])
-
             # scale to absolute dose using maximum individual dwell time
-            data_flat = main_data.dose.flatten() * 8.2573429808917e13 
-            
-            n, bins, __ = ax[index1].hist(
-                data_flat,
-                bins=500,
+            if from_summary:
+                n, n_cum_base, bins = load_summary(
+                    file_dict[(index1,index2)]
+                    ).dose_volume_histogram(bins=500, scale=8.2573429808917e13)
+            else:
+                # stream the dose in z-slabs so the 0.5 mm grids fit in memory
+                main_data = get_dose(file_dict[(index1,index2)], load_dose=False)
+                n, n_cum_base, bins = main_data.dose_volume_histogram(
+                    bins=500, scale=8.2573429808917e13, nz=10
+                    )
+
+            ax[index1].hist(
+                bins[:-1],
+                bins=bins,
                 color=color_list[index1],
                 label=label_list[index1],
-                weights=zeros_like(data_flat) + 1. / data_flat.size * 100,
+                weights=n,
                 alpha=0.4
                 )
 
-            n_cum_base = n[::-1].cumsum()[::-1]
-
             ax2[index1].loglog(
                 bins[:-1], n_cum_base,
                 color=color_list[index1],
@@ -244,18 +265,17 @@ def dose_position_plots():
 
         for index2 in xrange(len(file_list)):  # iterate through shield types
 
-            full_data = DoseFile(
+            full_data = get_dose(
                 file_list[index2].format(vox_size_list[fig_index]),
                 load_uncertainty=True
             )
 
             Nx, Ny, Nz = full_data.shape
 
-            # scale to absolute dose 
-            full_data.dose *= get_conversion_factor(air_kerma_strength,
+            # scale to absolute dose (applied to the profiles read below)
+            full_data *= get_conversion_factor(air_kerma_strength,
                 air_kerma_per_history, max_dwell_time
             )
-            full_data.uncertainty *= full_data.dose.__abs__()
 
             x_min, x_max = full_data.x_extent
             y_min, y_max = full_data.y_extent
@@ -269,53 +289,19 @@ def dose_position_plots():
             y_pos_mid = (y_pos[:-1] + y_pos[1:]) / 2.0
             z_pos_mid = (z_pos[:-1] + z_pos[1:]) / 2.0
 
+            mid_positions = [x_pos_mid, y_pos_mid, z_pos_mid]
+
             for index1 in xrange(3):  # iterate through axes x, y, and z
 
-                if index1 == 0:
-                    ax[index1, index2].errorbar(
-                        x_pos_mid, 
-                        full_data.dose[
-                            :, 
-                            position_to_index(0.0, y_pos_mid),
-                            position_to_index(0.0, z_pos_mid)
-                            ],
-                        yerr=full_data.uncertainty[
-                            :, 
-                            position_to_index(0.0, y_pos_mid), 
-                            position_to_index(0.0, z_pos_mid)
-                            ],
-                        lw=3.0 
-                    )
-                elif index1 == 1:
-                    ax[index1, index2].errorbar(
-                        y_pos_mid,
-                        full_data.dose[
-                            position_to_index(0.0, x_pos_mid),
-                            :,
-                            position_to_index(0.0, z_pos_mid)
-                            ],
-                        yerr=full_data.uncertainty[
-                            position_to_index(0.0, x_pos_mid), 
-                            :, 
-                            position_to_index(0.0, z_pos_mid)
-                            ],
-                        lw=3.0
-                    )
-                else:
-                    ax[index1, index2].errorbar(
-                        z_pos_mid,
-                        full_data.dose[
-                            position_to_index(0.0, x_pos_mid), 
-                            position_to_index(0.0, y_pos_mid),
-                            :
-                            ],
-                        yerr=full_data.uncertainty[
-                            position_to_index(0.0, x_pos_mid), 
-                            position_to_index(0.0, y_pos_mid), 
-                            :
-                            ],
-                        lw=3.0
-                    )
+                # profile along this axis through the voxel at the origin
+                (dose_profile,), (err_profile,) = full_data.profiles(
+                    [(0.0, 0.0)], axis=index1, lookup='centre'
+                )
+
+                ax[index1, index2].errorbar(
+                    mid_positions[index1], dose_profile,
+                    yerr=err_profile, lw=3.0
+                )
 
         for n in xrange(3):
             for m in xrange(len(file_list)):
@@ -466,10 +452,11 @@ def rel_dose_position_plot():
                 marker='^', s=14
                 )
 
-            unshielded_full_data = DoseFile(unshielded_file, load_uncertainty=True)
-            shield_90_data = DoseFile(shielded_file_90, load_uncertainty=True)
-            shield_180_data = DoseFile(shielded_file_180, load_uncertainty=True)
-            shield_270_data = DoseFile(shielded_file_270, load_uncertainty=True)
+            # only lines of these are used, read through the byte-offset index
+            unshielded_full_data = get_dose(unshielded_file, load_dose=False)
+            shield_90_data = get_dose(shielded_file_90, load_dose=False)
+            shield_180_data = get_dose(shielded_file_180, load_dose=False)
+            shield_270_data = get_dose(shielded_file_270, load_dose=False)
 
             # print unshielded_full_data.shape
             # print shield_90_data.shape
@@ -488,46 +475,23 @@ def rel_dose_position_plot():
             y_pos_mid = (y_pos[:-1] + y_pos[1:]) / 2.0
             z_pos_mid = (z_pos[:-1] + z_pos[1:]) / 2.0
 
-            error_90 = sqrt(
-                (shield_90_data.uncertainty) ** 2
-                + (unshielded_full_data.uncertainty) ** 2
-            ) 
-            error_180 = sqrt(
-                (shield_180_data.uncertainty) ** 2
-                + (unshielded_full_data.uncertainty) ** 2
-            ) 
-            error_270 = sqrt(
-                (shield_270_data.uncertainty) ** 2
-                + (unshielded_full_data.uncertainty) ** 2
-            ) 
-
-            unshielded_interpolated_dose_matrix = unshielded_full_data.dose
-            shield_90_interpolated_dose_matrix = shield_90_data.dose
-            shield_180_interpolated_dose_matrix = shield_180_data.dose
-            shield_270_interpolated_dose_matrix = shield_270_data.dose
-
-            shield_90_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
-            shield_180_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
-            shield_270_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
-
-            error_90 *= shield_90_data.dose.__abs__()
-            error_180 *= shield_180_data.dose.__abs__()
-            error_270 *= shield_270_data.dose.__abs__()
+            # shielded / unshielded dose ratios along x through the origin;
+            # only that line of each ratio is evaluated, with the relative
+            # uncertainties of the two doses added in quadrature
+            ratio_lines = []
+            for shield_data in [shield_90_data, shield_180_data, shield_270_data]:
+                ratio = shield_data / unshielded_full_data
+                (ratio_line,), (error_line,) = ratio.profiles(
+                    [(0.0, 0.0)], axis=0, lookup='centre'
+                )
+                ratio_lines.append((ratio_line, error_line))
+            (ratio_90, error_90), (ratio_180, error_180), \
+                (ratio_270, error_270) = ratio_lines
 
             ax.errorbar(
                 x_pos_mid[::stride],
-                # shield_90_data.dose[
-                shield_90_interpolated_dose_matrix[
-                # error_90[
-                    :, 
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_90[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_90[::stride],
+                yerr=error_90[::stride],
                 lw=2.0, label=r'$90^{\circ}$ MC', color='darkgreen',
                 # markeredgecolor='darkgreen', marker='o',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -535,16 +499,8 @@ def rel_dose_position_plot():
             )
             ax_twin.errorbar(
                 x_pos_mid[::stride],
-                shield_90_interpolated_dose_matrix[
-                    :, 
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_90[
-                    :, 
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_90[::stride],
+                yerr=error_90[::stride],
                 lw=2.0, label=r'$90^{\circ}$', color='darkgreen',
                 # markeredgecolor='darkgreen', marker='o',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -553,16 +509,8 @@ def rel_dose_position_plot():
 
             ax.errorbar(
                 x_pos_mid[::stride],
-                shield_180_interpolated_dose_matrix[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_180[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_180[::stride],
+                yerr=error_180[::stride],
                 lw=2.0, label=r'$180^{\circ}$ MC', color='purple',
                 # markeredgecolor='purple', marker='s',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -570,16 +518,8 @@ def rel_dose_position_plot():
             )
             ax_twin.errorbar(
                 x_pos_mid[::stride],
-                shield_180_interpolated_dose_matrix[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_180[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_180[::stride],
+                yerr=error_180[::stride],
                 lw=2.0, label=r'$180^{\circ}$', color='purple',
                 # markeredgecolor='purple', marker='s',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -588,16 +528,8 @@ def rel_dose_position_plot():
 
             ax.errorbar(
                 x_pos_mid[::stride],
-                shield_270_interpolated_dose_matrix[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_270[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_270[::stride],
+                yerr=error_270[::stride],
                 lw=2.0, label=r'$270^{\circ}$ MC', color='darkorange',
                 # markeredgecolor='darkorange', marker='^',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -605,16 +537,8 @@ def rel_dose_position_plot():
             )
             ax_twin.errorbar(
                 x_pos_mid[::stride],
-                shield_270_interpolated_dose_matrix[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
-                yerr=error_270[
-                    :,
-                    position_to_index(0.0, y_pos_mid),
-                    position_to_index(0.0, z_pos_mid)
-                ][::stride],
+                ratio_270[::stride],
+                yerr=error_270[::stride],
                 lw=2.0, label=r'$270^{\circ}$', color='darkorange',
                 # markeredgecolor='darkorange', marker='^',
                 markeredgewidth=1,# markersize=10, markerfacecolor='None',
@@ -676,7 +600,7 @@ def rel_dose_position_plot():
 
             close(fig)
 
-def dose_inv_position_plots(interpolate=False, plot=False):
+def dose_inv_position_plots(interpolate=False, plot=False, dtype=float64):
     """
     Description:
     Takes any number of .3ddose files and plots a plethora of diagnostic plots 
@@ -685,6 +609,8 @@ def dose_inv_position_plots(interpolate=False, plot=False):
     Inputs:
     :name list_file: a list of file names that are to be loaded
     :type list_file: list
+    :param dtype: type of the dose arrays (float32 halves the memory)
+    :type dtype: numpy.dtype
     """
 
     pwd = getcwd()
@@ -758,16 +684,16 @@ def dose_inv_position_plots(interpolate=False, plot=False):
                 # iterate through shield types
                 for index2, shield_type in enumerate(shield_type_lst):
 
-                    full_data = DoseFile(
+                    full_data = get_dose(
                         target_dir
                         + '/mlwa_25mmOut_'
                         + '{0}shield_{1}mm'.format(shield_type, vox_size)
                         + '_sim.phantom_wo_applicator.3ddose.gz',
-                        load_uncertainty=True
+                        load_uncertainty=True, dtype=dtype
                     )
 
                     # scale to maximum individual dwell time
-                    full_data.dose *= get_conversion_factor(
+                    full_data *= get_conversion_factor(
                         air_kerma_str, air_kerma_per_hist, max_dwell_time
                     )
 
@@ -785,73 +711,46 @@ def dose_inv_position_plots(interpolate=False, plot=False):
                     y_pos_mid = (y_pos[:-1] + y_pos[1:]) / 2.0
                     z_pos_mid = (z_pos[:-1] + z_pos[1:]) / 2.0
 
+                    # voxel indices of the shielded (+x) and unshielded (-x)
+                    # lines and of the z range, looked up once per file
+                    (ix_pos, ix_neg), iy, (iz_min, iz_max, iz_origin) = (
+                        full_data.grid_index.bounds[0](
+                            [x_pos_desired, -x_pos_desired]
+                        ),
+                        full_data.grid_index.bounds[1](y_pos_desired),
+                        full_data.grid_index.bounds[2]([-2.5, 2.6, 0.0])
+                    )
+
                     if interpolate:
 
-                        interpolated_dose = RGI(
-                            (x_pos_mid, y_pos_mid, z_pos_mid),
-                            full_data.dose,
-                            bounds_error=False,
-                            fill_value=None
+                        # shielded and unshielded dose along z at the voxel
+                        # bounds themselves (they need not be uniform),
+                        # extrapolated linearly beyond the outermost voxel
+                        # centres
+                        dose_lines, err_lines = interpolate_grid(
+                            full_data, x_pos[[ix_pos, ix_neg]], [y_pos[iy]],
+                            z_pos, uncertainty=True, fill_value=None
                         )
-
-                        points = meshgrid(x_pos, y_pos, z_pos)
-                        flat = array([m.flatten() for m in points])
-
-                        # something happens during the reshape that messes up the
-                        # (x, y, z) ordering not quite sure why.
-                        # Need the transpose in order to get proper (x, y, z)
-                        # ordering
-                        dose_matrix = interpolated_dose(
-                            flat.transpose()
-                        ).reshape(*points[0].shape).transpose((1, 0, 2))
-
-                        z_depths = (
-                                dose_matrix[
-                                    position_to_index(x_pos_desired, x_pos),
-                                    position_to_index(y_pos_desired, y_pos),
-                                    :
-                                ] / dose_matrix[
-                                    position_to_index(-x_pos_desired, x_pos),
-                                    position_to_index(y_pos_desired, y_pos),
-                                    :
-                                ]
-                            )
+                        shielded, unshielded = dose_lines[:, 0, :]
+                        shielded_err, unshielded_err = err_lines[:, 0, :]
 
                     else:
 
-                        dose_matrix = full_data.dose
-                        err_matrix = full_data.uncertainty * dose_matrix.__abs__()
-
-                        z_depths = (
-                            dose_matrix[
-                                position_to_index(x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ] / dose_matrix[
-                                position_to_index(-x_pos_desired,x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ]
-                        )
-                        z_depths_err = sqrt(
-                            (err_matrix[
-                                position_to_index(x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ] ** 2) * (err_matrix[
-                                position_to_index(-x_pos_desired,x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ] ** 2)
-                        ) * z_depths.__abs__()
+                        (shielded, unshielded), (shielded_err, unshielded_err) = \
+                            full_data.profiles([
+                                (x_pos_desired, y_pos_desired),
+                                (-x_pos_desired, y_pos_desired)
+                            ])
+
+                    z_depths = shielded / unshielded
+                    z_depths_err = sqrt(
+                        (shielded_err ** 2) * (unshielded_err ** 2)
+                    ) * z_depths.__abs__()
 
                     print "For shield type:", shield_type, ", voxel size:", vox_size
-                    print "mean =", z_depths[
-                        position_to_index(-2.5, z_pos):position_to_index(2.6, z_pos)
-                        ].mean(), ", std. deviation =", z_depths[
-                            position_to_index(-2.5, z_pos):position_to_index(2.6, z_pos)
-                        ].std()
-                    print "At origin:", z_depths[position_to_index(0.0, z_pos)], z_depths_err[position_to_index(0.0, z_pos)]
+                    print "mean =", z_depths[iz_min:iz_max].mean(), \
+                        ", std. deviation =", z_depths[iz_min:iz_max].std()
+                    print "At origin:", z_depths[iz_origin], z_depths_err[iz_origin]
                     print; 
 
                     if plot:
@@ -869,30 +768,14 @@ def dose_inv_position_plots(interpolate=False, plot=False):
 
                         ax[0].errorbar(
                             z_pos_mid,
-                            dose_matrix[
-                                position_to_index(x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ],
-                            yerr=err_matrix[
-                                position_to_index(x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                                ],
+                            shielded,
+                            yerr=shielded_err,
                             lw=3.0, capsize=2.0, elinewidth=2.0
                         )
                         ax[1].errorbar(
                             z_pos_mid,
-                            dose_matrix[
-                                position_to_index(-x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                            ],
-                            yerr=err_matrix[
-                                position_to_index(-x_pos_desired, x_pos),
-                                position_to_index(y_pos_desired, y_pos),
-                                :
-                                ],
+                            unshielded,
+                            yerr=unshielded_err,
                             lw=3.0, capsize=2.0, elinewidth=2.0
                         )
                         ax[2].errorbar(
@@ -957,7 +840,7 @@ def dose_inv_position_plots(interpolate=False, plot=False):
 
                         close(fig)
 
-def isodose_plot(mode='mlwa'):
+def isodose_plot(mode='mlwa', preview_pixels=None):
     """
     Description:
     Takes any number of .3ddose files and plots a plethora of diagnostic plots 
@@ -966,6 +849,10 @@ def isodose_plot(mode='mlwa'):
     Inputs:
     :name list_file: a list of file names that are to be loaded
     :type list_file: list
+    :param preview_pixels: for quick looks, plot the coarsest level of the
+                           dose pyramid with at least this many voxels in
+                           each plane instead of the full resolution grid
+    :type preview_pixels: int
     """
 
     pwd = getcwd()
@@ -1033,10 +920,13 @@ def isodose_plot(mode='mlwa'):
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                full_data = DoseFile(
+                # only the z = 0 and y = 0 planes are plotted, so read just
+                # those through the byte-offset index
+                full_data = get_dose(
                     target_dir + target_file.format(
                         shield_type, diameter, vox_size
-                        )
+                        ),
+                    load_dose=False
                     )
 
                 x_pos = array(full_data.positions[0])
@@ -1058,21 +948,51 @@ def isodose_plot(mode='mlwa'):
 
                 Nx, Ny, Nz = full_data.shape
 
-                full_data.dose *= get_conversion_factor(
+                # applied to the planes and volumes read below
+                full_data *= get_conversion_factor(
                     air_kerma_true, 
                     air_kerma_per_hist,
                     max_dwell_time
 
                 )  # scale to maximum individual dwell time
 
-                full_data.dose /= 5  # normalize to desired dose of 5 Gy
-                full_data.dose *= 100  # express in percent. Should see 100% at x=-2cm
+                full_data /= 5  # normalize to desired dose of 5 Gy
+                full_data *= 100  # express in percent. Should see 100% at x=-2cm
+
+                if preview_pixels is None:
+                    xy_data = xz_data = full_data
+                else:
+                    # block averaged levels of the pyramid stored next to
+                    # the dose file (built on the first run)
+                    xy_data = full_data.preview(preview_pixels, axis=2)
+                    xz_data = full_data.preview(preview_pixels, axis=1)
+
+                xy_mid = [(p[:-1] + p[1:]) / 2.0 for p in xy_data.positions]
+                xz_mid = [(p[:-1] + p[1:]) / 2.0 for p in xz_data.positions]
+
+                xy_dose = xy_data.read_plane(
+                    2, position_to_index(0.0, xy_mid[2])
+                    )
+                xz_dose = xz_data.read_plane(
+                    1, position_to_index(0.0, xz_mid[1])
+                    )
+
+                # volumes inside the plotted isodose levels (cached next to
+                # the dose file after the first run)
+                isodose_levels = arange(10, 110, 10)
+                for level, volume in zip(
+                        isodose_levels,
+                        isodose_volumes(full_data, isodose_levels)
+                        ):
+                    print "{0} shield, V{1} = {2:.2f} cm^3".format(
+                        shield_type, level, volume
+                        )
 
                 xy_contour = ax[ax_x, ax_y].contourf(
-                    x_pos_mid, y_pos_mid, 
+                    xy_mid[0], xy_mid[1], 
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, :, position_to_index(0.0, z_pos_mid)].transpose(),
+                    xy_dose.transpose(),
                     arange(0, 110, 10),
                     # [5, 10, 20, 50, 100],
                     # cmap=get_cmap('gnuplot')
@@ -1083,10 +1003,10 @@ def isodose_plot(mode='mlwa'):
                     )
 
                 xz_contour = ax2[ax_x, ax_y].contourf(
-                    x_pos_mid, z_pos_mid,
+                    xz_mid[0], xz_mid[2],
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, position_to_index(0.0, y_pos_mid), :].transpose(),
+                    xz_dose.transpose(),
                     arange(0, 110, 10),
                     # [5, 10, 20, 50, 100],
                     # cmap=get_cmap('gnuplot')
@@ -1266,10 +1186,12 @@ def isodose_plot_compare():
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                full_data = DoseFile(
+                # only the two plotted planes are read
+                full_data = get_dose(
                     target_dir + target_file.format(
                         shield_type, diameter, vox_size
-                    )
+                    ),
+                    load_dose=False
                 )
 
                 x_pos = array(full_data.positions[0])
@@ -1285,21 +1207,23 @@ def isodose_plot_compare():
 
                 Nx, Ny, Nz = full_data.shape
 
-                full_data.dose *= get_conversion_factor(
+                full_data *= get_conversion_factor(
                     air_kerma_true,
                     air_kerma_per_hist,
                     max_dwell_time
 
                 )  # scale to maximum individual dwell time
 
-                full_data.dose /= 5  # normalize to desired dose of 5 Gy
-                full_data.dose *= 100  # express in percent. Should see 100% at x=-2cm
+                full_data /= 5  # normalize to desired dose of 5 Gy
+                full_data *= 100  # express in percent. Should see 100% at x=-2cm
+
+                ix, iy, iz = full_data.grid_index.voxel(0.0, 0.0, 0.0)
 
                 xy_contour = ax[ax_x, ax_y].contour(
                     x_pos_mid, y_pos_mid,
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, :, position_to_index(0.0, z_pos)].transpose(),
+                    full_data.read_plane(2, iz).transpose(),
                     [5, 10, 20, 50, 100],
                     colors=tab10(linspace(0, 1, 5))
                 )
@@ -1312,7 +1236,7 @@ def isodose_plot_compare():
                     x_pos_mid, z_pos_mid,
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, position_to_index(0.0, y_pos), :].transpose(),
+                    full_data.read_plane(1, iy).transpose(),
                     [5, 10, 20, 50, 100],
                     colors=tab10(linspace(0, 1, 5))
                 )
@@ -1440,7 +1364,7 @@ def isodose_plot_compare():
                 + vox_size + 'mm_w_ref.pdf'
             )
 
-def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
+def tg43_mbdca_comparison_isodose_plot(explicit_contour=False, dtype=float64):
     """
     Description:
     Takes any number of .3ddose files and plots a plethora of diagnostic plots 
@@ -1449,6 +1373,8 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
     Inputs:
     :name list_file: a list of file names that are to be loaded
     :type list_file: list
+    :param dtype: type of the dose arrays (float32 halves the memory)
+    :type dtype: numpy.dtype
     """
 
     pwd = getcwd()
@@ -1506,15 +1432,20 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                 sharex='all', sharey='all'
             )
 
-            tg43_full_data = DoseFile(
-                target_dir + tg43_target_file.format(vox_size, diameter)
+            # pinned while the shielded runs are compared against it, and
+            # unpinned at the end of the iteration so that the baselines of
+            # a sweep do not fill the cache
+            tg43_file = target_dir + tg43_target_file.format(vox_size, diameter)
+            tg43_full_data = get_dose(
+                tg43_file, pin=True, cache=True, dtype=dtype
             )
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                mlwa_full_data = DoseFile(
+                mlwa_full_data = get_dose(
                     target_dir
-                    + mlwa_target_file.format(shield_type, diameter, vox_size)
+                    + mlwa_target_file.format(shield_type, diameter, vox_size),
+                    cache=True, dtype=dtype
                 )
 
                 x_pos = array(tg43_full_data.positions[0])
@@ -1528,22 +1459,26 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                 ax_x = shield_index // 2
                 ax_y = shield_index % 2
 
-                tg43_dose = tg43_full_data.dose * dose_scale_factor
-                mlwa_dose = mlwa_full_data.dose * dose_scale_factor
+                tg43_dose = tg43_full_data * dose_scale_factor
+                mlwa_dose = mlwa_full_data * dose_scale_factor
 
                 # calculate percentage difference between MBDCA calculation and
-                # tg43. Turn all NaNs to 0s and all inf to largest number that
-                # is held by the double type
-                per_diff = nan_to_num(
-                    ((tg43_dose - mlwa_dose) / mlwa_dose) * 100
-                    )
+                # tg43 on the two plotted planes only. Turn all NaNs to 0s and
+                # all inf to largest number that is held by the double type
+                iz = position_to_index(0.0, z_pos_mid)
+                iy = position_to_index(0.0, y_pos_mid)
+                per_diff_xy = percent_difference(
+                    tg43_dose.read_plane(2, iz), mlwa_dose.read_plane(2, iz)
+                )
+                per_diff_xz = percent_difference(
+                    tg43_dose.read_plane(1, iy), mlwa_dose.read_plane(1, iy)
+                )
 
                 xy_contour = ax[ax_x, ax_y].contourf(
                     x_pos_mid, y_pos_mid,
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    per_diff[:, :, position_to_index(
-                        0.0, z_pos_mid)].transpose(),
+                    per_diff_xy.transpose(),
                     arange(-150, 1200+1, 150),
                     # [5, 10, 20, 50, 100],
                     cmap=get_cmap('hot')
@@ -1557,8 +1492,7 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                     x_pos_mid, z_pos_mid,
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    per_diff[:, position_to_index(
-                        0.0, y_pos_mid), :].transpose(),
+                    per_diff_xz.transpose(),
                     arange(-150, 1200+1, 150),
                     # [5, 10, 20, 50, 100],
                     cmap=get_cmap('hot')
@@ -1573,8 +1507,7 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                         x_pos_mid, y_pos_mid,
                         # matplotlib plots column by row (instead of row by column)
                         # so transpose data array to account for this
-                        per_diff[:, :, position_to_index(
-                            0.0, z_pos_mid)].transpose(),
+                        per_diff_xy.transpose(),
                         # arange(0, 110, 10),
                         [10, 20, 50, 100],
                         cmap=get_cmap('Set1')
@@ -1584,8 +1517,7 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                         x_pos_mid, z_pos_mid,
                         # matplotlib plots column by row (instead of row by column)
                         # so transpose data array to account for this
-                        per_diff[:, position_to_index(
-                            0.0, y_pos_mid), :].transpose(),
+                        per_diff_xz.transpose(),
                         # arange(0, 110, 10),
                         [10, 20, 50, 100],
                         cmap=get_cmap('Set1')
@@ -1693,8 +1625,10 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                 + vox_size + 'mm.pdf'
             )
 
+            dose_cache.unpin(tg43_file)
 
-def tg43_mbdca_comparison_histograms():
+
+def tg43_mbdca_comparison_histograms(dtype=float64):
     """
     Description:
     Takes any number of .3ddose files and plots a plethora of diagnostic plots 
@@ -1703,6 +1637,8 @@ def tg43_mbdca_comparison_histograms():
     Inputs:
     :name list_file: a list of file names that are to be loaded
     :type list_file: list
+    :param dtype: type of the dose arrays (float32 halves the memory)
+    :type dtype: numpy.dtype
     """
 
     pwd = getcwd()
@@ -1754,15 +1690,20 @@ def tg43_mbdca_comparison_histograms():
                 sharex='all', sharey='all'
             )
 
-            tg43_full_data = DoseFile(
-                target_dir + tg43_target_file.format(vox_size, diameter)
+            # pinned while the shielded runs are compared against it, and
+            # unpinned at the end of the iteration so that the baselines of
+            # a sweep do not fill the cache
+            tg43_file = target_dir + tg43_target_file.format(vox_size, diameter)
+            tg43_full_data = get_dose(
+                tg43_file, pin=True, cache=True, dtype=dtype
             )
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                mlwa_full_data = DoseFile(
+                mlwa_full_data = get_dose(
                     target_dir
-                    + mlwa_target_file.format(shield_type, diameter, vox_size)
+                    + mlwa_target_file.format(shield_type, diameter, vox_size),
+                    cache=True, dtype=dtype
                 )
 
                 x_pos = array(tg43_full_data.positions[0])
@@ -1776,7 +1717,7 @@ def tg43_mbdca_comparison_histograms():
                 mlwa_dose = mlwa_full_data.dose * dose_scale_factor
 
                 # calculate percentage difference between MBDCA calculation and tg43
-                per_diff = nan_to_num(((tg43_dose - mlwa_dose) / mlwa_dose) * 100)
+                per_diff = percent_difference(tg43_dose, mlwa_dose)
 
                 xy_contour = ax[ax_x, ax_y].hist(
                     per_diff.flatten(),
@@ -1827,6 +1768,8 @@ def tg43_mbdca_comparison_histograms():
                 + vox_size + 'mm.pdf'
             )
 
+            dose_cache.unpin(tg43_file)
+
 if __name__ == "__main__":
     program_name, arguments = argv[0], argv[1:]
 
@@ -1,79 +1,16 @@
 #!/usr/bin/env python3
 
-from gzip import open as gOpen
 from glob import glob
+from multiprocessing import cpu_count
 from os.path import expanduser, isfile, isdir
 from os import getcwd
+from sys import argv
 import numpy
 
-# define dose file object 
-# modified from github/christopherpoole/3DDose
-class DoseFile(object):
-
-    """Description: Loads 3ddose file into numpy arrays"""
-
-    def __init__(self, file_name, load_uncertainty=False):
-        self._load_3ddose(file_name, load_uncertainty)
-        self.shape = self.dose.shape
-        self.size = self.dose.size
-    
-    def _load_3ddose(self, file_name, load_uncertainty=False):
-
-        if file_name[-3:] == '.gz':  # open gzipped file
-            with gOpen(file_name, 'rb') as data_file:
-                data = data_file.read().split('\n')
-        else:
-            with open(file_name, 'rb') as data_file: # open regular 3ddose file
-                data = data_file.read().split('\n')
-        
-        cur_line = 0
-        
-        x, y, z = map(int, data[cur_line].split())
-        self.shape = (z,y,x)
-        # print self.shape
-        self.size = numpy.multiply.reduce(self.shape)
-        
-        cur_line += 1
-        
-        positions = []
-        for i in range(0,3):
-            bounds = []
-            while len(bounds) < [x, y, z][i]:
-                line_positions = map(float, data[cur_line].split())
-                bounds += line_positions
-                cur_line += 1
-            positions.append(bounds)
-        
-        # recall that dimensions are read in order x, y, z
-        positions = [positions[0], positions[1], positions[2]]
-        
-        self.positions = positions
-        
-        dose = []
-        while len(dose) < self.size:
-            line_data = map(float, data[cur_line].split())
-            dose += line_data
-            cur_line += 1
-        
-        # have dose array be in order (x, y, z)
-        self.dose = self.dose.reshape((self.shape)).transpose((2,1,0))
-        
-        if load_uncertainty:
-            uncertainty = []
-            while len(uncertainty) < self.size:
-                line_data = map(float, data[cur_line].split())
-                uncertainty += line_data
-                cur_line += 1
-            self.uncertainty = numpy.array(uncertainty)  
-            assert len(self.uncertainty) == self.size, \
-            "len of uncertainty = {} (expected {})".format(len(self.uncertainty), self.size)
-            # have uncertainty array be in order (x, y, z)
-            self.uncertainty = self.uncertainty.reshape((self.shape)).transpose((2,1,0))
-            assert self.uncertainty.size == self.size, \
-            "uncertainty array size does not match that specified."
-
-        # reset the shape of array to have the proper (x,y,z) ordering
-        self.shape = (x, y, z)
+from dose_basis import get_basis
+from dose_columns import write_columns
+from dwell_optimizer import read_weights
+from superposition import superpose
 
 def checks(weights, len_weight, len_dose_files):
 
@@ -164,11 +101,22 @@ def checks(weights, len_weight, len_dose_files):
 
     return weights, type_of_weights
 
-def construct_dose(weights_input, ref_dose_files_input, get_uncertainty):
+def construct_dose(weights_input, ref_dose_files_input, get_uncertainty,
+        dtype=numpy.float64, nz=8, processes=1, report=False,
+        basis_dir=None, points=None, normalize=True):
 
     """\
     Description: Construct a dose profile from the reference dose files using \
-    linear superposition where the given weights are specified by the user. 
+    linear superposition where the given weights are specified by the user. \
+    The weights are divided by their maximum unless normalize is False, as \
+    for the absolute weights of dwell_optimizer. The reference files are streamed slab by slab into preallocated dose and \
+    squared uncertainty accumulators (see superposition.superpose), so only \
+    one grid's worth of accumulators and a slab are held in memory. With \
+    basis_dir the superposition is instead one matrix-vector product on the \
+    float32 dose basis of the reference files (see dose_basis), which is \
+    built there the first time. With points as well, only the dose at the \
+    points is computed, from the reference doses interpolated at them \
+    once per set of points (see dose_basis.PointBasis).
 
     Inputs:
     :param weights: weights with which the reference dose files are to be added.
@@ -177,13 +125,33 @@ def construct_dose(weights_input, ref_dose_files_input, get_uncertainty):
     :type dose_files: list of strings
     :param get_uncertainty: output uncertainty or not
     :type dose_files: bool
+    :param dtype: type of the dose accumulator and results (numpy.float32 \
+    halves the memory of the dose; the uncertainty is summed in float64)
+    :type dtype: numpy.dtype
+    :param nz: z planes read from a reference file at a time
+    :type nz: int
+    :param processes: number of worker processes parsing the reference files \
+    in parallel (None for all cores)
+    :type processes: int
+    :param report: print the time taken by each reference file
+    :type report: bool
+    :param basis_dir: directory of the dose basis of the reference files
+    :type basis_dir: str
+    :param points: (P, 3) x, y and z coordinates in cm at which to evaluate \
+    the dose instead of the whole grid (needs basis_dir)
+    :type points: numpy.ndarray
+    :param normalize: divide the weights by their maximum
+    :type normalize: bool
 
     Output: 
     :param dose_array: the dose array created by the weighted superposition of \
     the reference dose array
     :type dose_array: numpy.ndarray
-    :param resultant_uncertainty: the absolute uncertainty of the dose array
-    :type resultant_uncertainty: numpy.ndarray\
+    :param resultant_uncertainty: the absolute uncertainty of the dose array \
+    (None if get_uncertainty is False)
+    :type resultant_uncertainty: numpy.ndarray
+    :param position_tuple: x, y and z voxel centres, or the points if given
+    :type position_tuple: tuple\
     """
 
     weights_unscaled, type_of_weights = checks(
@@ -192,25 +160,39 @@ def construct_dose(weights_input, ref_dose_files_input, get_uncertainty):
 
     max_weight = max(weights_input)
 
-    if type_of_weights is numpy.ndarray:
+    if not normalize:
+        weights = weights_unscaled
+    elif max_weight <= 0:
+        print("WARNING: The largest weight is {0}, so the weights cannot be \
+        normalised. Using them as given.".format(max_weight))
+        weights = weights_unscaled
+    elif type_of_weights is numpy.ndarray:
         weights = weights_unscaled / max_weight
     elif type_of_weights is list:
         weights = [weight / max_weight for weight in weights_unscaled]
 
-    for index, ref_file in enumerate(ref_dose_files_input):
-        data = DoseFile(ref_file, load_uncertainty=get_uncertainty)
-        if index == 0:
-            resultant_dose = resultant_uncertainty = numpy.zeros(data.shape)
-        
-        resultant_dose += weights[index] * data.dose
-        if get_uncertainty:
-            resultant_uncertainty += (
-                weights[index] * data.uncertainty * data.dose
-                ) ** 2
+    if points is not None:
+        assert basis_dir is not None, "point doses need a dose basis"
+        point_basis = get_basis(
+            ref_dose_files_input, basis_dir, nz
+            ).point_basis(points)
+        resultant_dose, resultant_uncertainty = point_basis.superpose(
+            weights, get_uncertainty
+            )
+        return resultant_dose, resultant_uncertainty, point_basis.points
 
-    resultant_uncertainty = numpy.sqrt(resultant_uncertainty)
+    if basis_dir is not None:
+        basis = get_basis(ref_dose_files_input, basis_dir, nz)
+        resultant_dose, resultant_uncertainty, bounds = basis.superpose(
+            weights, get_uncertainty
+            )
+    else:
+        resultant_dose, resultant_uncertainty, bounds = superpose(
+            ref_dose_files_input, weights, get_uncertainty, dtype, nz,
+            processes, report
+            )
 
-    x_pos, y_pos, z_pos, = numpy.array(data.positions)
+    x_pos, y_pos, z_pos, = bounds
     x_pos_mid = (x_pos[:-1] + x_pos[1:]) / 2
     y_pos_mid = (y_pos[:-1] + y_pos[1:]) / 2
     z_pos_mid = (z_pos[:-1] + z_pos[1:]) / 2
@@ -219,19 +201,38 @@ def construct_dose(weights_input, ref_dose_files_input, get_uncertainty):
 
     return resultant_dose, resultant_uncertainty, position_tuple
         
-def main():
+def main(args):
 
     """\
-    Description: Run superposition calculation.
+    Description: Run superposition calculation. Usage:
+
+        python construct_dose.py [--processes=N] [--basis]
+
+    By default the reference files are parsed in N worker processes (all \
+    cores by default) and streamed into float64 accumulators, reporting the \
+    time taken by each. With --basis the dose is instead superposed from \
+    the float32 dose basis in the basis directory of the applicator (built \
+    the first time), which is faster for repeated runs but keeps about 7 \
+    significant digits. Doses at a set of points always use the basis.
 
     Outputs:
     :param gfile: Output dat file containing the resultant dose from doing \
     weighted superposition of the reference dose files. Has 5 columns containing, \
     in order, the x-coordinate, the y-coordinate, the z-coordinate, the dose at coordinate, \
-    and error of dose at coordinate.
-    :type gfile: gzipped data file\
+    and error of dose at coordinate (see dose_columns.write_columns; \
+    dose_columns.write_binary_columns writes the same table in binary).
+    :type gfile: gzipped data file
+    :param pfile: With a points file, resultant_points.dat instead, with the \
+    coordinates, dose and error of dose at each point.
+    :type pfile: data file\
     """
 
+    options = dict(
+        (arg[2:].split('=', 1) + [None])[:2]
+        for arg in args if arg.startswith('--')
+        )
+    processes = int(options.get('processes') or cpu_count())
+
     cwd = getcwd()
 
     print("Please input the size of the Nucletron applicator you wish to work with.")
@@ -248,7 +249,9 @@ def main():
         print("Please ensure that the reference directory is in the same directory as this script.")
         exit(1)
     
-    ref_dose_files = [ref_file for ref_file in glob(target_dir + '/*.3ddose.gz')]
+    # in name order, the order of the weights
+    ref_dose_files = sorted(glob(target_dir + '/*.3ddose.gz'))
+    normalize = True
     print("Do you want to use the default weights [y/n]?")
     while True:
         answer = input(">> ")
@@ -262,38 +265,62 @@ def main():
         elif answer.lower() in ('n', 'no'):
             print(
                 "Please input weights for the reference dose files separated by \
-                whitespace. You need to input "
+                whitespace, or the path of a weight file (e.g. written by \
+                dwell_optimizer). You need to input "
                 + "in {0} weights".format(len(ref_dose_files))
             )
             user_input = input(">> ")
             if isfile(expanduser(user_input)):
-                weights_input = numpy.loadtxt(expanduser(user_input))
+                # the weights of dwell_optimizer give the prescribed dose
+                # as they are
+                weights_input, absolute = read_weights(expanduser(user_input))
+                normalize = not absolute
             else:
                 weights_input = list(map(float, user_input.split()))
             break
         else:
-            print "Input not understood."
+            print("Input not understood.")
+
+    print(
+        "Please input the path of a file of points (x y z in cm, one point \
+        per line) to get the dose at those points only, or press enter for \
+        the whole grid."
+        )
+    points_input = input(">> ").strip()
+    if points_input:
+        points = numpy.loadtxt(expanduser(points_input), ndmin=2)
+        dose, uncertainty, points = construct_dose(
+            weights_input, ref_dose_files, get_uncertainty=True,
+            basis_dir=target_dir + '/basis', points=points,
+            normalize=normalize
+            )
+        numpy.savetxt(
+            'resultant_points.dat',
+            numpy.column_stack((points, dose, uncertainty)),
+            fmt='%.8e', delimiter='\t'
+            )
+        for point, point_dose, point_uncertainty in zip(
+                points, dose, uncertainty):
+            print("{0}: {1:.6e} +/- {2:.2e}".format(
+                tuple(point), point_dose, point_uncertainty
+                ))
+        return 0
 
     # construct the dose from weighted superposition of the reference dose files
     dose, uncertainty, positions = construct_dose(
-        weights_input, ref_dose_files, get_uncertainty=True
+        weights_input, ref_dose_files, get_uncertainty=True,
+        processes=processes, report=True,
+        basis_dir=target_dir + '/basis' if 'basis' in options else None,
+        normalize=normalize
         )
 
     # write into file
-    with gOpen('resultant_file.dat', 'w') as gfile:
-        for x_index, x in positions[0]:
-            for y_index, y in positions[1]:
-                for z_index, z in positions[2]:
-                    gfile.write(
-                        '{0}\t{1}\t{2}\t{3:.15f}\t{4:.15f}\n'.format(
-                            x, y, z, 
-                            dose[x_index, y_index, z_index], 
-                            uncertainty[x_index, y_index, z_index]
-                            )
-                        )   
-                
+    write_columns(
+        'resultant_file.dat', dose, uncertainty, positions, compress=True
+        )
+
     return 0
 
 if  __name__ == "__main__":
-    main()
+    main(argv[1:])
 
@@ -9,14 +9,28 @@ from sys import argv, exit
 from os import getcwd
 
 from numpy import linspace, zeros_like, histogram, arange 
-from py3ddose import DoseFile
+from dose_cache import get_dose
+from dose_summary import load_summary
 
 from matplotlib import cm
 from matplotlib.style import use
 use('seaborn')
 from matplotlib.pyplot import subplots
 
-def generate_tdvh_mlwa():
+def generate_tdvh_mlwa(from_summary=False):
+    """
+    Description:
+    Plots the differential and cumulative dose volume histograms of the
+    MBDCA runs for each voxel size.
+
+    Inputs:
+    :param from_summary: read the coarse histograms from the dose summary
+                         sidecars (see dose_summary.load_summary) instead of
+                         streaming every dose file, for quick renders of
+                         many runs; they are off by up to about 1 % of the
+                         volume
+    :type from_summary: bool
+    """
 
     pwd = getcwd()
 
@@ -76,21 +90,27 @@ def generate_tdvh_mlwa():
 
     for index in xrange(3):
 
-        main_data = DoseFile(file_list[index])
-        # data_base_flat = main_base_data.dose.flatten() * 2.2861e14 # converts to Gy; norm to treatment time
-        data_flat = main_data.dose.flatten() # converts to Gy; norm to individual max dwell time
-        
-        n, bins, __ = ax[index].hist(
-            data_flat,
-            bins=500,
+        # converts to Gy; norm to treatment time: scale=2.2861e14
+        if from_summary:
+            n, n_cum_base, bins = load_summary(
+                file_list[index]
+                ).dose_volume_histogram(bins=500)
+        else:
+            # the exact histogram of the dose, streamed in z-slabs
+            main_data = get_dose(file_list[index], load_dose=False)
+            n, n_cum_base, bins = main_data.dose_volume_histogram(
+                bins=500, nz=10
+                )
+
+        ax[index].hist(
+            bins[:-1],
+            bins=bins,
             # color=color_list[index],
             # label=label_list[index],
-            weights=zeros_like(data_flat) + 1. / data_flat.size * 100,
+            weights=n,
             alpha=0.4
             )
 
-        n_cum_base = n[::-1].cumsum()[::-1]
-
         ax2[index].loglog(
             bins[:-1], n_cum_base,
             # color=color_list[index],
@@ -159,7 +179,20 @@ def generate_tdvh_mlwa():
     fig2.savefig(pwd + '/cumulative_dose_volume_histogram_suxer.pdf')
 
 
-def generate_tdvh_tg43():
+def generate_tdvh_tg43(from_summary=False):
+    """
+    Description:
+    Plots the differential and cumulative dose volume histograms of the
+    TG43 runs for each applicator and voxel size.
+
+    Inputs:
+    :param from_summary: read the coarse histograms from the dose summary
+                         sidecars (see dose_summary.load_summary) instead of
+                         streaming every dose file, for quick renders of
+                         many runs; they are off by up to about 1 % of the
+                         volume
+    :type from_summary: bool
+    """
 
     pwd = getcwd()
 
@@ -216,23 +249,29 @@ def generate_tdvh_tg43():
     for index1 in xrange(2):
         for index2 in xrange(3):
 
-            main_data = DoseFile(file_dict[(index1, index2)])
-            # converts to Gy; norm to treatment time
-            # data_base_flat = main_base_data.dose.flatten() * 2.2861e14 
+            # converts to Gy; norm to treatment time: scale=2.2861e14
             # converts to Gy; norm to individual max dwell time
-            # data_flat = main_data.dose.flatten() * 8.2573429808917e13
+            if from_summary:
+                n, n_cum_base, bins = load_summary(
+                    file_dict[(index1, index2)]
+                ).dose_volume_histogram(bins=500, scale=8.2573429808917e13)
+            else:
+                main_data = get_dose(
+                    file_dict[(index1, index2)], load_dose=False
+                )
+                n, n_cum_base, bins = main_data.dose_volume_histogram(
+                    bins=500, scale=8.2573429808917e13, nz=10
+                )
 
-            n, bins, __ = ax[index1].hist(
-                data_flat,
-                bins=500,
+            ax[index1].hist(
+                bins[:-1],
+                bins=bins,
                 color=color_list[index1],
                 label=label_list[index1],
-                weights=zeros_like(data_flat) + 1. / data_flat.size * 100,
+                weights=n,
                 alpha=0.4
             )
 
-            n_cum_base = n[::-1].cumsum()[::-1]
-
             ax2[index1].loglog(
                 bins[:-1], n_cum_base,
                 color=color_list[index1],
@@ -362,7 +401,7 @@ def dose_position_plots():
 
         for index2 in xrange(3):  # iterate through shield types
 
-            full_data = DoseFile(
+            full_data = get_dose(
                 file_list[index2].format(vox_size_list[fig_index])
             )
 
@@ -466,10 +505,10 @@ def rel_dose_position_plot():
     )
     ax_twin = ax.twinx()
 
-    # unshielded_full_data = DoseFile(unshielded_file)
-    shield_90_data = DoseFile(shielded_file_90)
-    shield_180_data = DoseFile(shielded_file_180)
-    shield_270_data = DoseFile(shielded_file_270)
+    # unshielded_full_data = get_dose(unshielded_file)
+    shield_90_data = get_dose(shielded_file_90)
+    shield_180_data = get_dose(shielded_file_180)
+    shield_270_data = get_dose(shielded_file_270)
 
     Nx, Ny, Nz = shield_90_data.shape
 
@@ -623,7 +662,7 @@ def isodose_plot():
             
             else:
 
-                full_data = DoseFile(
+                full_data = get_dose(
                     file_name.format(vox_size_list[fig_index]))
 
                 if file_index == 0:
@@ -640,8 +679,8 @@ def isodose_plot():
                 # full_data.dose *= 2.2861e14 # scale to total treatment time
                 # full_data.dose *= 8.2573429808917e13  # scale to maximum individual dwell time
 
-                full_data.dose /= 5  # normalize to desired dose of 5 Gy
-                full_data.dose *= 100  # express in percent. Should see 100% at x=-2cm
+                full_data /= 5  # normalize to desired dose of 5 Gy
+                full_data *= 100  # express in percent. Should see 100% at x=-2cm
 
                 x_min, x_max = full_data.x_extent
                 y_min, y_max = full_data.y_extent
@@ -649,14 +688,14 @@ def isodose_plot():
 
                 xy_contour = ax[ax_x, ax_y].contourf(
                     linspace(x_min, x_max, Nx), linspace(y_min, y_max, Ny),
-                    full_data.dose[Nz // 2, :, :],
+                    full_data.read_plane(0, Nz // 2),
                     arange(0, 110, 10),
                     cmap=cm.Purples
                 )
 
                 xz_contour = ax2[ax_x, ax_y].contourf(
                     linspace(x_min, x_max, Nx), linspace(z_min, z_max, Nz),
-                    full_data.dose[:, Ny // 2, :],
+                    full_data.read_plane(1, Ny // 2),
                     arange(0, 110, 10),
                     cmap=cm.Purples
                 )
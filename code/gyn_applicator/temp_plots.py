@@ -9,11 +9,12 @@ from sys import argv, exit
 from os import getcwd
 
 from numpy import (
-    linspace, histogram, arange, meshgrid, array, empty, around, sqrt, zeros,
+    linspace, histogram, arange, array, empty, around, sqrt,
     nan_to_num
     )
-from scipy.interpolate import RegularGridInterpolator as RGI
-from py3ddose import DoseFile, position_to_index
+from py3ddose import position_to_index
+from dose_cache import dose_cache, get_dose
+from interpolation import interpolate_grid
 from normalize import get_conversion_factor
 
 from matplotlib.cm import get_cmap
@@ -84,14 +85,15 @@ def dose_position_plots():
 
         for index2 in xrange(len(shield_type_lst)):  # iterate through shield types
 
-            full_data = DoseFile(
+            full_data = get_dose(
                 file_list[index2].format(vox_size_txt_lst[fig_index])
             )
 
             Nx, Ny, Nz = full_data.shape
 
-            # scale to maximum individual dwell time
-            full_data.dose *= 8.2573429808917e13  
+            # scale to maximum individual dwell time (into a new array, as
+            # the cached one is shared)
+            dose_matrix = full_data.dose * 8.2573429808917e13
 
             x_min, x_max = full_data.x_extent
             y_min, y_max = full_data.y_extent
@@ -102,21 +104,21 @@ def dose_position_plots():
                 if index1 == 0:
                     ax[index1, index2].plot(
                         linspace(x_min, x_max, Nx), 
-                        full_data.dose[:, Ny // 2, Nz // 2],
+                        dose_matrix[:, Ny // 2, Nz // 2],
                         # yerr=full_data.uncertainty[Nz // 2, Ny // 2, :],
                         lw=3.0
                     )
                 elif index1 == 1:
                     ax[index1, index2].plot(
                         linspace(y_min, y_max, Ny), 
-                        full_data.dose[Nx // 2, :, Nz // 2],
+                        dose_matrix[Nx // 2, :, Nz // 2],
                         # yerr=full_data.uncertainty[Nz // 2, :, Nx // 2],
                         lw=3.0
                     )
                 else:
                     ax[index1, index2].plot(
                         linspace(z_min, z_max, Nz), 
-                        full_data.dose[Nx // 2, Ny // 2, :],
+                        dose_matrix[Nx // 2, Ny // 2, :],
                         # yerr=full_data.uncertainty[:, Ny // 2, Nx // 2],
                         lw=3.0
                     )
@@ -242,7 +244,7 @@ def dose_inv_position_plots(interpolate=False):
 
                     ax = [ax1, ax2, ax3]
 
-                    full_data = DoseFile(
+                    full_data = get_dose(
                         target_dir 
                         + '/mlwa_30mmOut_'
                         +'{0}shield_{1}mm'.format(shield_type, vox_size)
@@ -250,8 +252,9 @@ def dose_inv_position_plots(interpolate=False):
                         load_uncertainty=True
                     )
 
-                    # scale to maximum individual dwell time
-                    full_data.dose *= get_conversion_factor(
+                    # scale to maximum individual dwell time (lazily, the
+                    # cached dose array is shared)
+                    full_data *= get_conversion_factor(
                         air_kerma_str, air_kerma_per_hist, max_dwell_time
                     )
 
@@ -265,24 +268,12 @@ def dose_inv_position_plots(interpolate=False):
 
                     if interpolate:
 
-                        interpolated_dose = RGI(
-                            (x_pos_mid, y_pos_mid, z_pos_mid), 
-                            full_data.dose, 
-                            bounds_error=False, 
-                            fill_value=None
+                        # dose at the voxel bounds, extrapolated linearly
+                        # beyond the outermost voxel centres
+                        dose_matrix = interpolate_grid(
+                            full_data, x_pos, y_pos, z_pos, fill_value=None
                         )
 
-                        points = meshgrid(x_pos, y_pos, z_pos)
-                        flat = array([m.flatten() for m in points])
-
-                        # something happens during the reshape that messes up the
-                        # (x, y, z) ordering not quite sure why.
-                        # Need the transpose in order to get proper (x, y, z)
-                        # ordering
-                        dose_matrix = interpolated_dose(
-                            flat.transpose()
-                        ).reshape(*points[0].shape).transpose((1, 0, 2))
-
                         z_depths = (dose_matrix[
                                 position_to_index(x_pos_desired, x_pos),
                                 position_to_index(y_pos_desired, y_pos),
@@ -322,9 +313,10 @@ def dose_inv_position_plots(interpolate=False):
 
                     else: 
 
-                        dose_matrix = full_data.dose
-                        err_matrix = full_data.uncertainty
-                        err_matrix_scaled = full_data.uncertainty * dose_matrix
+                        dose_matrix, err_matrix = full_data.evaluate(
+                            load_uncertainty=True
+                        )
+                        err_matrix_scaled = err_matrix * dose_matrix
 
                         z_depths = (dose_matrix[
                             position_to_index(x_pos_desired,x_pos),
@@ -496,10 +488,10 @@ def rel_dose_position_plot(interpolate=False):
                 )
             ax_twin = ax.twinx()
 
-            unshielded_full_data = DoseFile(unshielded_file,load_uncertainty=True)
-            shield_90_data = DoseFile(shielded_file_90,load_uncertainty=True)
-            shield_180_data = DoseFile(shielded_file_180,load_uncertainty=True)
-            shield_270_data = DoseFile(shielded_file_270,load_uncertainty=True)
+            unshielded_full_data = get_dose(unshielded_file,load_uncertainty=True)
+            shield_90_data = get_dose(shielded_file_90,load_uncertainty=True)
+            shield_180_data = get_dose(shielded_file_180,load_uncertainty=True)
+            shield_270_data = get_dose(shielded_file_270,load_uncertainty=True)
 
             x_min, x_max = unshielded_full_data.x_extent
             z_min, z_max = unshielded_full_data.z_extent
@@ -513,59 +505,43 @@ def rel_dose_position_plot(interpolate=False):
             z_pos_mid = (z_pos[1:] + z_pos[:-1]) / 2.0
 
             if interpolate:
-                unshielded_interpolated_dose = RGI(
-                    (x_pos_mid, y_pos_mid, z_pos_mid),
-                    unshielded_full_data.dose,
-                    bounds_error=False,
+                # doses at the voxel bounds, extrapolated linearly beyond the
+                # outermost voxel centres, with their uncertainties propagated
+                # through the interpolation
+                unshielded_interpolated_dose_matrix, unshielded_error = \
+                interpolate_grid(
+                    unshielded_full_data, x_pos, y_pos, z_pos, uncertainty=True,
                     fill_value=None
                 )
-                shield_90_interpolated_dose = RGI(
-                    (x_pos_mid, y_pos_mid, z_pos_mid),
-                    shield_90_data.dose,
-                    bounds_error=False,
+                shield_90_interpolated_dose_matrix, error_90 = interpolate_grid(
+                    shield_90_data, x_pos, y_pos, z_pos, uncertainty=True,
                     fill_value=None
                 )
-                shield_180_interpolated_dose = RGI(
-                    (x_pos_mid, y_pos_mid, z_pos_mid),
-                    shield_180_data.dose,
-                    bounds_error=False,
+                shield_180_interpolated_dose_matrix, error_180 = interpolate_grid(
+                    shield_180_data, x_pos, y_pos, z_pos, uncertainty=True,
                     fill_value=None
                 )
-                shield_270_interpolated_dose = RGI(
-                    (x_pos_mid, y_pos_mid, z_pos_mid),
-                    shield_270_data.dose,
-                    bounds_error=False,
+                shield_270_interpolated_dose_matrix, error_270 = interpolate_grid(
+                    shield_270_data, x_pos, y_pos, z_pos, uncertainty=True,
                     fill_value=None
                 )
 
-                points = meshgrid(x_pos, y_pos, z_pos)
-                flat = array([m.flatten() for m in points])
+                # relative to the unshielded dose, as below: the relative
+                # uncertainties of both runs add in quadrature
+                error_90 = sqrt(error_90 ** 2 + unshielded_error ** 2)
+                error_180 = sqrt(error_180 ** 2 + unshielded_error ** 2)
+                error_270 = sqrt(error_270 ** 2 + unshielded_error ** 2)
 
-                unshielded_interpolated_dose_matrix = \
-                unshielded_interpolated_dose(
-                    flat.transpose()
-                ).reshape(*points[0].shape).transpose((1, 0, 2))
-                
-                shield_90_interpolated_dose_matrix = \
-                shield_90_interpolated_dose(
-                    flat.transpose()
-                ).reshape(*points[0].shape).transpose((1, 0, 2))
-                
-                shield_180_interpolated_dose_matrix = \
-                shield_180_interpolated_dose(
-                    flat.transpose()
-                ).reshape(*points[0].shape).transpose((1, 0, 2))
-                
-                shield_270_interpolated_dose_matrix = \
-                shield_270_interpolated_dose(
-                    flat.transpose()
-                ).reshape(*points[0].shape).transpose((1, 0, 2))
+                shield_90_interpolated_dose_matrix /= \
+                    unshielded_interpolated_dose_matrix
+                shield_180_interpolated_dose_matrix /= \
+                    unshielded_interpolated_dose_matrix
+                shield_270_interpolated_dose_matrix /= \
+                    unshielded_interpolated_dose_matrix
 
-                # Don't know how to do the errors for the interpolation so for now
-                # set them to zero
-                error_90 = zeros(shield_90_interpolated_dose_matrix.shape)
-                error_180 = zeros(shield_180_interpolated_dose_matrix.shape)
-                error_270 = zeros(shield_270_interpolated_dose_matrix.shape)
+                error_90 *= abs(shield_90_interpolated_dose_matrix)
+                error_180 *= abs(shield_180_interpolated_dose_matrix)
+                error_270 *= abs(shield_270_interpolated_dose_matrix)
 
             else:
 
@@ -582,18 +558,18 @@ def rel_dose_position_plot(interpolate=False):
                     + (unshielded_full_data.uncertainty) ** 2
                 ) 
 
+                # out of place: the cached dose arrays are shared
                 unshielded_interpolated_dose_matrix = unshielded_full_data.dose
-                shield_90_interpolated_dose_matrix = shield_90_data.dose
-                shield_180_interpolated_dose_matrix = shield_180_data.dose
-                shield_270_interpolated_dose_matrix = shield_270_data.dose
-
-                shield_90_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
-                shield_180_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
-                shield_270_interpolated_dose_matrix /= unshielded_interpolated_dose_matrix
+                shield_90_interpolated_dose_matrix = \
+                    shield_90_data.dose / unshielded_interpolated_dose_matrix
+                shield_180_interpolated_dose_matrix = \
+                    shield_180_data.dose / unshielded_interpolated_dose_matrix
+                shield_270_interpolated_dose_matrix = \
+                    shield_270_data.dose / unshielded_interpolated_dose_matrix
 
-                error_90 *= shield_90_data.dose.__abs__()
-                error_180 *= shield_180_data.dose.__abs__()
-                error_270 *= shield_270_data.dose.__abs__()
+                error_90 *= abs(shield_90_interpolated_dose_matrix)
+                error_180 *= abs(shield_180_interpolated_dose_matrix)
+                error_270 *= abs(shield_270_interpolated_dose_matrix)
 
             ax.errorbar(
                 x_pos_mid[::stride],
@@ -838,7 +814,7 @@ def isodose_plot(mode='mlwa'):
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                full_data = DoseFile(
+                full_data = get_dose(
                     target_dir + target_file.format(
                         shield_type, diameter, vox_size
                         )
@@ -858,21 +834,25 @@ def isodose_plot(mode='mlwa'):
 
                 Nx, Ny, Nz = full_data.shape
 
-                full_data.dose *= get_conversion_factor(
+                # the scaling is lazy (applied as the planes are read), as the
+                # cached dose array is shared
+                full_data *= get_conversion_factor(
                     air_kerma_true, 
                     air_kerma_per_hist,
                     max_dwell_time
 
                 )  # scale to maximum individual dwell time
 
-                full_data.dose /= 5  # normalize to desired dose of 5 Gy
-                full_data.dose *= 100  # express in percent. Should see 100% at x=-2cm
+                full_data /= 5  # normalize to desired dose of 5 Gy
+                full_data *= 100  # express in percent. Should see 100% at x=-2cm
 
                 xy_contour = ax[ax_x, ax_y].contourf(
                     x_pos_mid, y_pos_mid, 
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, :, position_to_index(0.0, z_pos_mid)].transpose(),
+                    full_data.read_plane(
+                        2, position_to_index(0.0, z_pos_mid)
+                        ).transpose(),
                     arange(0, 110, 10),
                     # [5, 10, 20, 50, 100],
                     # cmap=get_cmap('gnuplot')
@@ -895,7 +875,9 @@ def isodose_plot(mode='mlwa'):
                     x_pos_mid, z_pos_mid,
                     # matplotlib plots column by row (instead of row by column)
                     # so transpose data array to account for this
-                    full_data.dose[:, position_to_index(0.0, y_pos_mid), :].transpose(),
+                    full_data.read_plane(
+                        1, position_to_index(0.0, y_pos_mid)
+                        ).transpose(),
                     arange(0, 110, 10),
                     # [5, 10, 20, 50, 100],
                     # cmap=get_cmap('gnuplot')
@@ -1090,13 +1072,15 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                 sharex='all', sharey='all'
             )
 
-            tg43_full_data = DoseFile(
-                target_dir + tg43_target_file.format(vox_size, diameter)
-            )
+            # pinned while the shielded runs are compared against it, and
+            # unpinned at the end of the iteration so that the baselines of
+            # a sweep do not fill the cache
+            tg43_file = target_dir + tg43_target_file.format(vox_size, diameter)
+            tg43_full_data = get_dose(tg43_file, pin=True)
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                mlwa_full_data = DoseFile(
+                mlwa_full_data = get_dose(
                     target_dir 
                     + mlwa_target_file.format(shield_type, diameter, vox_size)
                 )
@@ -1285,6 +1269,8 @@ def tg43_mbdca_comparison_isodose_plot(explicit_contour=False):
                 + vox_size + 'mm_nb.pdf'
             )
 
+            dose_cache.unpin(tg43_file)
+
 
 def tg43_mbdca_comparison_histograms():
     """
@@ -1346,13 +1332,15 @@ def tg43_mbdca_comparison_histograms():
                 sharex='all', sharey='all'
             )
 
-            tg43_full_data = DoseFile(
-                target_dir + tg43_target_file.format(vox_size)
-            )
+            # pinned while the shielded runs are compared against it, and
+            # unpinned at the end of the iteration so that the baselines of
+            # a sweep do not fill the cache
+            tg43_file = target_dir + tg43_target_file.format(vox_size)
+            tg43_full_data = get_dose(tg43_file, pin=True)
 
             for shield_index, shield_type in enumerate(shield_type_lst):
 
-                mlwa_full_data = DoseFile(
+                mlwa_full_data = get_dose(
                     target_dir
                     + mlwa_target_file.format(shield_type, diameter, vox_size)
                 )
@@ -1434,6 +1422,8 @@ def tg43_mbdca_comparison_histograms():
                 + vox_size + 'mm_nb.pdf'
             )
 
+            dose_cache.unpin(tg43_file)
+
 
 if __name__ == "__main__":
     # dose_position_plots()
@@ -9,7 +9,9 @@ from sys import argv, exit
 from os import getcwd
 
 from numpy import linspace, zeros_like, histogram, arange, array
-from py3ddose import DoseFile, position_to_index
+from py3ddose import position_to_index
+from dose_cache import get_dose
+from dose_summary import load_summary
 
 from matplotlib.colors import Normalize
 from matplotlib.cm import get_cmap
@@ -22,7 +24,20 @@ from normalize import get_conversion_factor
 def calc_per_diff(A,B):
     return ((A - B) / B) * 100
 
-def generate_tdvh_tg43():
+def generate_tdvh_tg43(from_summary=False):
+    """
+    Description:
+    Plots the differential and cumulative dose volume histograms of the
+    TG43 runs for each applicator and voxel size.
+
+    Inputs:
+    :param from_summary: read the coarse histograms from the dose summary
+                         sidecars (see dose_summary.load_summary) instead of
+                         streaming every dose file, for quick renders of
+                         many runs; they are off by up to about 1 % of the
+                         volume
+    :type from_summary: bool
+    """
 
     pwd = getcwd()
 
@@ -83,21 +98,31 @@ def generate_tdvh_tg43():
                 pass
             else:
 
-                main_data = DoseFile(file_dict[(index1, index2)])
                 # converts to Gy; norm to individual max dwell time
-                data_flat = main_data.dose.flatten() * 8.2573429808917e13
-
-                n, bins, __ = ax[index1].hist(
-                    data_flat,
-                    bins=500,
+                if from_summary:
+                    n, n_cum_base, bins = load_summary(
+                        file_dict[(index1, index2)]
+                    ).dose_volume_histogram(
+                        bins=500, scale=8.2573429808917e13
+                    )
+                else:
+                    # the exact histogram of the dose, streamed in z-slabs
+                    main_data = get_dose(
+                        file_dict[(index1, index2)], load_dose=False
+                        )
+                    n, n_cum_base, bins = main_data.dose_volume_histogram(
+                        bins=500, scale=8.2573429808917e13, nz=10
+                    )
+
+                ax[index1].hist(
+                    bins[:-1],
+                    bins=bins,
                     color=color_list[index1],
                     label=shield_type_list[index1],
-                    weights=zeros_like(data_flat) + 1. / data_flat.size * 100,
+                    weights=n,
                     alpha=0.4
                 )
 
-                n_cum_base = n[::-1].cumsum()[::-1]
-
                 ax2[index1].loglog(
                     bins[:-1], n_cum_base,
                     color=color_list[index1],
@@ -204,14 +229,15 @@ def dose_position_plots():
             sharex='col'
         )
 
-        full_data = DoseFile(
+        full_data = get_dose(
             file_template.format(vox_size_list[fig_index])
         )
 
         Nx, Ny, Nz = full_data.shape
 
-        # full_data.dose *= 2.2861e14 # scale to total treatment time
-        full_data.dose *= 8.2573429808917e13  # scale to maximum individual dwell time
+        # full_data *= 2.2861e14 # scale to total treatment time
+        full_data *= 8.2573429808917e13  # scale to maximum individual dwell time
+        dose = full_data.evaluate()
 
         x_min, x_max = full_data.x_extent
         y_min, y_max = full_data.y_extent
@@ -221,19 +247,19 @@ def dose_position_plots():
 
             if index1 == 0:
                 ax[index1].plot(
-                    linspace(x_min, x_max, Nx), full_data.dose[Nz // 2, Ny // 2, :],
+                    linspace(x_min, x_max, Nx), dose[Nz // 2, Ny // 2, :],
                     # yerr=full_data.uncertainty[Nz // 2, Ny // 2, :],
                     lw=3.0
                 )
             elif index1 == 1:
                 ax[index1].plot(
-                    linspace(y_min, y_max, Ny), full_data.dose[Nz // 2, :, Nx // 2],
+                    linspace(y_min, y_max, Ny), dose[Nz // 2, :, Nx // 2],
                     # yerr=full_data.uncertainty[Nz // 2, :, Nx // 2],
                     lw=3.0
                 )
             else:
                 ax[index1].plot(
-                    linspace(z_min, z_max, Nz), full_data.dose[:, Ny // 2, Nx // 2],
+                    linspace(z_min, z_max, Nz), dose[:, Ny // 2, Nx // 2],
                     # yerr=full_data.uncertainty[:, Ny // 2, Nx // 2],
                     lw=3.0
                 )
@@ -323,16 +349,16 @@ def isodose_plot(place='work', mode='appl'):
 
     for voxel_size in vox_size_list:
 
-        full_data = DoseFile(
+        full_data = get_dose(
             target_dir + file_name_template.format(voxel_size, '30')
         )
 
-        full_data.dose *= get_conversion_factor(
+        full_data *= get_conversion_factor(
             air_kerma, air_kerma_per_hist, max_dwell_time
             )  # normalize to desired dose of 5 Gy
 
-        full_data.dose /= 5  # normalize to desired dose of 5 Gy
-        full_data.dose *= 100  # normalize to desired dose of 5 Gy
+        full_data /= 5  # normalize to desired dose of 5 Gy
+        full_data *= 100  # normalize to desired dose of 5 Gy
 
         x_min, x_max = full_data.x_extent
         y_min, y_max = full_data.y_extent
@@ -351,7 +377,7 @@ def isodose_plot(place='work', mode='appl'):
 
         xy_contour = ax.contourf(
             x_pos_mid, y_pos_mid,
-            full_data.dose[:, :, position_to_index(0.0, z_pos)].transpose(),
+            full_data.read_plane(2, position_to_index(0.0, z_pos)).transpose(),
             arange(0, 110, 10),
             # [5, 10, 20, 50, 100]
             # cmap=get_cmap('Purples')
@@ -360,7 +386,7 @@ def isodose_plot(place='work', mode='appl'):
 
         xz_contour = ax2.contourf(
             x_pos_mid, z_pos_mid,
-            full_data.dose[:, position_to_index(0.0, y_pos), :].transpose(),
+            full_data.read_plane(1, position_to_index(0.0, y_pos)).transpose(),
             arange(0, 110, 10),
             # [5, 10, 20, 50, 100]
             # cmap=get_cmap('Purples')
@@ -519,10 +545,10 @@ def isodose_plot_compare():
     
     if source is 'V2-V1Compare':
         print "Source is:", source
-        data1 = DoseFile(
+        data1 = get_dose(
             target_dir + '/tg43_microSelectronV2_2mm.phantom_wo_box.3ddose.gz'
         )
-        data2 = DoseFile(
+        data2 = get_dose(
             target_dir + '/tg43_microSelectronV1_2mm.phantom_wo_box.3ddose.gz'
         )
         comparison_matrix = calc_per_diff(
@@ -532,10 +558,10 @@ def isodose_plot_compare():
         sup_title = 'microSelectron-v1 to microSelectron-v2\n Dose Comparison'
     elif source is 'Flexi-V1Compare':
         print "Source is:", source
-        data1 = DoseFile(
+        data1 = get_dose(
             target_dir + '/tg43_Flexisource_2mm.phantom_wo_box.3ddose.gz'
         )
-        data2 = DoseFile(
+        data2 = get_dose(
             target_dir + '/tg43_microSelectronV1_2mm.phantom_wo_box.3ddose.gz'
         )
         comparison_matrix = calc_per_diff(
@@ -545,10 +571,10 @@ def isodose_plot_compare():
         sup_title = 'Flexisource to microSelectron-v1\n Dose Comparison'
     elif source is 'Flexi-V2Compare':
         print "Source is:", source
-        data1 = DoseFile(
+        data1 = get_dose(
             target_dir + '/tg43_Flexisource_2mm.phantom_wo_box.3ddose.gz'
         )
-        data2 = DoseFile(
+        data2 = get_dose(
             target_dir + '/tg43_microSelectronV2_2mm.phantom_wo_box.3ddose.gz'
         )
         comparison_matrix = calc_per_diff(
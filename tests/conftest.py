@@ -0,0 +1,82 @@
+from __future__ import division
+
+from gzip import open as gOpen
+from os.path import abspath, dirname, join
+import sys
+
+import numpy
+import pytest
+
+# the modules are scripts in these directories rather than a package
+ROOT = dirname(dirname(abspath(__file__)))
+for directory in ('global', 'gyn_applicator'):
+    sys.path.insert(0, join(ROOT, 'code', directory))
+
+# non-cubic and non-uniform: the voxel counts differ along each axis and the
+# voxels widen away from the origin, as in the egs_brachy phantoms
+BOUNDS = (
+    numpy.array([-1.5, -1.0, -0.6, -0.3, 0.0, 0.3, 0.6, 1.0, 1.5]),
+    numpy.array([-1.2, -0.5, -0.2, 0.0, 0.2, 0.5, 1.2]),
+    numpy.concatenate((
+        [-2.0, -1.4], numpy.linspace(-1.0, 1.0, 11), [1.4, 2.0]
+        )),
+    )
+
+
+def synthetic_dose(bounds=BOUNDS, seed=0, source=(0., 0., 0.)):
+    """
+    Inverse square like dose falling off from source and random relative
+    uncertainties on the grid of bounds, in (x, y, z) order.
+    """
+    x, y, z = [(b[:-1] + b[1:]) / 2 for b in bounds]
+    r2 = (
+        (x[:, None, None] - source[0]) ** 2
+        + (y[None, :, None] - source[1]) ** 2
+        + (z[None, None, :] - source[2]) ** 2
+        )
+    dose = 1e-13 / (r2 + 0.01)
+    uncertainty = numpy.random.RandomState(seed).uniform(
+        0.001, 0.2, dose.shape
+        )
+    return dose, uncertainty
+
+
+def write_text_3ddose(file_name, bounds, dose, uncertainty):
+    """
+    Writes a .3ddose file the way egs_brachy does, one line per axis of
+    bounds and one line per z plane of each block with x fastest, with
+    printf formatting so that the writer under test is not involved.
+    """
+    opener = gOpen if file_name[-3:] == '.gz' else open
+    with opener(file_name, 'wb') as out_file:
+        out_file.write(
+            '{0} {1} {2}\n'.format(*dose.shape).encode('ascii')
+            )
+        for b in bounds:
+            out_file.write(
+                (' '.join('{0:.4f}'.format(v) for v in b) + '\n').encode()
+                )
+        for block in (dose, uncertainty):
+            # x fastest within each z plane
+            planes = block.transpose((2, 1, 0)).reshape(dose.shape[2], -1)
+            numpy.savetxt(out_file, planes, fmt='%.4E')
+
+
+@pytest.fixture
+def dose_files(tmpdir):
+    """
+    Factory writing synthetic .3ddose files on BOUNDS into a temporary
+    directory; returns the file name and the (dose, uncertainty) written,
+    rounded as the file holds them.
+    """
+    def write(name, seed=0, source=(0., 0., 0.)):
+        file_name = str(tmpdir.join(name))
+        dose, uncertainty = synthetic_dose(BOUNDS, seed, source)
+        write_text_3ddose(file_name, BOUNDS, dose, uncertainty)
+        rounded = [
+            numpy.array(['%.4E' % v for v in block.ravel()], dtype=float)
+            .reshape(block.shape)
+            for block in (dose, uncertainty)
+            ]
+        return file_name, rounded[0], rounded[1]
+    return write
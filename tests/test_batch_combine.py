@@ -0,0 +1,45 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from batch_combine import BatchCombination, _combine
+
+
+@pytest.mark.parametrize('dtype', [numpy.float64, numpy.float32])
+def test_combine(dose_files, dtype):
+    batches = [
+        dose_files('batch_{0}.3ddose'.format(number), seed=number)
+        for number in range(3)
+        ]
+    histories = [1e6, 2e6, 5e5]
+    weights = numpy.array(histories) / sum(histories)
+    dose = sum(w * d for w, (__, d, __) in zip(weights, batches))
+    relative = numpy.sqrt(sum(
+        (w * r * d) ** 2 for w, (__, d, r) in zip(weights, batches)
+        )) / dose
+
+    combination = BatchCombination(
+        [batch[0] for batch in batches], histories, dtype=dtype
+        )
+    combined, combined_uncertainty = combination.evaluate(
+        load_uncertainty=True
+        )
+    tolerance = 1e-12 if dtype == numpy.float64 else 1e-6
+    assert combined.dtype == dtype
+    assert numpy.allclose(combined, dose, rtol=tolerance, atol=0)
+    assert numpy.allclose(
+        combined_uncertainty, relative, rtol=tolerance, atol=0
+        )
+
+
+def test_combine_float32_small_doses():
+    # the squared absolute uncertainties of float32 doses of 1e-21 are below
+    # the smallest float32
+    dose = numpy.full((2, 3), 1e-21, dtype=numpy.float32)
+    uncertainty = numpy.full((2, 3), 0.05, dtype=numpy.float32)
+    combined, relative = _combine(
+        [0.5, 0.5], [(dose, uncertainty), (dose, uncertainty)], True
+        )
+    assert combined.dtype == relative.dtype == numpy.float32
+    assert numpy.allclose(relative, 0.05 / numpy.sqrt(2), rtol=1e-6)
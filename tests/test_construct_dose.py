@@ -0,0 +1,45 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from construct_dose import construct_dose
+from superposition import superpose
+
+
+@pytest.fixture
+def references(dose_files):
+    return [
+        dose_files('reference_{0}.3ddose'.format(number), seed=number,
+            source=(0., 0., z))[0]
+        for number, z in enumerate(numpy.linspace(-1., 1., 3))
+        ]
+
+
+@pytest.mark.parametrize('weights', [
+    [0.5, 2.0, 1.0], numpy.array([0.5, 2.0, 1.0])
+    ])
+def test_normalized(references, weights):
+    dose, uncertainty, __ = construct_dose(weights, references, True)
+    expected, expected_uncertainty, __ = superpose(
+        references, [0.25, 1.0, 0.5]
+        )
+    assert numpy.allclose(dose, expected, rtol=1e-12, atol=0)
+    assert numpy.allclose(
+        uncertainty, expected_uncertainty, rtol=1e-12, atol=0
+        )
+
+
+def test_absolute(references):
+    # the weights of dwell_optimizer are used as they are
+    weights = numpy.array([0.5, 2.0, 1.0])
+    dose, __, __ = construct_dose(weights, references, False, normalize=False)
+    expected, __, __ = superpose(references, weights, uncertainty=False)
+    assert numpy.allclose(dose, expected, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('weights', [[0.0, 0.0, 0.0], numpy.zeros(3)])
+def test_zero_weights(references, capsys, weights):
+    dose, __, __ = construct_dose(weights, references, False)
+    assert 'WARNING' in capsys.readouterr().out
+    assert not dose.any()
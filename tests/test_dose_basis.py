@@ -0,0 +1,101 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+import dose_basis
+from dose_basis import get_basis
+from interpolation import interpolate_points
+from py3ddose import DoseFile
+from superposition import superpose
+
+
+@pytest.fixture
+def references(dose_files):
+    return [
+        dose_files('reference_{0}.3ddose'.format(number), seed=number,
+            source=(0., 0., z))[0]
+        for number, z in enumerate(numpy.linspace(-1., 1., 5))
+        ]
+
+
+def test_superpose(references, tmpdir):
+    basis = get_basis(references, str(tmpdir.join('basis')), nz=3)
+    assert len(basis) == len(references)
+    assert basis.shape == (8, 6, 14)
+
+    for weights in ([1.0, 0.5, 0.0, 2.0, 0.3], numpy.ones(5)):
+        dose, uncertainty, positions = basis.superpose(weights)
+        expected, expected_uncertainty, expected_positions = superpose(
+            references, weights
+            )
+        # the basis is float32
+        assert abs(dose - expected).max() <= 1e-6 * expected.max()
+        assert abs(uncertainty - expected_uncertainty).max() <= (
+            1e-6 * expected_uncertainty.max()
+            )
+        for p, expected_p in zip(positions, expected_positions):
+            assert numpy.array_equal(p, expected_p)
+
+
+def test_rebuilt_for_other_files(references, tmpdir):
+    basis_dir = str(tmpdir.join('basis'))
+    basis = get_basis(references, basis_dir)
+    assert get_basis(references, basis_dir) is basis
+
+    # the weights follow the order of the files
+    reordered = get_basis(references[::-1], basis_dir)
+    assert reordered.file_names == references[::-1]
+    assert numpy.allclose(
+        reordered.superpose([0, 0, 0, 0, 1])[0],
+        basis.superpose([1, 0, 0, 0, 0])[0]
+        )
+
+
+def test_point_bases_bounded(references, tmpdir, monkeypatch):
+    monkeypatch.setattr(dose_basis, 'MAX_POINT_BASES', 3)
+    basis = get_basis(references, str(tmpdir.join('basis')))
+    point_sets = [[[0.1 * n, 0., 0.]] for n in range(5)]
+
+    first, second, third = [
+        basis.point_basis(points) for points in point_sets[:3]
+        ]
+    # the first set is used again, so the second is evicted instead
+    assert basis.point_basis(point_sets[0]) is first
+    basis.point_basis(point_sets[3])
+    assert len(basis._point_bases) == 3
+    assert basis.point_basis(point_sets[0]) is first
+    assert basis.point_basis(point_sets[2]) is third
+    assert basis.point_basis(point_sets[1]) is not second
+
+
+@pytest.mark.parametrize('fill_value', [numpy.nan, None])
+def test_point_basis(references, tmpdir, fill_value):
+    # the superposed dose at the points against interpolating each
+    # reference file there, some points outside the voxel centres
+    basis = get_basis(references, str(tmpdir.join('basis')))
+    weights = numpy.linspace(0.3, 1.0, len(references))
+    points = numpy.random.RandomState(0).uniform(
+        (-1.6, -1.3, -2.1), (1.6, 1.3, 2.1), (50, 3)
+        )
+
+    dose, uncertainty = basis.point_basis(points, fill_value).superpose(
+        weights
+        )
+
+    expected = numpy.zeros(len(points))
+    variance = numpy.zeros(len(points))
+    for weight, file_name in zip(weights, references):
+        reference, relative = interpolate_points(
+            DoseFile(file_name, load_uncertainty=True), points,
+            uncertainty=True, fill_value=fill_value
+            )
+        expected += weight * reference
+        variance += (weight * reference * relative) ** 2
+    inside = ~numpy.isnan(expected)
+    assert inside.any() and (fill_value is None or not inside.all())
+    assert numpy.array_equal(numpy.isnan(dose), ~inside)
+    assert numpy.allclose(dose[inside], expected[inside], rtol=1e-6, atol=0)
+    assert numpy.allclose(
+        uncertainty[inside], numpy.sqrt(variance[inside]), rtol=1e-6, atol=0
+        )
@@ -0,0 +1,100 @@
+from __future__ import division
+
+from os import stat, utime
+
+import numpy
+import pytest
+
+from conftest import BOUNDS, write_text_3ddose
+from dose_cache import DoseCache, _dose_nbytes
+from py3ddose import DoseFile
+
+
+@pytest.fixture
+def files(dose_files):
+    return [
+        dose_files('dose_{0}.3ddose'.format(number), seed=number)[0]
+        for number in range(3)
+        ]
+
+
+def entry_bytes(file_name):
+    return _dose_nbytes(DoseFile(file_name))
+
+
+def test_hit_and_miss(files):
+    cache = DoseCache()
+    first = cache.get(files[0])
+    second = cache.get(files[0])
+    assert cache.info()['hits'] == 1 and cache.info()['misses'] == 1
+
+    # copies sharing the arrays, scaled independently
+    assert first is not second and first.dose is second.dose
+    first *= 2.
+    assert second.scale == 1.
+
+    # the entry loaded with the uncertainty serves the dose alone too
+    cache.get(files[1], load_uncertainty=True)
+    cache.get(files[1])
+    assert cache.info()['hits'] == 2 and cache.info()['entries'] == 2
+
+    # other options are other entries
+    cache.get(files[0], dtype=numpy.float32)
+    assert cache.info()['misses'] == 3
+
+
+def test_evict_least_recent(files):
+    cache = DoseCache(max_bytes=2 * entry_bytes(files[0]))
+    cache.get(files[0])
+    cache.get(files[1])
+    cache.get(files[0])
+    cache.get(files[2])
+
+    info = cache.info()
+    assert info['entries'] == 2 and info['evictions'] == 1
+    assert info['nbytes'] <= cache.max_bytes
+    # files[1] was the least recently used
+    cache.get(files[0])
+    cache.get(files[2])
+    assert cache.info()['misses'] == 3
+    cache.get(files[1])
+    assert cache.info()['misses'] == 4
+
+
+def test_pin_and_unpin(files):
+    cache = DoseCache(max_bytes=entry_bytes(files[0]))
+    cache.get(files[0], pin=True)
+    cache.get(files[1])
+    cache.get(files[2])
+    assert cache.info()['pinned'] == 1
+
+    # the pinned entry stays, the others are evicted
+    cache.get(files[0])
+    assert cache.info()['hits'] == 1
+
+    cache.unpin(files[0])
+    assert cache.info()['pinned'] == 0
+    cache.get(files[1])
+    cache.get(files[0])
+    assert cache.info()['hits'] == 1
+
+
+def test_larger_than_budget(files):
+    cache = DoseCache(max_bytes=entry_bytes(files[0]) - 1)
+    dose_file = cache.get(files[0])
+    assert dose_file.shape == (8, 6, 14)
+    assert cache.info()['entries'] == 0
+
+
+def test_reloaded_when_changed(dose_files):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    cache = DoseCache()
+    assert numpy.array_equal(cache.get(file_name).dose, dose)
+
+    # the same size, a later modification time
+    write_text_3ddose(file_name, BOUNDS, 2 * dose, uncertainty)
+    status = stat(file_name)
+    utime(file_name, (status.st_atime, status.st_mtime + 10))
+
+    assert numpy.allclose(cache.get(file_name).dose, 2 * dose, rtol=1e-4)
+    assert cache.info()['misses'] == 2 and cache.info()['entries'] == 1
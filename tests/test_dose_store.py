@@ -0,0 +1,100 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from dose_store import STORE_EXTENSION, DoseStore, store_name, write_store
+from py3ddose import DoseFile
+
+# does not divide the (8, 6, 14) grid along any axis
+CHUNK_SHAPE = (3, 4, 5)
+
+
+@pytest.fixture
+def store(dose_files, tmpdir):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    name = str(tmpdir.join('dose' + STORE_EXTENSION))
+    write_store(
+        name, DoseFile(file_name, load_uncertainty=True),
+        chunk_shape=CHUNK_SHAPE
+        )
+    return name, dose, uncertainty
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma', 'none'])
+def test_round_trip(dose_files, tmpdir, compression):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    name = str(tmpdir.join('dose' + STORE_EXTENSION))
+    # streamed from the text file
+    write_store(
+        name, DoseFile(file_name, load_dose=False), chunk_shape=CHUNK_SHAPE,
+        compression=compression
+        )
+
+    stored = DoseFile(name, load_uncertainty=True)
+    assert stored.shape == dose.shape
+    assert numpy.array_equal(stored.dose, dose)
+    assert numpy.array_equal(stored.uncertainty, uncertainty)
+    for p, q in zip(stored.positions, DoseFile(file_name).positions):
+        assert numpy.array_equal(p, q)
+
+
+@pytest.mark.parametrize('box', [
+    ((0, 8), (0, 6), (0, 14)),
+    ((2, 7), (1, 4), (3, 11)),
+    ((5, 6), (3, 4), (13, 14)),
+    ((3, 6), (4, 6), (0, 5)),
+    ((4, 4), (0, 6), (0, 14)),
+    ])
+def test_read_region(store, box):
+    name, dose, uncertainty = store
+    slices = tuple(slice(*r) for r in box)
+
+    reader = DoseStore(name)
+    assert numpy.array_equal(reader.read_region('dose', *box), dose[slices])
+    assert numpy.array_equal(
+        reader.read_region('uncertainty', *box), uncertainty[slices]
+        )
+    # again from the chunk cache
+    assert numpy.array_equal(reader.read_region('dose', *box), dose[slices])
+
+    lazy = DoseFile(name, load_dose=False)
+    lazy *= 2.
+    assert numpy.allclose(
+        lazy.read_region(*box), 2. * dose[slices], rtol=1e-15, atol=0
+        )
+
+
+def test_iter_slabs(store):
+    name, dose, uncertainty = store
+    slabs = list(DoseStore(name).iter_slabs(4, ('dose', 'uncertainty')))
+    assert [slab[0] for slab in slabs] == [0, 4, 8, 12]
+    assert numpy.array_equal(
+        numpy.concatenate([slab[1] for slab in slabs], axis=2), dose
+        )
+    assert numpy.array_equal(
+        numpy.concatenate([slab[2] for slab in slabs], axis=2), uncertainty
+        )
+
+
+def test_float32(dose_files, tmpdir):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    name = str(tmpdir.join('dose' + STORE_EXTENSION))
+    write_store(
+        name, DoseFile(file_name), uncertainty=False, chunk_shape=CHUNK_SHAPE,
+        dtype=numpy.float32
+        )
+
+    reader = DoseStore(name)
+    assert reader.blocks == ['dose']
+    assert reader.dtype == numpy.float32
+    # the 4 significant digits of the text file are kept
+    assert numpy.allclose(
+        reader.read_region(), dose, rtol=1e-7, atol=0
+        )
+
+
+def test_store_name():
+    assert store_name('run/dose.3ddose.gz') == 'run/dose' + STORE_EXTENSION
+    assert store_name('run/dose.3ddose', 'stores') == \
+        'stores/dose' + STORE_EXTENSION
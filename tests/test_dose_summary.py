@@ -0,0 +1,71 @@
+from __future__ import division
+
+from os.path import exists
+
+import numpy
+
+from dose_cache import get_dose
+from dose_summary import _summary_path, load_summary
+from py3ddose import DoseFile, dose_to_volume
+
+
+def test_summary_only_on_request(dose_files):
+    file_name, dose, __ = dose_files('dose.3ddose')
+
+    # parsing alone does not store a summary
+    DoseFile(file_name, load_uncertainty=True)
+    assert not exists(_summary_path(file_name))
+
+    summary = DoseFile(file_name, load_dose=False).summary()
+    assert exists(_summary_path(file_name))
+    assert summary.shape == dose.shape
+    assert numpy.isclose(summary.max, dose.max(), rtol=1e-12, atol=0)
+    assert numpy.isclose(summary.mean, dose.mean(), rtol=1e-12, atol=0)
+
+    stored = load_summary(file_name)
+    assert numpy.array_equal(stored.counts, summary.counts)
+
+
+def test_summary_queries(dose_files):
+    # interpolated from log bins each spanning 2.3 % of their dose
+    file_name, dose, __ = dose_files('dose.3ddose')
+    summary = load_summary(file_name)
+
+    for volume in (90., 50., 10.):
+        assert numpy.isclose(
+            summary.dose_at_volume(volume), dose_to_volume(dose, volume),
+            rtol=0.03, atol=0
+            )
+    counts, edges = summary.histogram(bins=20)
+    assert numpy.isclose(counts.sum(), dose.size)
+    assert numpy.array_equal(edges, numpy.linspace(dose.min(), dose.max(), 21))
+
+
+def test_summary_on_parse(dose_files, tmpdir):
+    file_name, dose, __ = dose_files('dose.3ddose')
+
+    DoseFile(file_name, summary=True)
+    assert exists(_summary_path(file_name))
+    assert numpy.isclose(
+        load_summary(file_name).max, dose.max(), rtol=1e-12, atol=0
+        )
+
+    # through the cache, into its directory
+    cache_dir = str(tmpdir.mkdir('cache'))
+    get_dose(file_name, summary=True, cache_dir=cache_dir)
+    assert exists(_summary_path(file_name, cache_dir))
+
+
+def test_dose_volume_histogram(dose_files):
+    # the coarse DVH of the summary against the exact one of the dose
+    file_name, dose, __ = dose_files('dose.3ddose')
+    volume, cumulative, edges = load_summary(
+        file_name
+        ).dose_volume_histogram(bins=20, scale=2.)
+    expected_volume, expected_cumulative, expected_edges = DoseFile(
+        file_name, load_dose=False
+        ).dose_volume_histogram(bins=20, scale=2.)
+
+    assert numpy.allclose(edges, expected_edges, rtol=1e-12, atol=0)
+    assert numpy.isclose(volume.sum(), 100.)
+    assert abs(cumulative - expected_cumulative).max() <= 1.
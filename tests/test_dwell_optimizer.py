@@ -0,0 +1,78 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from dose_basis import get_basis
+from dwell_optimizer import (
+    DoseObjective, evaluate_objectives, optimize_weights, read_weights,
+    write_weights
+    )
+
+SCALE = 1e13
+
+
+@pytest.fixture
+def basis(dose_files, tmpdir):
+    # dwell positions along the z axis
+    references = [
+        dose_files('reference_{0}.3ddose'.format(number), seed=number,
+            source=(0., 0., z))[0]
+        for number, z in enumerate(numpy.linspace(-0.8, 0.8, 5))
+        ]
+    return get_basis(references, str(tmpdir.join('basis')))
+
+
+def targets_of(basis, weights):
+    # targets 0.45 cm off the line of dwell positions, prescribed the dose
+    # of weights at them
+    points = numpy.column_stack((
+        numpy.full(12, 0.45), numpy.zeros(12), numpy.linspace(-0.9, 0.9, 12)
+        ))
+    doses = basis.voxel_doses(
+        basis.flat_index(*basis.grid_index.voxel(*points.T))
+        ).dot(weights)
+    return [
+        DoseObjective('target', dose * SCALE, points=[point])
+        for point, dose in zip(points, doses)
+        ]
+
+
+def test_recovers_weights(basis):
+    true_weights = numpy.linspace(1.0, 0.3, len(basis))
+    weights = optimize_weights(
+        basis, targets_of(basis, true_weights), SCALE, tolerance=1e-12
+        )
+    assert abs(weights - true_weights).max() <= 1e-3 * true_weights.max()
+
+
+def test_upper_limit(basis):
+    # a limit on the far side of the sources, below what the targets give
+    true_weights = numpy.linspace(1.0, 0.3, len(basis))
+    targets = targets_of(basis, true_weights)
+    box = ((-0.6, -0.3), (-0.2, 0.2), (-0.5, 0.5))
+    limit = 0.8 * evaluate_objectives(
+        basis, [DoseObjective('maximum', 0., box=box)], true_weights, SCALE
+        )[0][5]
+    organ = DoseObjective('maximum', limit, box=box, weight=1e6)
+
+    weights = optimize_weights(basis, targets + [organ], SCALE)
+    assert weights.min() >= 0.
+    assert evaluate_objectives(
+        basis, [organ], weights, SCALE
+        )[0][5] <= 1.01 * limit
+
+
+def test_weight_files(basis, tmpdir):
+    weights = numpy.array([0.25, 3.5, 0.0, 1e-3, 2.0])
+    file_name = str(tmpdir.join('weights.txt'))
+    write_weights(file_name, weights, basis.file_names)
+    read, absolute = read_weights(file_name)
+    assert absolute
+    assert numpy.array_equal(read, weights)
+
+    # weights written by hand are relative
+    numpy.savetxt(file_name, weights)
+    read, absolute = read_weights(file_name)
+    assert not absolute
+    assert numpy.array_equal(read, weights)
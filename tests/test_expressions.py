@@ -0,0 +1,47 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from py3ddose import DoseFile
+
+
+@pytest.mark.parametrize('load_dose', [True, False])
+def test_expressions(dose_files, load_dose):
+    # (a * a * k - 2 b) / b with a scaled in place, loaded and streamed,
+    # against the same arithmetic on the arrays
+    a_name, a, a_uncertainty = dose_files('a.3ddose', seed=1)
+    b_name, b, b_uncertainty = dose_files('b.3ddose', seed=2)
+
+    # (60 a) * (60 a) * 1e13: the two factors are treated as independent
+    product = (60 * a) ** 2 * 1e13
+    product_uncertainty = numpy.sqrt(2 * a_uncertainty ** 2)
+    numerator = product - 2 * b
+    numerator_uncertainty = numpy.sqrt(
+        (product_uncertainty * product) ** 2 + (b_uncertainty * 2 * b) ** 2
+        ) / abs(numerator)
+    expected = numerator / b
+    expected_uncertainty = numpy.sqrt(
+        numerator_uncertainty ** 2 + b_uncertainty ** 2
+        )
+
+    dose_a = DoseFile(a_name, load_uncertainty=load_dose, load_dose=load_dose)
+    dose_b = DoseFile(b_name, load_uncertainty=load_dose, load_dose=load_dose)
+    dose_a *= 3
+    dose_a /= 5
+    dose_a *= 100
+    expression = (dose_a * dose_a * 1e13 - dose_b * 2) / dose_b
+
+    dose, uncertainty = expression.evaluate(load_uncertainty=True)
+    assert numpy.allclose(dose, expected, rtol=1e-12, atol=0)
+    assert numpy.allclose(uncertainty, expected_uncertainty, rtol=1e-12, atol=0)
+    assert numpy.allclose(expression.read_plane(2, 3), expected[:, :, 3])
+    assert numpy.allclose(
+        expression.read_region((2, 8), None, (1, 4), uncertainty=True),
+        expected_uncertainty[2:8, :, 1:4]
+        )
+    counts, __ = expression.histogram(bins=100, nz=3)
+    expected_counts, __ = numpy.histogram(expected, bins=100)
+    # bin edges may differ in the last bit from numpy's
+    assert abs(counts - expected_counts).sum() <= 2
+    assert numpy.allclose(dose_a.read_plane(0, 2), a[2] * 60)
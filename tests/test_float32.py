@@ -0,0 +1,61 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from py3ddose import (
+    DoseFile, absolute_uncertainty, dose_to_volume, percent_difference
+    )
+
+
+def test_float32(dose_files):
+    # a float32 comparison workflow reproduces the float64 one: D90, D50 and
+    # D100 to 1e-6 relative and the percent difference to
+    # 1e-6 * (|per_diff| + 100) percentage points; float32 rounds each dose
+    # to 6e-8 relative
+    file_name, __, __ = dose_files('dose.3ddose.gz')
+    dose_scale_factor = 8.2573429808917e13
+
+    results = {}
+    for dtype in (numpy.float64, numpy.float32):
+        data = DoseFile(file_name, load_uncertainty=True, dtype=dtype)
+        tg43_dose = data.dose * dose_scale_factor
+        mlwa_dose = tg43_dose * (1 + 10 * data.uncertainty)
+        results[dtype] = (
+            percent_difference(tg43_dose, mlwa_dose),
+            [dose_to_volume(mlwa_dose, v) for v in (90, 50, 100)]
+            )
+
+    per_diff_64, d_values_64 = results[numpy.float64]
+    per_diff_32, d_values_32 = results[numpy.float32]
+    assert per_diff_32.dtype == numpy.float32
+    assert (
+        abs(per_diff_32 - per_diff_64) / (abs(per_diff_64) + 100)
+        ).max() <= 1e-6
+    for d_64, d_32 in zip(d_values_64, d_values_32):
+        assert abs(d_32 / d_64 - 1) <= 1e-6
+
+
+@pytest.mark.parametrize('load_dose', [True, False])
+def test_float32_arrays(dose_files, load_dose):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    data = DoseFile(
+        file_name, load_uncertainty=load_dose, load_dose=load_dose,
+        dtype=numpy.float32
+        )
+    for slab in data.iter_slabs(5, load_uncertainty=True):
+        assert slab[1].dtype == slab[2].dtype == numpy.float32
+    assert data.read_region(uncertainty=True).dtype == numpy.float32
+    assert numpy.allclose(data.read_region(), dose, rtol=6e-8, atol=0)
+
+
+def test_helpers_dtype():
+    # float64 inputs give float32 results without float64 temporaries
+    dose = numpy.array([2., -4., 0.])
+    reference = numpy.array([1., -2., 0.])
+    per_diff = percent_difference(dose, reference, dtype=numpy.float32)
+    assert per_diff.dtype == numpy.float32
+    assert numpy.array_equal(per_diff, [100., 100., 0.])
+    err = absolute_uncertainty(dose, [0.1, 0.5, 0.2], dtype=numpy.float32)
+    assert err.dtype == numpy.float32
+    assert numpy.allclose(err, [0.2, 2., 0.], rtol=1e-7, atol=0)
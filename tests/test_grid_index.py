@@ -0,0 +1,83 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from conftest import BOUNDS
+from py3ddose import AxisIndex, DoseFile, position_to_index
+
+UNIFORM = numpy.linspace(-2.5, 2.5, 51)
+
+
+def positions_on(bounds):
+    # random positions, the bounds themselves and the values just either
+    # side of them, inside the grid
+    random = numpy.random.RandomState(0)
+    return numpy.concatenate((
+        random.uniform(bounds[0], bounds[-1], 1000), bounds[:-1],
+        numpy.nextafter(bounds[1:-1], -numpy.inf),
+        numpy.nextafter(bounds[:-1], numpy.inf)
+        ))
+
+
+@pytest.mark.parametrize('bounds', [UNIFORM, BOUNDS[0], BOUNDS[2]])
+def test_matches_binary_search(bounds):
+    index = AxisIndex(bounds)
+    assert index.uniform == (bounds is UNIFORM)
+    p = positions_on(bounds)
+    expected = position_to_index(p, bounds)
+    assert numpy.array_equal(index(p), expected)
+    # scalars take another path
+    assert [index(float(v)) for v in p] == expected.tolist()
+    assert isinstance(index(float(p[0])), int)
+
+
+@pytest.mark.parametrize('bounds', [UNIFORM, BOUNDS[2]])
+def test_modes(bounds):
+    index = AxisIndex(bounds)
+    size = len(bounds) - 1
+    # the upper bound is outside the half open grid
+    p = numpy.array([bounds[0] - 1., bounds[0], bounds[-1], bounds[-1] + 1.])
+
+    def binary_search(p, mode='raise'):
+        return position_to_index(p, bounds, mode)
+
+    for lookup in (index, binary_search):
+        with pytest.raises(ValueError):
+            lookup(p)
+        with pytest.raises(ValueError):
+            lookup(float(p[-1]))
+        assert lookup(p, 'clip').tolist() == [0, 0, size - 1, size - 1]
+        assert lookup(p, 'mask').tolist() == [-1, 0, -1, -1]
+        assert lookup(float(p[0]), 'mask') == -1
+        assert lookup(float(p[-1]), 'clip') == size - 1
+        with pytest.raises(ValueError):
+            lookup(p, 'wrap')
+
+
+def test_nan():
+    index = AxisIndex(UNIFORM)
+    assert index(numpy.array([numpy.nan, 0.]), 'mask').tolist() == [-1, 25]
+
+
+def test_grid_index(dose_files):
+    file_name, __, __ = dose_files('dose.3ddose')
+    grid = DoseFile(file_name).grid_index
+    assert [axis.uniform for axis in grid.bounds] == [False, False, False]
+
+    # voxel centres are looked up in the voxels they are the centres of
+    centres = [(b[:-1] + b[1:]) / 2 for b in BOUNDS]
+    x, y, z = numpy.meshgrid(*centres, indexing='ij')
+    ix, iy, iz = grid.voxel(x.ravel(), y.ravel(), z.ravel())
+    assert numpy.array_equal(
+        numpy.ravel_multi_index((ix, iy, iz), x.shape), numpy.arange(x.size)
+        )
+    assert grid.voxel(0.1, -1.2, 1.9) == (4, 0, 13)
+
+    # the centre at or below the point
+    assert grid.centre(*[float(c[2]) for c in centres]) == (2, 2, 2)
+    assert grid.centre(0., 0., 0., 'mask') == tuple(
+        position_to_index(0., c, 'mask') for c in centres
+        )
+    with pytest.raises(ValueError):
+        grid.centre(-1.4, 0., 0.)
@@ -0,0 +1,97 @@
+from __future__ import division
+
+from gzip import open as gOpen
+
+import numpy
+import pytest
+
+from parallel_gzip import InflateStream, find_members, gzip_member
+from py3ddose import DoseFile
+
+
+@pytest.fixture
+def members_file(tmpdir):
+    # members of different sizes, one of them empty
+    random = numpy.random.RandomState(0)
+    chunks = [
+        b' '.join(b'%.4E' % v for v in random.uniform(0, 1, size))
+        for size in (1000, 1, 0, 5000, 300)
+        ]
+    file_name = str(tmpdir.join('members.gz'))
+    with open(file_name, 'wb') as out_file:
+        for chunk in chunks:
+            out_file.write(gzip_member(chunk))
+    return file_name, b''.join(chunks)
+
+
+def test_find_members(members_file):
+    file_name, __ = members_file
+    members = find_members(file_name)
+    assert len(members) == 5 and members[0][0] == 0
+    # contiguous up to the end of the file
+    for (__, stop), (start, __) in zip(members[:-1], members[1:]):
+        assert stop == start
+    with open(file_name, 'rb') as raw_file:
+        assert members[-1][1] == len(raw_file.read())
+
+
+def test_find_members_plain_gzip(tmpdir):
+    # without the size subfield the file cannot be split
+    file_name = str(tmpdir.join('plain.gz'))
+    with gOpen(file_name, 'wb') as out_file:
+        out_file.write(b'1.0000E-13 ' * 100)
+    assert find_members(file_name) is None
+
+
+@pytest.mark.parametrize('threads', [1, 2, None])
+@pytest.mark.parametrize('size', [-1, 1, 7, 4096])
+def test_inflate_stream(members_file, threads, size):
+    file_name, data = members_file
+    with gOpen(file_name, 'rb') as gzip_file:
+        assert gzip_file.read() == data
+
+    with InflateStream(file_name, threads=threads) as stream:
+        if size == -1:
+            inflated = stream.read()
+        else:
+            parts = []
+            part = stream.read(size)
+            while part:
+                assert len(part) <= size
+                parts.append(part)
+                part = stream.read(size)
+            inflated = b''.join(parts)
+    assert inflated == data
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 2 ** 20])
+def test_inflate_stream_plain_gzip(tmpdir, chunk_size):
+    file_name = str(tmpdir.join('plain.gz'))
+    data = b'1.0000E-13 ' * 1000
+    with gOpen(file_name, 'wb') as out_file:
+        out_file.write(data)
+    with InflateStream(file_name, chunk_size=chunk_size) as stream:
+        assert stream.read() == data
+
+
+def test_close_early(members_file):
+    # the reader stops before the end without hanging the producer
+    file_name, data = members_file
+    stream = InflateStream(file_name, threads=2, prefetch=1)
+    assert stream.read(10) == data[:10]
+    stream.close()
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_parse_written_members(dose_files, tmpdir, threads):
+    # the writer emits one member per slab, read back in parallel
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    out_name = str(tmpdir.join('out.3ddose.gz'))
+    DoseFile(file_name, load_uncertainty=True).write_3ddose(
+        out_name, compress=True, nz=3
+        )
+    assert len(find_members(out_name)) > 2
+
+    data = DoseFile(out_name, load_uncertainty=True, threads=threads)
+    assert numpy.array_equal(data.dose, dose)
+    assert numpy.array_equal(data.uncertainty, uncertainty)
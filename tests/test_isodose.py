@@ -0,0 +1,111 @@
+from __future__ import division
+
+from os import listdir
+
+import numpy
+import pytest
+
+import isodose
+from conftest import BOUNDS, synthetic_dose
+from isodose import (
+    _isodose_path, clear_memory, dose_levels, isodose_surfaces,
+    isodose_volumes
+    )
+from py3ddose import DoseFile
+
+
+def enclosed_volumes(dose, bounds, levels):
+    widths = [numpy.diff(b) for b in bounds]
+    volumes = (
+        widths[0][:, None, None] * widths[1][None, :, None]
+        * widths[2][None, None, :]
+        )
+    return numpy.array([volumes[dose >= level].sum() for level in levels])
+
+
+def test_dose_levels():
+    assert numpy.array_equal(dose_levels([1e-12, 2e-12]), [1e-12, 2e-12])
+    assert numpy.allclose(
+        dose_levels([50, 100, 200], reference=4.), [2., 4., 8.],
+        rtol=1e-15, atol=0
+        )
+
+
+@pytest.mark.parametrize('nz', [1, 4, 20])
+def test_volumes(dose_files, nz):
+    # unsorted levels, on the non-uniform grid
+    file_name, dose, __ = dose_files('dose.3ddose')
+    levels = [5e-13, 3e-14, 1e-12, 1e-11]
+    volumes = isodose_volumes(
+        DoseFile(file_name), levels, nz=nz, cache=False
+        )
+    assert numpy.allclose(
+        volumes, enclosed_volumes(dose, BOUNDS, levels), rtol=1e-12, atol=0
+        )
+
+
+def test_volumes_uniform():
+    bounds = [numpy.linspace(-1., 1., n + 1) for n in (6, 5, 9)]
+    dose, __ = synthetic_dose(bounds)
+    levels = [50, 100]
+    volumes = isodose_volumes(
+        DoseFile.from_arrays(bounds, dose), levels, reference=dose.mean()
+        )
+    assert numpy.allclose(
+        volumes,
+        enclosed_volumes(dose, bounds, dose_levels(levels, dose.mean())),
+        rtol=1e-12, atol=0
+        )
+
+
+def test_cached_volumes(dose_files, tmpdir, monkeypatch):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    cache_dir = str(tmpdir.mkdir('cache'))
+    levels = [1e-13, 5e-13]
+    expected = isodose_volumes(DoseFile(file_name), levels, cache_dir=cache_dir)
+    result_dir = _isodose_path(file_name, cache_dir)
+    assert len(listdir(result_dir)) == 1
+
+    # served from memory, then from disk, without streaming the dose
+    def no_slabs(*args, **kwargs):
+        raise AssertionError("the dose was read")
+    monkeypatch.setattr(DoseFile, 'iter_slabs', no_slabs)
+    for __ in range(2):
+        assert numpy.array_equal(
+            isodose_volumes(DoseFile(file_name), levels, cache_dir=cache_dir),
+            expected
+            )
+        clear_memory()
+    monkeypatch.undo()
+
+    # another scale is another result
+    scaled = DoseFile(file_name)
+    scaled *= 2.
+    assert numpy.allclose(
+        isodose_volumes(scaled, levels, cache_dir=cache_dir),
+        enclosed_volumes(2. * dose, BOUNDS, levels), rtol=1e-12, atol=0
+        )
+    assert len(listdir(result_dir)) == 2
+
+
+def test_memory_bounded(dose_files, monkeypatch):
+    monkeypatch.setattr(isodose, 'MAX_RESULTS', 2)
+    clear_memory()
+    file_name, __, __ = dose_files('dose.3ddose')
+    for level in (1e-13, 1e-12, 1e-11):
+        isodose_volumes(DoseFile(file_name), [level])
+    assert len(isodose._results) == 2
+
+
+def test_surfaces(dose_files):
+    pytest.importorskip('skimage')
+    file_name, dose, __ = dose_files('dose.3ddose')
+    (vertices, faces), (outside, no_faces) = isodose_surfaces(
+        DoseFile(file_name), [5e-13, 10 * dose.max()], cache=False
+        )
+    assert len(faces) and not len(outside) and not len(no_faces)
+    # within the voxel centres
+    for axis, bounds in enumerate(BOUNDS):
+        centres = (bounds[:-1] + bounds[1:]) / 2
+        assert centres[0] <= vertices[:, axis].min()
+        assert vertices[:, axis].max() <= centres[-1]
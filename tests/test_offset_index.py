@@ -0,0 +1,52 @@
+from __future__ import division
+
+from os.path import isfile
+
+import numpy
+import pytest
+
+import py3ddose
+from py3ddose import DoseFile, _index_path
+
+
+@pytest.mark.parametrize('name', ['dose.3ddose', 'dose.3ddose.gz'])
+def test_read_region(dose_files, name):
+    file_name, dose, uncertainty = dose_files(name)
+    streamed = DoseFile(file_name, load_dose=False)
+
+    assert numpy.array_equal(
+        streamed.read_region((2, 7), (1, 4), (3, 11)), dose[2:7, 1:4, 3:11]
+        )
+    assert numpy.array_equal(
+        streamed.read_region(None, (5, 6), (12, 14), uncertainty=True),
+        uncertainty[:, 5:6, 12:14]
+        )
+    assert numpy.array_equal(streamed.read_plane(1, 2), dose[:, 2, :])
+
+
+def test_persisted(dose_files, monkeypatch):
+    file_name, dose, uncertainty = dose_files('dose.3ddose.gz')
+    DoseFile(file_name, load_dose=False).read_region(z_range=(3, 4))
+    assert isfile(_index_path(file_name))
+
+    # a later run seeks through the stored index without scanning the file
+    def no_scan(*args, **kwargs):
+        raise AssertionError("the file was scanned")
+    monkeypatch.setattr(py3ddose, '_scan_offsets', no_scan)
+    assert numpy.array_equal(
+        DoseFile(file_name, load_dose=False).read_region(
+            (0, 2), None, (13, 14), uncertainty=True
+            ),
+        uncertainty[:2, :, 13:]
+        )
+
+
+def test_read_uncertainty(dose_files):
+    # the uncertainty block of a file loaded without it, read on demand
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    data = DoseFile(file_name, dtype=numpy.float32)
+    assert not hasattr(data, 'uncertainty')
+    assert numpy.array_equal(
+        data.read_uncertainty(), uncertainty.astype(numpy.float32)
+        )
+    assert data.uncertainty.dtype == numpy.float32
@@ -0,0 +1,47 @@
+from __future__ import division
+
+from io import BytesIO
+
+import numpy
+import pytest
+
+from conftest import BOUNDS
+from py3ddose import DoseFile, _ValueReader
+
+
+@pytest.mark.parametrize('name', ['dose.3ddose', 'dose.3ddose.gz'])
+def test_parse(dose_files, name):
+    file_name, dose, uncertainty = dose_files(name)
+    data = DoseFile(file_name, load_uncertainty=True)
+
+    assert data.shape == dose.shape == (8, 6, 14)
+    for positions, bounds in zip(data.positions, BOUNDS):
+        assert numpy.allclose(positions, bounds, rtol=0, atol=1e-12)
+    assert numpy.array_equal(data.dose, dose)
+    assert numpy.array_equal(data.uncertainty, uncertainty)
+
+
+def test_dose_only(dose_files):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    data = DoseFile(file_name)
+    assert numpy.array_equal(data.dose, dose)
+    assert not hasattr(data, 'uncertainty')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 13, 2 ** 22])
+def test_chunk_boundaries(chunk_size):
+    # numbers cut by a chunk boundary, and runs of whitespace
+    values = numpy.random.RandomState(0).uniform(-1, 1, 200) * 1e-13
+    text = b'\n'.join(
+        b'  '.join(b'%.4E' % v for v in row) for row in values.reshape(20, 10)
+        ) + b'\n\n'
+    reader = _ValueReader(BytesIO(text), chunk_size=chunk_size)
+
+    reader.skip(3)
+    assert numpy.array_equal(
+        reader.read(97), numpy.array([b'%.4E' % v for v in values[3:100]],
+            dtype=float)
+        )
+    assert reader.read(100, numpy.float32).dtype == numpy.float32
+    with pytest.raises(AssertionError):
+        reader.read(1)
@@ -0,0 +1,43 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from dose_basis import get_basis
+from plan_sweep import sweep_plans
+
+
+@pytest.fixture
+def basis(dose_files, tmpdir):
+    references = [
+        dose_files('reference_{0}.3ddose'.format(number), seed=number,
+            source=(0., 0., z))[0]
+        for number, z in enumerate(numpy.linspace(-1., 1., 4))
+        ]
+    return get_basis(references, str(tmpdir.join('basis')))
+
+
+@pytest.mark.parametrize('nz', [None, 3])
+def test_sweep_plans(basis, nz):
+    weights = numpy.array([[1.0, 0.5, 0.0, 2.0], [0.2, 0.2, 1.0, 0.0]])
+    points = [[0.45, 0.1, -0.5], [-1.2, 0.0, 1.5]]
+    max_dose, point_doses, volumes = sweep_plans(
+        basis, weights, points, levels=[50., 100.], reference=1e-12, nz=nz
+        )
+
+    widths = [numpy.diff(p) for p in basis.positions]
+    voxel_volumes = (
+        widths[0][:, None, None] * widths[1][None, :, None]
+        * widths[2][None, None, :]
+        )
+    for plan, plan_weights in enumerate(weights):
+        dose = basis.superpose(plan_weights, uncertainty=False)[0]
+        assert numpy.isclose(max_dose[plan], dose.max(), rtol=1e-6, atol=0)
+        for level, volume in zip([0.5e-12, 1e-12], volumes[plan]):
+            assert numpy.isclose(
+                volume, voxel_volumes[dose >= level].sum(), rtol=1e-6, atol=0
+                )
+        ix, iy, iz = basis.grid_index.voxel(*numpy.transpose(points))
+        assert numpy.allclose(
+            point_doses[plan], dose[ix, iy, iz], rtol=1e-6, atol=0
+            )
@@ -0,0 +1,106 @@
+from __future__ import division
+
+from os import stat, utime
+from os.path import isdir
+
+import numpy
+import pytest
+
+from conftest import BOUNDS, write_text_3ddose
+from py3ddose import DoseFile, _pyramid_path
+
+
+def block_reduce(dose, bounds, factor):
+    # volume weighted means and maxima of factor^3 blocks (partial at the
+    # far edges), by brute force
+    widths = [numpy.diff(b) for b in bounds]
+    volumes = (
+        widths[0][:, None, None] * widths[1][None, :, None]
+        * widths[2][None, None, :]
+        )
+    shape = [-(-n // factor) for n in dose.shape]
+    index = numpy.ix_(*[numpy.arange(n) // factor for n in dose.shape])
+    integral = numpy.zeros(shape)
+    volume = numpy.zeros(shape)
+    maximum = numpy.full(shape, -numpy.inf)
+    numpy.add.at(integral, index, dose * volumes)
+    numpy.add.at(volume, index, volumes)
+    numpy.maximum.at(maximum, index, dose)
+    return integral / volume, maximum
+
+
+@pytest.mark.parametrize('load_dose', [False, True])
+@pytest.mark.parametrize('factor', [2, 4, 8])
+def test_levels(dose_files, tmpdir, load_dose, factor):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    data = DoseFile(file_name, load_dose=load_dose)
+    cache_dir = str(tmpdir.mkdir('cache'))
+    mean, maximum = block_reduce(dose, BOUNDS, factor)
+
+    level = data.pyramid(factor, cache_dir=cache_dir)
+    assert level.shape == mean.shape
+    for p, b in zip(level.positions, data.positions):
+        # every factor-th bound and the last one
+        assert numpy.array_equal(p, numpy.append(b[:-1][::factor], b[-1]))
+    assert numpy.allclose(level.dose, mean, rtol=1e-12, atol=0)
+    # the integral dose is kept
+    assert numpy.isclose(
+        (level.dose * level.spacing[0][:, None, None]
+            * level.spacing[1][None, :, None]
+            * level.spacing[2][None, None, :]).sum(),
+        (dose * data.spacing[0][:, None, None] * data.spacing[1][None, :, None]
+            * data.spacing[2][None, None, :]).sum(),
+        rtol=1e-12, atol=0
+        )
+    assert numpy.array_equal(
+        data.pyramid(factor, 'max', cache_dir=cache_dir).dose, maximum
+        )
+
+
+def test_scale(dose_files, tmpdir):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    data = DoseFile(file_name)
+    data *= 3.
+    level = data.pyramid(2, 'max', cache_dir=str(tmpdir))
+    assert numpy.allclose(
+        level.read_region(), 3. * block_reduce(dose, BOUNDS, 2)[1],
+        rtol=1e-15, atol=0
+        )
+
+
+def test_persisted(dose_files, monkeypatch):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    expected = DoseFile(file_name, load_dose=False).pyramid(4).dose
+    assert isdir(_pyramid_path(file_name))
+
+    # a later run reads the stored levels
+    def no_build(*args):
+        raise AssertionError("the pyramid was rebuilt")
+    monkeypatch.setattr(DoseFile, '_build_pyramid', no_build)
+    assert numpy.array_equal(
+        DoseFile(file_name, load_dose=False).pyramid(4).dose, expected
+        )
+    monkeypatch.undo()
+
+    # and rebuilds them once the file changes
+    write_text_3ddose(file_name, BOUNDS, 2 * dose, uncertainty)
+    status = stat(file_name)
+    utime(file_name, (status.st_atime, status.st_mtime + 10))
+    assert numpy.allclose(
+        DoseFile(file_name, load_dose=False).pyramid(4).dose, 2 * expected,
+        rtol=1e-4
+        )
+
+
+@pytest.mark.parametrize('pixels, axis, factor', [
+    (12, 2, 2), (13, 2, 1), (4, 2, 4), (1, 2, 8), (2, None, 8), (21, 0, 2)
+    ])
+def test_preview(dose_files, tmpdir, pixels, axis, factor):
+    # the (8, 6, 14) grid gives (4, 3, 7), (2, 2, 4) and (1, 1, 2) levels
+    file_name, __, __ = dose_files('dose.3ddose')
+    data = DoseFile(file_name)
+    preview = data.preview(pixels, axis, cache_dir=str(tmpdir))
+    if factor == 1:
+        assert preview is data
+    else:
+        assert preview.shape == tuple(-(-n // factor) for n in data.shape)
@@ -0,0 +1,99 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from conftest import BOUNDS
+from interpolation import interpolate_grid
+from py3ddose import DoseFile
+
+# every other bound (each axis of BOUNDS has an even number of voxels), so
+# that each target voxel is two source voxels along each axis
+COARSE = [b[::2] for b in BOUNDS]
+
+
+def voxel_volumes(bounds):
+    widths = [numpy.diff(b) for b in bounds]
+    return (
+        widths[0][:, None, None] * widths[1][None, :, None]
+        * widths[2][None, None, :]
+        )
+
+
+@pytest.mark.parametrize('mode', ['volume', 'trilinear'])
+@pytest.mark.parametrize('nz', [None, 3])
+def test_same_grid(dose_files, mode, nz):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    resampled = DoseFile(file_name, load_dose=False).resample(
+        BOUNDS, mode, load_uncertainty=True, nz=nz
+        )
+    assert numpy.allclose(resampled.dose, dose, rtol=1e-12, atol=0)
+    assert numpy.allclose(
+        resampled.uncertainty, uncertainty, rtol=1e-12, atol=0
+        )
+
+
+@pytest.mark.parametrize('nz', [None, 1, 5])
+def test_volume_average(dose_files, nz):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    resampled = DoseFile(file_name, load_uncertainty=True).resample(
+        COARSE, load_uncertainty=True, nz=nz
+        )
+
+    # the volume weighted mean of the source voxels in each target voxel,
+    # and the uncertainty of that weighted sum
+    volumes = voxel_volumes(BOUNDS)
+    index = [b.searchsorted((s[:-1] + s[1:]) / 2) - 1
+        for b, s in zip(COARSE, BOUNDS)]
+    shape = resampled.shape
+    integral = numpy.zeros(shape)
+    variance = numpy.zeros(shape)
+    covered = numpy.zeros(shape)
+    numpy.add.at(integral, numpy.ix_(*index), dose * volumes)
+    numpy.add.at(variance, numpy.ix_(*index), (dose * uncertainty * volumes) ** 2)
+    numpy.add.at(covered, numpy.ix_(*index), volumes)
+
+    assert numpy.allclose(resampled.dose, integral / covered, rtol=1e-12, atol=0)
+    assert numpy.allclose(
+        resampled.uncertainty, numpy.sqrt(variance) / integral,
+        rtol=1e-12, atol=0
+        )
+    # the integral dose is conserved
+    assert numpy.isclose(
+        (resampled.dose * voxel_volumes(COARSE)).sum(),
+        (dose * volumes).sum(), rtol=1e-12, atol=0
+        )
+
+
+def test_trilinear(dose_files):
+    # matches the interpolation at the target voxel centres inside the grid
+    file_name, dose, __ = dose_files('dose.3ddose')
+    data = DoseFile(file_name)
+    target = [numpy.linspace(b[1], b[-2], 6) for b in BOUNDS]
+    resampled = data.resample(target, 'trilinear')
+    centres = [(t[:-1] + t[1:]) / 2 for t in target]
+    assert numpy.allclose(
+        resampled.dose, interpolate_grid(data, *centres, fill_value=None),
+        rtol=1e-12, atol=0
+        )
+
+
+@pytest.mark.parametrize('mode', ['volume', 'trilinear'])
+def test_outside(dose_files, mode):
+    file_name, __, __ = dose_files('dose.3ddose')
+    target = [numpy.concatenate((b, [b[-1] + 1., b[-1] + 2.])) for b in BOUNDS]
+    resampled = DoseFile(file_name).resample(
+        target, mode, load_uncertainty=True, fill_value=-1.
+        )
+    outside = numpy.zeros(resampled.shape, dtype=bool)
+    # the two voxels added beyond each axis
+    outside[-2:], outside[:, -2:], outside[:, :, -2:] = True, True, True
+    assert (resampled.dose[outside] == -1.).all()
+    assert (resampled.uncertainty[outside] == 0.).all()
+    assert (resampled.dose[~outside] > 0.).all()
+
+
+def test_unknown_mode(dose_files):
+    file_name, __, __ = dose_files('dose.3ddose')
+    with pytest.raises(ValueError):
+        DoseFile(file_name).resample(BOUNDS, 'nearest')
@@ -0,0 +1,71 @@
+from __future__ import division
+
+from os import stat, utime
+from os.path import isfile, join
+
+import numpy
+import pytest
+
+from conftest import BOUNDS, write_text_3ddose
+from py3ddose import DoseFile, _cache_path
+
+
+def no_parse(*args, **kwargs):
+    raise AssertionError("the text was parsed")
+
+
+@pytest.mark.parametrize('cache_dir', [False, True])
+def test_memory_mapped(dose_files, tmpdir, monkeypatch, cache_dir):
+    file_name, dose, uncertainty = dose_files('dose.3ddose.gz')
+    cache_dir = str(tmpdir.mkdir('cache')) if cache_dir else None
+    first = DoseFile(
+        file_name, load_uncertainty=True, cache=True, cache_dir=cache_dir
+        )
+    assert isfile(join(_cache_path(file_name, cache_dir), 'header.json'))
+
+    monkeypatch.setattr(DoseFile, '_load_3ddose', no_parse)
+    cached = DoseFile(
+        file_name, load_uncertainty=True, cache=True, cache_dir=cache_dir
+        )
+    assert isinstance(cached.dose, numpy.memmap)
+    assert numpy.array_equal(cached.dose, dose)
+    assert numpy.array_equal(cached.uncertainty, uncertainty)
+    for p, q in zip(cached.positions, first.positions):
+        assert numpy.array_equal(p, q)
+
+    # copy on write: scaling in place leaves the cache as it was
+    cached.dose *= 2
+    assert numpy.array_equal(
+        DoseFile(file_name, cache=True, cache_dir=cache_dir).dose, dose
+        )
+
+    # float32 from the float64 cache
+    single = DoseFile(
+        file_name, cache=True, cache_dir=cache_dir, dtype=numpy.float32
+        )
+    assert single.dose.dtype == numpy.float32
+    assert numpy.allclose(single.dose, dose, rtol=1e-7, atol=0)
+
+
+def test_reparsed(dose_files, monkeypatch):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    DoseFile(file_name, cache=True)
+
+    # a cache without the uncertainty cannot serve it
+    data = DoseFile(file_name, load_uncertainty=True, cache=True)
+    assert numpy.array_equal(data.uncertainty, uncertainty)
+
+    # nor a changed file
+    write_text_3ddose(file_name, BOUNDS, 2 * dose, uncertainty)
+    status = stat(file_name)
+    utime(file_name, (status.st_atime, status.st_mtime + 10))
+    assert numpy.allclose(
+        DoseFile(file_name, load_uncertainty=True, cache=True).dose, 2 * dose,
+        rtol=1e-4
+        )
+
+    # a cache with the uncertainty serves the dose alone
+    monkeypatch.setattr(DoseFile, '_load_3ddose', no_parse)
+    assert numpy.allclose(
+        DoseFile(file_name, cache=True).dose, 2 * dose, rtol=1e-4
+        )
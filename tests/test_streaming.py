@@ -0,0 +1,41 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from py3ddose import DoseFile
+
+
+@pytest.mark.parametrize('name', ['dose.3ddose', 'dose.3ddose.gz'])
+def test_iter_slabs(dose_files, name):
+    file_name, dose, uncertainty = dose_files(name)
+    streamed = DoseFile(file_name, load_dose=False)
+    assert streamed.shape == dose.shape
+    assert not hasattr(streamed, 'dose')
+
+    slabs = list(streamed.iter_slabs(4, load_uncertainty=True))
+    assert [slab[0] for slab in slabs] == [0, 4, 8, 12]
+    assert numpy.array_equal(
+        numpy.concatenate([slab[1] for slab in slabs], axis=2), dose
+        )
+    assert numpy.array_equal(
+        numpy.concatenate([slab[2] for slab in slabs], axis=2), uncertainty
+        )
+
+
+@pytest.mark.parametrize('nz', [1, 5, 14, 20])
+def test_streamed_reductions(dose_files, nz):
+    # the slab by slab reductions match those of the loaded dose, with the
+    # lazy scale applied
+    file_name, dose, __ = dose_files('dose.3ddose')
+    streamed = DoseFile(file_name, load_dose=False)
+    streamed *= 2.
+
+    assert streamed.max(nz) == 2. * dose.max()
+    assert streamed.min(nz) == 2. * dose.min()
+    counts, edges = streamed.histogram(bins=50, nz=nz)
+    expected_counts, expected_edges = numpy.histogram(2. * dose, bins=50)
+    assert numpy.allclose(edges, expected_edges, rtol=1e-12, atol=0)
+    # bin edges may differ in the last bit from numpy's
+    assert abs(counts - expected_counts).sum() <= 2
+    assert counts.sum() == dose.size
@@ -0,0 +1,106 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from conftest import BOUNDS, write_text_3ddose
+from py3ddose import DoseFile
+from superposition import superpose
+
+
+def superposed(references, weights):
+    # the weighted sum of the doses and the quadrature sum of the absolute
+    # uncertainties w_i * r_i * D_i
+    dose = sum(w * d for w, (__, d, __) in zip(weights, references))
+    variance = sum(
+        (w * r * d) ** 2 for w, (__, d, r) in zip(weights, references)
+        )
+    return dose, numpy.sqrt(variance)
+
+
+@pytest.fixture
+def references(dose_files):
+    return [
+        dose_files('reference_{0}.3ddose'.format(number), seed=number,
+            source=(0., 0., z))
+        for number, z in enumerate(numpy.linspace(-1., 1., 5))
+        ]
+
+
+@pytest.mark.parametrize('dtype, tolerance', [
+    (numpy.float64, 1e-12), (numpy.float32, 1e-6)
+    ])
+def test_superpose(references, dtype, tolerance):
+    weights = numpy.linspace(0.3, 1.0, len(references))
+    dose, uncertainty = superposed(references, weights)
+
+    result, result_uncertainty, positions = superpose(
+        [reference[0] for reference in references], weights, dtype=dtype,
+        nz=4
+        )
+    assert result.dtype == dtype
+    assert [len(p) - 1 for p in positions] == list(dose.shape)
+    assert abs(result - dose).max() <= tolerance * dose.max()
+    assert abs(result_uncertainty - uncertainty).max() <= (
+        tolerance * uncertainty.max()
+        )
+    # the uncertainty is small next to the dose, so an aliased accumulator
+    # would fail the checks above
+    assert uncertainty.max() < 0.5 * dose.max()
+
+
+def test_superpose_without_uncertainty(references):
+    weights = [1.0, 0.0, 2.5, 0.5, 1.0]
+    dose, __ = superposed(references, weights)
+
+    result, result_uncertainty, __ = superpose(
+        [reference[0] for reference in references], weights,
+        uncertainty=False
+        )
+    assert result_uncertainty is None
+    assert numpy.allclose(result, dose, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('processes', [2, None])
+def test_superpose_pooled(references, processes):
+    # the files parsed in a process pool, adding into shared memory
+    weights = numpy.linspace(0.3, 1.0, len(references))
+    dose, uncertainty = superposed(references, weights)
+
+    result, result_uncertainty, __ = superpose(
+        [reference[0] for reference in references], weights, nz=4,
+        processes=processes
+        )
+    assert abs(result - dose).max() <= 1e-12 * dose.max()
+    assert abs(result_uncertainty - uncertainty).max() <= (
+        1e-12 * uncertainty.max()
+        )
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_superpose_float32_small_doses(dose_files, tmpdir, processes):
+    # the squared absolute uncertainties of doses per history of 1e-19 are
+    # below the smallest float32, so they are summed in float64
+    file_names = []
+    for number in range(2):
+        file_name, dose, uncertainty = dose_files(
+            'reference_{0}.3ddose'.format(number), seed=number
+            )
+        small_name = str(tmpdir.join('small_{0}.3ddose'.format(number)))
+        write_text_3ddose(small_name, BOUNDS, dose * 1e-6, uncertainty)
+        file_names.append(small_name)
+    references = [
+        (None, reference.dose, reference.uncertainty) for reference in [
+            DoseFile(file_name, load_uncertainty=True)
+            for file_name in file_names
+            ]
+        ]
+    assert max(reference[1].max() for reference in references) < 1e-17
+    dose, uncertainty = superposed(references, [0.5, 0.5])
+
+    result, result_uncertainty, __ = superpose(
+        file_names, [0.5, 0.5], dtype=numpy.float32, processes=processes
+        )
+    assert result_uncertainty.dtype == numpy.float32
+    assert result_uncertainty.all()
+    assert numpy.allclose(result_uncertainty, uncertainty, rtol=1e-6, atol=0)
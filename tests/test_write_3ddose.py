@@ -0,0 +1,95 @@
+from __future__ import division
+
+import numpy
+import pytest
+
+from py3ddose import DoseFile, _format_scientific
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_write_round_trip(dose_files, tmpdir, compress):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    out_name = str(tmpdir.join('out.3ddose' + ('.gz' if compress else '')))
+    DoseFile(file_name, load_uncertainty=True).write_3ddose(
+        out_name, compress=compress, nz=3
+        )
+
+    written = DoseFile(out_name, load_uncertainty=True)
+    assert numpy.array_equal(written.dose, dose)
+    assert numpy.array_equal(written.uncertainty, uncertainty)
+
+
+@pytest.mark.parametrize('load_dose', [False, True])
+def test_write_streams_uncertainty(dose_files, tmpdir, load_dose):
+    # the uncertainty block of the source is kept when it is not loaded
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    out_name = str(tmpdir.join('out.3ddose'))
+    DoseFile(file_name, load_dose=load_dose).write_3ddose(
+        out_name, compress=False
+        )
+
+    written = DoseFile(out_name, load_uncertainty=True)
+    assert numpy.array_equal(written.dose, dose)
+    assert numpy.array_equal(written.uncertainty, uncertainty)
+
+
+def test_write_without_uncertainty(dose_files, tmpdir):
+    file_name, dose, __ = dose_files('dose.3ddose')
+    grid = DoseFile.from_arrays(DoseFile(file_name).positions, dose)
+    out_name = str(tmpdir.join('out.3ddose'))
+
+    with pytest.raises(ValueError):
+        grid.write_3ddose(out_name, compress=False)
+
+    grid.write_3ddose(out_name, compress=False, uncertainty=False)
+    written = DoseFile(out_name, load_uncertainty=True)
+    assert numpy.array_equal(written.dose, dose)
+    assert not written.uncertainty.any()
+
+
+def test_format_scientific_matches_printf():
+    random = numpy.random.RandomState(0)
+    values = 10 ** random.uniform(-300, 300, 10000) * random.choice(
+        [-1, 1], 10000
+        )
+    values[:3] = 0., 1., -1e-5
+
+    text = _format_scientific(values, line_length=7).decode('ascii')
+    # the field holds three exponent digits here
+    for formatted, value in zip(text.split(), values):
+        assert float(formatted) == float('%.4E' % value)
+    assert set(len(line) for line in text.split('\n')[:-2]) == {7 * 13 - 1}
+
+
+def test_format_scientific_non_finite():
+    values = numpy.array([
+        1.5, numpy.nan, -numpy.inf, numpy.inf, 5e-324, -1e-310, 2.5e-308
+        ])
+    text = _format_scientific(values)
+
+    # nan does not widen the exponent of the others; the subnormals are
+    # flushed to zero and 2.5e-308 is the smallest exponent
+    assert text.split() == [
+        b'1.5000E+000', b'NAN', b'-INF', b'INF', b'0.0000E+000',
+        b'-0.0000E+000', b'2.5000E-308'
+        ]
+    assert len(text) == 13 * len(values)
+    assert _format_scientific(values[:4]).split() == [
+        b'1.5000E+00', b'NAN', b'-INF', b'INF'
+        ]
+
+
+def test_write_non_finite(dose_files, tmpdir):
+    file_name, dose, uncertainty = dose_files('dose.3ddose')
+    dose = dose.copy()
+    dose[1, 2, 3] = numpy.nan
+    dose[4, 0, 13] = numpy.inf
+    grid = DoseFile.from_arrays(
+        DoseFile(file_name).positions, dose, uncertainty
+        )
+    out_name = str(tmpdir.join('out.3ddose'))
+    grid.write_3ddose(out_name, compress=False)
+
+    written = DoseFile(out_name, load_uncertainty=True)
+    assert numpy.array_equal(written.dose, dose, equal_nan=True)
+    assert numpy.array_equal(written.uncertainty, uncertainty)